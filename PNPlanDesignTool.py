@@ -4,6 +4,14 @@
 '''
 
 import os
+import multiprocessing
+from copy import deepcopy
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import Queue
 
 import Tkinter as tk
 import ttk
@@ -12,15 +20,248 @@ import tkFont
 import tkMessageBox
 
 import zipfile
-import tempfile
+
+import journal
 
 from gui.tabmanager import TabManager
 from gui.pneditors import DexecPNEditor,\
     FinalizationPNEditor, CancelationPNEditor, RulePNEditor
 from gui.auxdialogs import InputDialog, CopyTextDialog
 from nodes import FactPlace
+from pnmlcache import PNMLCache
+import projectdb
+from settings import PNML_CACHE_DIR, PNML_CACHE_MAX_SIZE, RELEASE_PNML_TREES, INCREMENTAL_SAVE, SAVE_PROCESSES, LAZY_OPEN,\
+    JOURNAL_INTERVAL, JOURNAL_COMPACT_SIZE, DEDUPLICATE_NETS, BACKGROUND_OPEN, OPEN_POLL_INTERVAL
 from StringIO import StringIO
 
+def _copy_zip_member(src_zip, zinfo, dst_zip):
+    """Writes a member of a zip file opened for reading again to a zip file opened for writing, with writestr.
+    
+    The contents are read (i. e. decompressed) and written with the name, date and compression type of the member,
+    they are not copied as raw compressed data. Project and task files store their members without compression,
+    so the members are written stored, as they were read.
+    """
+    
+    # A new ZipInfo is written, since writestr sets the offset of the member in the zip file it is written to.
+    new_info = zipfile.ZipInfo(zinfo.filename, zinfo.date_time)
+    new_info.compress_type = zinfo.compress_type
+    new_info.external_attr = zinfo.external_attr
+    dst_zip.writestr(new_info, src_zip.read(zinfo))
+
+# Entries read by the worker thread that opens a project, which the Tk thread adds to the project tree (see PNPDT._open_project):
+#     (_OPEN_TOTAL, count) -- Number of _OPEN_STEP entries that follow, to show the progress.
+#     (_OPEN_TASK, task_name) -- A task.
+#     (_OPEN_NET, folder, unloaded, pn, key) -- A Petri Net to add to a folder of the project tree, with its contents (see _UnloadedPetriNet),
+#         the Petri Net read from them or None if it is opened lazily, and the key it is stored under (see PNPDT._get_content_key) or None.
+#     (_OPEN_STEP,) -- A task or generic rule was read.
+#     (_OPEN_DONE,) -- The whole project was read.
+#     (_OPEN_ERROR, exception) -- The project could not be read.
+_OPEN_TOTAL = 'total'
+_OPEN_TASK = 'task'
+_OPEN_NET = 'net'
+_OPEN_STEP = 'step'
+_OPEN_DONE = 'done'
+_OPEN_ERROR = 'error'
+
+class _ProjectOpening(object):
+    """State of a project that is being opened (see PNPDT._open_project)."""
+    
+    def __init__(self):
+        super(_ProjectOpening, self).__init__()
+        
+        # Entries read by the worker thread, and the event that stops it when opening the project is canceled.
+        self.queue = Queue.Queue()
+        self.canceled = threading.Event()
+        
+        self.steps = 0
+        self.total = 0
+        self.tasks_count = 0
+        self.pn_count = 0
+
+class _UnloadedPetriNet(object):
+    """Contents of a Petri Net of an opened project, which is not read until it is needed (see _VirtualPNEditor)."""
+    
+    def __init__(self, PNEditorClass, pnml_data, snapshot, task, name):
+        """
+        Positional Arguments:
+        PNEditorClass -- Class of the editor to open the Petri Net with.
+        pnml_data -- Contents of the PNML file of the Petri Net.
+        snapshot -- Snapshot saved along with the PNML file, or None.
+        task -- Task name for planning rules, or None.
+        name -- Name of the Petri Net.
+        """
+        
+        self.PNEditorClass = PNEditorClass
+        self.pnml_data = pnml_data
+        self.snapshot = snapshot
+        self.task = task
+        self.name = name
+
+class _VirtualPNEditor(object):
+    """Stands in for the editor of a Petri Net in PNPDT.petri_nets until its tab is opened (see PNPDT._get_pne).
+    
+    Only keeps the Petri Net, which is read the first time it is needed if it was opened lazily,
+    so that no canvas is created nor drawn for the rules that are never shown.
+    """
+    
+    def __init__(self, PNEditorClass, PetriNet = None, unloaded = None, loader = None):
+        """
+        Positional Arguments:
+        PNEditorClass -- Class of the editor to create when the tab is opened.
+        
+        Keyword Arguments:
+        PetriNet -- Petri Net object, if it was already read.
+        unloaded -- _UnloadedPetriNet object, if it was not.
+        loader -- Function that reads the Petri Net of an _UnloadedPetriNet object.
+        """
+        
+        if PetriNet is None and unloaded is None:
+            raise Exception('Either a PetriNet object or its unloaded contents must be passed to the virtual editor.')
+        
+        self.PNEditorClass = PNEditorClass
+        self.edited = False
+        self.mutations = []
+        self._pn = PetriNet
+        self._unloaded = unloaded
+        self._loader = loader
+    
+    @property
+    def unloaded(self):
+        """Read-only property. _UnloadedPetriNet object, or None if the Petri Net was already read."""
+        return self._unloaded
+    
+    @property
+    def _petri_net(self):
+        if self._pn is None:
+            self._pn = self._loader(self._unloaded)
+            self._unloaded = None
+            self._loader = None
+        return self._pn
+    
+    @property
+    def petri_net(self):
+        """Read-only property. Deepcopy of the petri net object."""
+        return deepcopy(self._petri_net)
+    
+    @property
+    def name(self):
+        if self._pn is None:
+            return self._unloaded.name
+        return self._pn.name
+    
+    def set_pn_task(self, val):
+        self._petri_net.task = val
+
+def _serialize_petri_net(pn):
+    """Returns the PNML contents of a Petri Net and the snapshot saved along with them (or None).
+    
+    Petri Nets that were not read yet are saved as they were opened.
+    """
+    
+    if isinstance(pn, _UnloadedPetriNet):
+        return pn.pnml_data, pn.snapshot
+    
+    pnml_data = pn.to_pnml_string()
+    return pnml_data, pn.to_snapshot(pnml_data)
+
+def _build_task_data(task_name, petri_nets):
+    """Returns the contents of a task file, built in memory.
+    
+    Positional Arguments:
+    task_name -- Contents of the task_name.txt file.
+    petri_nets -- List of (path_name, PetriNet) tuples with the rules of the task
+                  (see _serialize_petri_net).
+    """
+    
+    buf = StringIO()
+    zip_file = zipfile.ZipFile(buf, "w")
+    
+    zip_file.writestr('task_name.txt', task_name)
+    
+    for path_name, pn in petri_nets:
+        pnml_data, snapshot = _serialize_petri_net(pn)
+        zip_file.writestr(path_name, pnml_data)
+        if snapshot is not None:
+            zip_file.writestr(PNPDT.SNAPSHOTS_FOLDER + path_name + '.snp', snapshot)
+    
+    zip_file.close()
+    
+    return buf.getvalue()
+
+def _build_task_refs(task_name, refs):
+    """Returns the contents of a task file within a project file whose Petri Nets are stored apart (see PNPDT.NETS_FOLDER).
+    
+    Positional Arguments:
+    task_name -- Contents of the task_name.txt file.
+    refs -- List of (path_name, key) tuples with the rules of the task and the keys of their Petri Nets,
+            which are written to path_name + '.ref' files.
+    """
+    
+    buf = StringIO()
+    zip_file = zipfile.ZipFile(buf, "w")
+    
+    zip_file.writestr('task_name.txt', task_name)
+    for path_name, key in refs:
+        zip_file.writestr(path_name + '.ref', key)
+    
+    zip_file.close()
+    
+    return buf.getvalue()
+
+def _run_job(job):
+    function, args = job
+    try:
+        return function(*args), None
+    except Exception as e:
+        return None, e
+
+# Jobs run by the processes of the pool in _run_jobs, which inherit them when they are forked.
+_forked_jobs = None
+
+def _run_forked_job(index):
+    result, error = _run_job(_forked_jobs[index])
+    if error is not None:
+        # Exceptions are sent back to the parent pickled, which not all of them can be.
+        error = Exception(str(error))
+    return result, error
+
+def _run_jobs(jobs, processes):
+    """Runs a list of (function, args) jobs, in a pool of processes if there are several of them,
+    and returns a list of (result, exception) tuples in the same order as the jobs.
+    
+    Serializing Petri Nets is mostly done in Python code, which threads could not run in parallel (see benchmark.py --save).
+    The processes are forked, so that the jobs do not need to be pickled (only their results are),
+    and the jobs are run in this process where fork is not available.
+    """
+    
+    global _forked_jobs
+    
+    if processes < 2 or len(jobs) < 2 or not hasattr(os, 'fork'):
+        return map(_run_job, jobs)
+    
+    _forked_jobs = jobs
+    try:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            return pool.map(_run_forked_job, range(len(jobs)), chunksize = 1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        _forked_jobs = None
+
+def _replace_file(src, dst):
+    """Moves file src over file dst, atomically where the platform allows it."""
+    
+    if os.path.exists(dst):
+        shutil.copymode(dst, src)
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows does not rename over existing files.
+        os.remove(dst)
+        os.rename(src, dst)
+
 class PNPDT(object):
     
     WORKSPACE_WIDTH = 600
@@ -28,6 +269,25 @@ class PNPDT(object):
     
     EXPLORER_WIDTH = 400
     
+    # Binary snapshots of the Petri Nets are saved in this folder of .pnpdt and .tsk files,
+    # next to the PNML files, which are still read if a snapshot is missing or stale.
+    SNAPSHOTS_FOLDER = 'Snapshots/'
+    
+    # Folder of project files where each Petri Net is stored once, as <key>.pnml (see _get_content_key),
+    # when identical nets are deduplicated. Tasks and generic rules refer to them with .ref files that contain their keys.
+    NETS_FOLDER = 'Nets/'
+    
+    # Folders of the rules of a task in the project tree (and in project directories), and their editor classes,
+    # by kind of rule in project databases.
+    _RULE_FOLDERS = {
+                              projectdb.DEXEC : ('Dexec_Rules/', DexecPNEditor),
+                              projectdb.FINALIZING : ('Finalizing_Rules/', FinalizationPNEditor),
+                              projectdb.CANCELING : ('Canceling_Rules/', CancelationPNEditor)
+                              }
+    
+    # Editor classes by name, as they are written in the journal.
+    _EDITOR_CLASSES = dict((cls.__name__, cls) for cls in [RulePNEditor, DexecPNEditor, FinalizationPNEditor, CancelationPNEditor])
+    
     def __init__(self):
         super(PNPDT, self).__init__()
         
@@ -55,13 +315,23 @@ class PNPDT(object):
         
         self.status_bar = tk.Frame(self.root, height = 20)
         self.status_bar.grid(row = 2, columnspan=3, sticky = tk.EW)
+        self.status_bar.columnconfigure(0, weight = 1)
         
         self.status_var = tk.StringVar()
         self.status_var.set('Ready.')
         
-        self.status_label = tk.Label(self.status_bar, textvariable = self.status_var)
+        self.status_label = tk.Label(self.status_bar, textvariable = self.status_var, anchor = tk.W)
         self.status_label.grid(row = 0, column = 0, sticky = tk.EW)
         
+        # Progress of the project being opened, only shown while it is read (see _open_project).
+        self.open_progress = ttk.Progressbar(self.status_bar, orient = tk.HORIZONTAL, length = 200, mode = 'determinate')
+        self.open_progress.grid(row = 0, column = 1, padx = 5)
+        self.open_progress.grid_remove()
+        
+        self.cancel_open_button = tk.Button(self.status_bar, text = 'Cancel', command = self.cancel_open)
+        self.cancel_open_button.grid(row = 0, column = 2)
+        self.cancel_open_button.grid_remove()
+        
         self.project_tree = ttk.Treeview(self.project_frame, height = int((PNPDT.WORKSPACE_HEIGHT - 20)/20), selectmode = 'browse')
         self.project_tree.heading('#0', text='Project Explorer', anchor=tk.W)
         self.project_tree.grid(row = 0, column = 0, sticky = tk.NSEW)
@@ -92,8 +362,11 @@ class PNPDT(object):
         
         file_menu = tk.Menu(menubar, tearoff = False)
         file_menu.add_command(label = 'Open', command = self.open)
+        file_menu.add_command(label = 'Open Directory...', command = self.open_directory)
+        file_menu.add_command(label = 'Refresh', command = self.refresh, accelerator = 'F5')
         file_menu.add_command(label="Save", command = self.save, accelerator = 'Ctrl+s')
         file_menu.add_command(label="Save As...", command = self.save_as)
+        file_menu.add_command(label="Save As Directory...", command = self.save_as_directory)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command = self.exit, accelerator = 'Ctrl+q', foreground = 'red', activeforeground = 'white', activebackground = 'red')
         
@@ -108,9 +381,44 @@ class PNPDT(object):
         self.root.config(menu = menubar)
         
         self.popped_up_menu = None
+        # Editors of the Petri Nets by tree item, which are _VirtualPNEditor objects until their tab is opened.
         self.petri_nets = {}
         self.file_path = None
         
+        # Project file the nets were last opened from or saved to, and the tree items each of its members
+        # was built from (see _get_project_members), to copy unchanged members on incremental saves.
+        self._saved_file_path = None
+        self._saved_members = {}
+        # Modification time and size of the PNML files of a project directory, by path relative to it,
+        # as they were last read or written, and the names of the tasks in it (see refresh).
+        self._directory_files = {}
+        self._directory_tasks = set()
+        # Keys the Petri Nets were last stored under in the project file, by tree item (see _get_content_key).
+        self._content_keys = {}
+        # Project being read by the worker thread, or None (see _open_project).
+        self._opening = None
+        
+        # Journal of the edits made since the project was opened or saved, and the tree items of the Petri Nets
+        # that were added, renamed or moved since they were last written to it (see _update_journal).
+        self.edit_journal = None
+        self._journal_pending = set()
+        if JOURNAL_INTERVAL:
+            self.root.after(int(JOURNAL_INTERVAL*1000), self._update_journal)
+        
+        self.save_processes = SAVE_PROCESSES
+        if not self.save_processes:
+            try:
+                self.save_processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                self.save_processes = 1
+        
+        self.pnml_cache = None
+        if PNML_CACHE_DIR:
+            try:
+                self.pnml_cache = PNMLCache(os.path.expanduser(PNML_CACHE_DIR), PNML_CACHE_MAX_SIZE)
+            except Exception as e:
+                print 'WARNING: PNML cache could not be created - ' + str(e)
+        
         self.tasks_folder_menu = tk.Menu(self.root, tearoff = 0)
         self.tasks_folder_menu.add_command(label = 'Add Task', command = self.create_task)
         self.tasks_folder_menu.add_command(label = 'Import Task', command = self.import_task)
@@ -169,6 +477,7 @@ class PNPDT(object):
         self.project_tree.tag_bind('petri_net', '<Double-1>', self.open_callback)
         self.root.bind('<Button-1>', self._hide_menu)
         self.root.bind('<Control-s>', self.save)
+        self.root.bind('<F5>', self.refresh)
         self.root.bind('<Control-q>', self.exit)
     
     
@@ -347,6 +656,8 @@ class PNPDT(object):
             tkMessageBox.showerror('ERROR', 'A Task could not be inserted in the selected node, possible duplicate name.\n\n' + str(e))
             return None
         
+        self._journal_record(journal.TASK, item_id)
+        
         return item_id
     
     def delete_task(self):
@@ -357,6 +668,8 @@ class PNPDT(object):
             for pn in self.project_tree.get_children(folder):
                 self.delete_petri_net(pn)
         self.project_tree.delete(item_id)
+        
+        self._journal_record(journal.REMOVE_TASK, item_id)
     
     def create_generic_pn(self):
         self.create_petri_net(PNEditorClass = RulePNEditor)
@@ -370,6 +683,62 @@ class PNPDT(object):
     def create_canceling(self):
         self.create_petri_net(PNEditorClass = CancelationPNEditor)
     
+    def _get_petri_net_tags(self, folder):
+        """Returns the tags for a Petri Net item in a folder of the project tree."""
+        
+        item_tags = list(self.project_tree.item(folder, "tags")) + ['petri_net']
+        item_tags.remove('folder')
+        try:
+            item_tags.remove('top_level')
+        except:
+            pass
+        try:
+            item_tags.remove('dexec_folder')
+        except:
+            try:
+                item_tags.remove('finalizing_folder')
+            except:
+                try:
+                    item_tags.remove('canceling_folder')
+                except:
+                    try:
+                        item_tags.remove('rules_folder')
+                    except:
+                        pass
+        return item_tags
+    
+    def _add_virtual_pne(self, PNEditorClass, PetriNet = None, unloaded = None):
+        """Adds a Petri Net to the selected folder of the project tree, without creating its editor (see _VirtualPNEditor).
+        
+        Returns the virtual editor, or None if it could not be added.
+        """
+        
+        pne = _VirtualPNEditor(PNEditorClass, PetriNet = PetriNet, unloaded = unloaded, loader = self._load_unloaded_petri_net)
+        if self.create_petri_net(pne) is None:
+            return None
+        pne.edited = False
+        return pne
+    
+    def _get_pne(self, item_id):
+        """Returns the editor of a Petri Net in the project tree, creating it if it is still a virtual one."""
+        
+        pne = self.petri_nets[item_id]
+        if not isinstance(pne, _VirtualPNEditor):
+            return pne
+        
+        edited = pne.edited
+        pne = self._add_pne(item_id, pne.PNEditorClass, PetriNet = pne._petri_net, open_tab = False)
+        pne.edited = edited
+        return pne
+    
+    def _get_petri_net(self, item_id):
+        """Returns the Petri Net of an item in the project tree to be saved, which is not read if it was not read yet."""
+        
+        pne = self.petri_nets[item_id]
+        if isinstance(pne, _VirtualPNEditor) and pne.unloaded is not None:
+            return pne.unloaded
+        return pne._petri_net
+    
     def create_petri_net(self, pne_object = None, PNEditorClass = RulePNEditor):
         
         if pne_object:
@@ -397,25 +766,7 @@ class PNPDT(object):
             tkMessageBox.showerror('ERROR', 'There is already a petri net with that name.')
             return
         
-        item_tags = list(self.project_tree.item(self.clicked_element, "tags")) + ['petri_net']
-        item_tags.remove('folder')
-        try:
-            item_tags.remove('top_level')
-        except:
-            pass
-        try:
-            item_tags.remove('dexec_folder')
-        except:
-            try:
-                item_tags.remove('finalizing_folder')
-            except:
-                try:
-                    item_tags.remove('canceling_folder')
-                except:
-                    try:
-                        item_tags.remove('rules_folder')
-                    except:
-                        pass
+        item_tags = self._get_petri_net_tags(self.clicked_element)
         
         try:
             if pne_object:
@@ -435,6 +786,11 @@ class PNPDT(object):
             del self.petri_nets[item_id]
             tkMessageBox.showerror('ERROR', 'The Petri Net could not be inserted in the selected node, possible duplicate name.\n\n' + str(e))
             return
+        
+        if self.edit_journal is not None:
+            self._journal_pending.add(item_id)
+        
+        return item_id
     
     def rename_task(self):
         
@@ -473,6 +829,8 @@ class PNPDT(object):
                     self.open_petri_net(pne)
         
         self.project_tree.delete(old_id)
+        
+        self._journal_record(journal.REMOVE_TASK, old_id)
     
     def open_callback(self, event):
         self.clicked_element = self.project_tree.identify('row', event.x, event.y)
@@ -480,7 +838,11 @@ class PNPDT(object):
     
     def open_petri_net(self, pne = None):
         if pne is None:
-            pne = self.petri_nets[self.clicked_element]
+            try:
+                pne = self._get_pne(self.clicked_element)
+            except Exception as e:
+                tkMessageBox.showerror('Error loading PetriNet.', 'An error occurred while loading the PetriNet object.\n\n' + str(e))
+                return
         try:
             self.tab_manager.add(pne, text = pne.name)
         except:
@@ -501,58 +863,137 @@ class PNPDT(object):
         self._import_task(zip_filename)
     
     def _import_task(self, zip_filename):
+        """Imports a task from a task file, given by its name or as a file-like object."""
+        
+        task_name = None
+        for entry in self._read_task_entries(zip_filename, lazy = False):
+            if entry[0] == _OPEN_TASK:
+                task_name = entry[1]
+            pne = self._add_open_entry(entry)
+            if entry[0] == _OPEN_NET and pne is not None:
+                # Imported rules are not saved in the project yet.
+                pne.edited = True
+                if self.edit_journal is not None:
+                    self._journal_pending.add(entry[1] + entry[2].name)
+        
+        self._update_state_bar('Imported task: ' + task_name)
+    
+    def _read_task_entries(self, zip_filename, lazy, read_shared_net = None):
+        """Yields the entries of a task and its rules (see _OPEN_TASK and _OPEN_NET), from a task file
+        given by its name or as a file-like object. It does not use any widgets, so it can run in a worker thread.
+        
+        The rules are read from the zip file in memory. If lazy is True, they are not read
+        until they are needed (see _VirtualPNEditor).
+        
+        Task files within project files may refer to Petri Nets stored apart (see NETS_FOLDER),
+        which are read with read_shared_net(key), returning their PNML contents and snapshot.
+        """
         
         zip_file = zipfile.ZipFile(zip_filename, 'r')
+        try:
+            task_name = zip_file.read('task_name.txt').strip()
+            yield (_OPEN_TASK, task_name)
+            task_id = 'Tasks/' + task_name + '/'
+            
+            # Create content from files in each folder
+            for x in zip_file.infolist():
+                
+                file_name = x.filename
+                PNEditorClass = None
+                
+                if file_name[:12] == 'Dexec_Rules/':
+                    file_name = file_name[12:file_name.find('.')]
+                    PNEditorClass = DexecPNEditor
+                    folder = task_id + 'Dexec_Rules/'
+                elif file_name[:17] == 'Finalizing_Rules/':
+                    file_name = file_name[17:file_name.find('.')]
+                    PNEditorClass = FinalizationPNEditor
+                    folder = task_id + 'Finalizing_Rules/'
+                elif file_name[:16] == 'Canceling_Rules/':
+                    file_name = file_name[16:file_name.find('.')]
+                    PNEditorClass = CancelationPNEditor
+                    folder = task_id + 'Canceling_Rules/'
+                
+                if PNEditorClass is None or not file_name:
+                    continue
+                
+                key = None
+                if x.filename.endswith('.ref'):
+                    if read_shared_net is None:
+                        print 'WARNING: Rule stored apart from the task file was not loaded - ' + x.filename
+                        continue
+                    key = zip_file.read(x).strip()
+                    pnml_data, snapshot = read_shared_net(key)
+                else:
+                    pnml_data = zip_file.read(x)
+                    snapshot = self._read_snapshot(zip_file, x.filename)
+                
+                yield self._get_net_entry(folder, _UnloadedPetriNet(PNEditorClass, pnml_data, snapshot, task_name, file_name), lazy, key)
+        finally:
+            zip_file.close()
+    
+    def _get_net_entry(self, folder, unloaded, lazy, key = None):
+        """Returns the entry of a Petri Net (see _OPEN_NET), reading it from its contents unless lazy is True."""
         
-        pn_count = 0
+        pn = None
+        if not lazy:
+            pn = self._load_unloaded_petri_net(unloaded)
+        return (_OPEN_NET, folder, unloaded, pn, key)
+    
+    def _add_open_entry(self, entry):
+        """Adds the task or Petri Net of an entry (see _OPEN_TASK and _OPEN_NET) to the project tree.
         
-        tmp_dir = tempfile.mkdtemp()
+        Returns the item of the task or the virtual editor of the Petri Net, or None if it could not be added.
+        """
         
-        task_name = zip_file.read('task_name.txt').strip()
-        self.create_task(task_name, open_tree = False)
-        task_id = self.clicked_element + task_name + '/'
+        if entry[0] == _OPEN_TASK:
+            self.clicked_element = 'Tasks/'
+            return self.create_task(entry[1], open_tree = False)
         
-        # Create content from files in each folder
-        for x in zip_file.infolist():
-            
-            file_name = x.filename
-            PNEditorClass = None
-            
-            if file_name[:12] == 'Dexec_Rules/':
-                file_name = file_name[12:file_name.find('.')]
-                PNEditorClass = DexecPNEditor
-                self.clicked_element = task_id + 'Dexec_Rules/'
-            elif file_name[:17] == 'Finalizing_Rules/':
-                file_name = file_name[17:file_name.find('.')]
-                PNEditorClass = FinalizationPNEditor
-                self.clicked_element = task_id + 'Finalizing_Rules/'
-            elif file_name[:16] == 'Canceling_Rules/':
-                file_name = file_name[16:file_name.find('.')]
-                PNEditorClass = CancelationPNEditor
-                self.clicked_element = task_id + 'Canceling_Rules/'
-            
-            if PNEditorClass is None or not file_name:
-                continue
-            
-            file_path = os.path.join(tmp_dir, file_name)
-            f = open(file_path, 'w')
-            f.write(zip_file.read(x))
-            f.close()
-            
-            pn_count += 1
-            pn = PNEditorClass.PetriNetClass.from_pnml_file(file_path, task_name)[0]
-            pne = PNEditorClass(self.tab_manager, PetriNet = pn)
-            self.create_petri_net(pne_object = pne)
-            
-            os.remove(file_path) 
-            
-        os.rmdir(tmp_dir)
-        zip_file.close()
+        _, folder, unloaded, pn, key = entry
+        self.clicked_element = folder
+        if pn is None:
+            pne = self._add_virtual_pne(unloaded.PNEditorClass, unloaded = unloaded)
+        else:
+            pne = self._add_virtual_pne(unloaded.PNEditorClass, PetriNet = pn)
         
+        if pne is not None and key is not None:
+            self._content_keys[folder + unloaded.name] = key
+        return pne
+    
+    def _read_snapshot(self, zip_file, pnml_name):
+        """Returns the snapshot saved along with a PNML file in a zip file, or None if there is none."""
         
-        self._update_state_bar('Imported task: ' + task_name)
+        try:
+            return zip_file.read(self.SNAPSHOTS_FOLDER + pnml_name + '.snp')
+        except KeyError:
+            return None
+    
+    def _load_snapshot(self, snapshot, pnml_data, PetriNetClass, task, name = None):
+        """Returns the Petri Net from the snapshot saved along with a PNML file,
+        or None if there is no snapshot or it cannot be used (e. g. it is stale)."""
+        
+        if snapshot is None:
+            return None
         
-        return pn_count
+        try:
+            return PetriNetClass.from_snapshot(snapshot, pnml_data, task, name)
+        except Exception as e:
+            print 'WARNING: Snapshot was not used, reading PNML file instead - ' + str(e)
+            return None
+    
+    def _load_petri_net(self, pnml_data, snapshot, PetriNetClass, task, name):
+        """Returns the Petri Net saved in a zip file, from its snapshot if it can be used or from its PNML contents otherwise."""
+        
+        pn = self._load_snapshot(snapshot, pnml_data, PetriNetClass, task, name)
+        if pn is None:
+            pn = PetriNetClass.from_pnml_file(StringIO(pnml_data), task, cache = self.pnml_cache,
+                                              release_tree = RELEASE_PNML_TREES, name = name)[0]
+        return pn
+    
+    def _load_unloaded_petri_net(self, unloaded):
+        return self._load_petri_net(unloaded.pnml_data, unloaded.snapshot, unloaded.PNEditorClass.PetriNetClass,
+                                    unloaded.task, unloaded.name)
     
     def import_from_PNML(self):
         
@@ -595,10 +1036,10 @@ class PNPDT(object):
         
         self._import_from_pnml(filename, PNEditorClass, task)
         
-    def _import_from_pnml(self, filename, PNEditorClass, task, open_tab = True):
+    def _import_from_pnml(self, filename, PNEditorClass, task, open_tab = True, name = None):
         
         try:
-            petri_nets = PNEditorClass.PetriNetClass.from_pnml_file(filename, task)
+            petri_nets = PNEditorClass.PetriNetClass.from_pnml_file(filename, task, cache = self.pnml_cache, release_tree = RELEASE_PNML_TREES, name = name)
         except Exception as e:
             tkMessageBox.showerror('Error reading PNML file.', 'An error occurred while reading the PNML file.\n\n' + str(e))
             return
@@ -611,12 +1052,13 @@ class PNPDT(object):
         except Exception as e:
             tkMessageBox.showerror('Error loading PetriNet.', 'An error occurred while loading the PetriNet object.\n\n' + str(e))
         
-        pne = PNEditorClass(self.tab_manager, PetriNet = pn)
-        self.create_petri_net(pne)
-        pne.edited = False
-        if open_tab:
-            self.tab_manager.add(pne, text = pne.name)
-            self.tab_manager.select(pne)
+        self._add_loaded_petri_net(pn, PNEditorClass, open_tab)
+    
+    def _add_loaded_petri_net(self, pn, PNEditorClass, open_tab = True):
+        
+        pne = self._add_virtual_pne(PNEditorClass, PetriNet = pn)
+        if pne is not None and open_tab:
+            self.open_petri_net(self._get_pne(self.clicked_element + pne.name))
     
     def rename_petri_net(self):
         old_name = self.project_tree.item(self.clicked_element, 'text')
@@ -657,7 +1099,12 @@ class PNPDT(object):
             self.project_tree.delete(old_id)
             self._adjust_width(name, item_id)
             pne._petri_net.name = name
+            pne.edited = True
             self.petri_nets[item_id] = pne
+            self._journal_pending.discard(old_id)
+            self._journal_record(journal.REMOVE, old_id)
+            if self.edit_journal is not None:
+                self._journal_pending.add(item_id)
         except Exception as e:
             tkMessageBox.showerror('ERROR', 'Item could not be inserted in the selected node, possible duplicate name.\n\nERROR: ' + str(e))
             try:
@@ -679,9 +1126,12 @@ class PNPDT(object):
         new_pn = original_pne.petri_net
         new_pn.name += '-copy_'
         
-        PNEditorClass = original_pne.__class__
+        if isinstance(original_pne, _VirtualPNEditor):
+            PNEditorClass = original_pne.PNEditorClass
+        else:
+            PNEditorClass = original_pne.__class__
         
-        new_pne = PNEditorClass(self.tab_manager, PetriNet = new_pn)
+        new_pne = _VirtualPNEditor(PNEditorClass, PetriNet = new_pn)
         
         self.clicked_element = self.project_tree.parent(self.clicked_element)
         
@@ -697,6 +1147,9 @@ class PNPDT(object):
         except:
             tab_open = False
         self.project_tree.delete(item)
+        self._content_keys.pop(item, None)
+        self._journal_pending.discard(item)
+        self._journal_record(journal.REMOVE, item)
         return pne, tab_open
     
     def view_clips_code(self):
@@ -745,50 +1198,57 @@ class PNPDT(object):
         if not zip_filename:
             return
         
+        task_data = self._build_task_file(self.clicked_element, mark_saved = bool(zip_file_name))
+        
         try:
-            zip_file = zipfile.ZipFile(zip_filename, "w")
+            f = open(zip_filename, 'wb')
         except:
             tkMessageBox.showerror('Error opening file.', 'A problem occurred while opening a file for writing, make sure the file is not open by other program before saving.')
             return
-        tmp_dir = tempfile.mkdtemp()
+        f.write(task_data)
+        f.close()
+        
+        self._update_state_bar('Exported Task: ' + zip_filename)
+    
+    def _build_task_file(self, task_item, mark_saved = False):
+        """Returns the contents of the task file of a task in the project tree, built in memory.
+        
+        If mark_saved is True, the editors of the task's rules are marked as not edited.
+        """
         
-        file_name = os.path.join(tmp_dir, 'task_name.txt')
-        name_file = open(file_name, 'w')
-        name_file.write(os.path.basename(self.clicked_element[:-1]))
-        name_file.close()
+        task_name, petri_nets = self._get_task_contents(task_item)
+        task_data = _build_task_data(task_name, petri_nets)
         
-        zip_file.write(file_name, 'task_name.txt')
-        os.remove(file_name)
+        if mark_saved:
+            for f in self.project_tree.get_children(task_item):
+                for current in self.project_tree.get_children(f):
+                    self.petri_nets[current].edited = False
+        
+        return task_data
+    
+    def _get_task_rules(self, task_item):
+        """Returns the list of (path_name, item) tuples with the paths of the rules of a task in its task file,
+        and their items in the project tree."""
         
-        folders = self.project_tree.get_children(self.clicked_element)
+        rules = []
         
-        for f in folders:
-            children = self.project_tree.get_children(f)
+        for f in self.project_tree.get_children(task_item):
             folder_name = os.path.basename(f[:-1])
-            for current in children:
-                
-                file_name = os.path.basename(current)
+            for current in self.project_tree.get_children(f):
                 
                 ext, _ = self._get_ext_and_filetype(current)
-                file_name = file_name + ext + '.pnml'
-                path_name = os.path.join(folder_name, file_name)
-                file_path = os.path.join(tmp_dir, file_name)
-                
-                pne = self.petri_nets[current]
-                pne._petri_net.to_pnml_file(file_path)
-                
-                if zip_file_name:
-                    #This means this was called from the "save" routine.
-                    pne.edited = False
-                
-                zip_file.write(file_path, path_name)
-                os.remove(file_path)
+                file_name = os.path.basename(current) + ext + '.pnml'
+                rules.append((os.path.join(folder_name, file_name), current))
         
-        os.rmdir(tmp_dir)
-        zip_file.close()
+        return rules
+    
+    def _get_task_contents(self, task_item):
+        """Returns the task name and the list of (path_name, PetriNet) tuples to build
+        the task file of a task in the project tree with (see _build_task_data)."""
         
+        petri_nets = [(path_name, self._get_petri_net(current)) for path_name, current in self._get_task_rules(task_item)]
         
-        self._update_state_bar('Exported Task: ' + zip_filename)
+        return os.path.basename(task_item[:-1]), petri_nets
     
     def export_to_PNML(self):
         
@@ -808,7 +1268,7 @@ class PNPDT(object):
         
     def _export_to_PNML(self, element, filename):
         try:
-            self.petri_nets[element].petri_net.to_pnml_file(filename)
+            self.petri_nets[element]._petri_net.to_pnml_file(filename)
         except Exception as e:
             tkMessageBox.showerror('Error saving PNML file.', 'An error occurred while saving the PNML file.\n\n' + str(e))
             return False
@@ -839,18 +1299,90 @@ class PNPDT(object):
         
         zip_filename = tkFileDialog.askopenfilename(
                                                   defaultextension = '.pnpdt',
-                                                  filetypes=[('Petri Net Plan Design Tool file', '*.pnpdt')],
+                                                  filetypes=[('Petri Net Plan Design Tool file', '*.pnpdt'),
+                                                             ('Petri Net Plan Design Tool database', '*' + projectdb.EXTENSION)],
                                                   title = 'Open PNPDT file...',
                                                   initialdir = os.path.dirname(self.file_path) if self.file_path is not None else default_path
                                                   )
         if not zip_filename:
             return
         
+        self._open_project(zip_filename)
+    
+    def open_directory(self):
+        
+        dir_path = tkFileDialog.askdirectory(
+                                              title = 'Open project directory...',
+                                              initialdir = os.path.dirname(self.file_path) if self.file_path is not None else os.path.expanduser('~/Desktop'),
+                                              mustexist = True
+                                            )
+        if not dir_path:
+            return
+        
+        # Reopening the current project directory only reads the files that changed, keeping unsaved changes.
+        if self.file_path is not None and os.path.isdir(self.file_path) and os.path.samefile(dir_path, self.file_path):
+            self.refresh()
+            return
+        
+        if self._check_edited():
+            if not tkMessageBox.askokcancel('Close without saving?', 'Are you sure you want to discard any unsaved changes?', default = tkMessageBox.CANCEL):
+                return
+        
+        self._open_project(dir_path)
+    
+    def _open_project(self, file_path):
+        """Opens a project from a .pnpdt file, a project database or a project directory.
+        
+        If BACKGROUND_OPEN is set, the project is read by a worker thread, and the Tk thread adds what it reads
+        to the project tree a few entries at a time (see _poll_open_queue), showing the progress in the status bar.
+        """
+        
+        # Opening another project cancels the one being opened.
+        self._stop_open()
+        
         self._update_state_bar('Loading...')
         
+        # Unsaved changes to the project that was open were discarded.
+        self._close_journal(remove = True)
+        
+        self._clear_project()
+        
+        self.file_path = file_path
+        
+        try:
+            if os.path.isdir(self.file_path):
+                self._directory_tasks, self._directory_files = self._scan_project_directory()
+                entries = self._read_project_directory(self._directory_tasks, self._directory_files)
+            elif self.file_path.endswith(projectdb.EXTENSION):
+                entries = self._read_project_database()
+            else:
+                entries = self._read_project_file()
+        except Exception as e:
+            tkMessageBox.showerror('Error opening file.', 'An error occurred while opening the project.\n\n' + str(e))
+            return
+        
+        opening = _ProjectOpening()
+        self._opening = opening
+        
+        if not BACKGROUND_OPEN:
+            self._read_open_entries(entries, opening)
+            self._add_open_entries(opening)
+            return
+        
+        self.open_progress.configure(value = 0, maximum = 1)
+        self.open_progress.grid()
+        self.cancel_open_button.grid()
+        
+        thread = threading.Thread(target = self._read_open_entries, args = (entries, opening), name = 'OpenProject')
+        thread.daemon = True
+        thread.start()
+        
+        self.root.after(OPEN_POLL_INTERVAL, self._poll_open_queue, opening)
+    
+    def _clear_project(self):
+        """Removes every task and Petri Net from the project tree."""
+        
         tasks = self.project_tree.get_children('Tasks/')
-        tasks_count = 0
-        pn_count = 0
         
         for t in tasks:
             for folder in self.project_tree.get_children(t):
@@ -860,89 +1392,920 @@ class PNPDT(object):
         
         for pn in self.project_tree.get_children('Generic_Rules/'):
             self.delete_petri_net(pn)
+    
+    def _read_open_entries(self, entries, opening):
+        """Puts the entries read from a project in the queue of the project being opened,
+        until they are all read or opening it is canceled.
         
-        self.file_path = zip_filename
+        This is the worker stage of opening a project, it does not use any widgets.
+        """
         
-        zip_file = zipfile.ZipFile(self.file_path, 'r')
-        tmp_dir = tempfile.mkdtemp()
+        try:
+            for entry in entries:
+                if opening.canceled.is_set():
+                    return
+                opening.queue.put(entry)
+        except Exception as e:
+            opening.queue.put((_OPEN_ERROR, e))
+        else:
+            opening.queue.put((_OPEN_DONE,))
+        finally:
+            entries.close()
+    
+    def _poll_open_queue(self, opening):
+        """Adds the entries read by the worker thread to the project tree for up to OPEN_POLL_INTERVAL milliseconds,
+        and schedules the next call until the project is opened."""
         
-        for x in zip_file.infolist():
-            if x.filename[-4:] == '.tsk':
-                self.clicked_element = 'Tasks/'
-                
-                file_name = os.path.join(tmp_dir, x.filename)
-                f = open(file_name, 'w')
-                f.write(zip_file.read(x))
-                f.close()
-                tasks_count += 1
-                pn_count += self._import_task(file_name)
-                os.remove(file_name)
-            elif x.filename[-7:] == '.g.pnml':
-                self.clicked_element = 'Generic_Rules/'
+        if opening is not self._opening:
+            # Opening the project was canceled.
+            return
+        
+        if not self._add_open_entries(opening, time.time() + OPEN_POLL_INTERVAL/1000.0):
+            self.root.after(OPEN_POLL_INTERVAL, self._poll_open_queue, opening)
+    
+    def _add_open_entries(self, opening, deadline = None):
+        """Adds the entries in the queue of the project being opened to the project tree, until the queue is empty
+        or the deadline (in seconds since the epoch) is reached, and finishes opening it after the last one.
+        
+        Returns True if opening the project finished.
+        """
+        
+        # Entries may be added while a dialog waits for the user (e. g. to name a new rule in the selected folder).
+        clicked_element = getattr(self, 'clicked_element', None)
+        
+        try:
+            while deadline is None or time.time() < deadline:
+                try:
+                    entry = opening.queue.get_nowait()
+                except Queue.Empty:
+                    break
                 
-                file_name = os.path.join(tmp_dir, x.filename)
-                f = open(file_name, 'w')
-                f.write(zip_file.read(x))
-                f.close()
-                pn_count += 1
-                self._import_from_pnml(file_name, RulePNEditor, None, open_tab = False)
-                os.remove(file_name)
-            else:
-                print 'WARNING: Unknown file was not loaded - ' + x.filename
-                continue
-            
-        os.rmdir(tmp_dir)
-        zip_file.close()
+                kind = entry[0]
+                if kind == _OPEN_TOTAL:
+                    opening.total = entry[1]
+                elif kind == _OPEN_STEP:
+                    opening.steps += 1
+                elif kind == _OPEN_TASK:
+                    self._add_open_entry(entry)
+                    opening.tasks_count += 1
+                elif kind == _OPEN_NET:
+                    self._add_open_entry(entry)
+                    opening.pn_count += 1
+                elif kind == _OPEN_ERROR:
+                    self._stop_open()
+                    tkMessageBox.showerror('Error opening file.', 'An error occurred while opening the project.\n\n' + str(entry[1]))
+                    return True
+                else:
+                    self._finish_open(opening)
+                    return True
+        finally:
+            self.clicked_element = clicked_element
+        
+        self.open_progress.configure(value = opening.steps, maximum = max(opening.total, 1))
+        self._update_state_bar('Loading... ' + str(opening.steps) + '/' + str(opening.total))
+        return False
+    
+    def _finish_open(self, opening):
+        
+        self._stop_open()
+        
+        self._saved_file_path = self.file_path
+        self._saved_members = self._get_saved_members()
+        
+        self._start_journal(self._recover_journal())
         
         self._update_state_bar('Opened: ' + self.file_path)
-        print 'Loaded ' + str(tasks_count) + ' tasks, ' + str(pn_count) + ' petri nets.'
+        print 'Loaded ' + str(opening.tasks_count) + ' tasks, ' + str(opening.pn_count) + ' petri nets.'
     
-    def save(self, event = None):
-        if not self.file_path:
-            self.save_as()
-            return
+    def _stop_open(self):
+        """Stops the worker thread of the project being opened, if there is one, and hides the progress of opening it."""
         
-        try:
-            zip_file = zipfile.ZipFile(self.file_path, "w")
-        except:
-            tkMessageBox.showerror('Error opening file.', 'A problem ocurred while opening a file for writing, make sure the file is not open by other program before saving.')
+        if self._opening is None:
             return
         
-        self._update_state_bar('Saving...')
+        self._opening.canceled.set()
+        self._opening = None
         
-        tmp_dir = tempfile.mkdtemp()
+        self.open_progress.grid_remove()
+        self.cancel_open_button.grid_remove()
+    
+    def cancel_open(self):
+        """Cancels opening a project, removing the part of it that was already added to the project tree."""
         
-        for t in self.project_tree.get_children('Tasks/'):
-            self.clicked_element = t
-            task_name = os.path.basename(self.clicked_element[:-1])
-            pos = task_name.find('(')
-            if pos > -1:
-                task_name = task_name[:pos]
-            task_name = task_name + '.tsk'
-            file_path = os.path.join(tmp_dir, task_name)
-            self.export_task(file_path)
-            zip_file.write(file_path, task_name)
-            os.remove(file_path)
+        if self._opening is None:
+            return
         
-        for r in self.project_tree.get_children('Generic_Rules/'):
-            self.clicked_element = r
-            
-            rule_name = os.path.basename(self.clicked_element)
-            rule_name = rule_name + '.g.pnml'
-            
-            file_path = os.path.join(tmp_dir, rule_name)
-            
-            if self._export_to_PNML(self.clicked_element, file_path):
-                zip_file.write(file_path, rule_name)
-            os.remove(file_path)
+        self._stop_open()
+        self._clear_project()
         
-        os.rmdir(tmp_dir)
-        zip_file.close()
+        self.file_path = None
+        self._saved_file_path = None
+        self._saved_members = {}
         
-        self._update_state_bar('File saved: ' + self.file_path)
+        self._update_state_bar('Opening canceled.')
+    
+    def _check_opening(self):
+        """Returns True, telling the user, if a project is being opened."""
+        
+        if self._opening is None:
+            return False
+        
+        tkMessageBox.showinfo('Project not opened yet', 'The project is still being opened. Please wait until it is opened, or cancel opening it.')
+        return True
+    
+    def _read_project_file(self):
+        """Yields the entries of the tasks and generic rules of the .pnpdt file in self.file_path (see _open_project)."""
+        
+        zip_file = zipfile.ZipFile(self.file_path, 'r')
+        try:
+            # Petri Nets stored apart are read once, however many rules refer to them.
+            shared_nets = {}
+            def read_shared_net(key):
+                if key not in shared_nets:
+                    pnml_name = self.NETS_FOLDER + key + '.pnml'
+                    shared_nets[key] = zip_file.read(pnml_name), self._read_snapshot(zip_file, pnml_name)
+                return shared_nets[key]
+            
+            members = zip_file.infolist()
+            yield (_OPEN_TOTAL, len([x for x in members if x.filename[-4:] == '.tsk' or x.filename[-7:] == '.g.pnml' or x.filename[-11:] == '.g.pnml.ref']))
+            
+            for x in members:
+                if x.filename[-4:] == '.tsk':
+                    # Nested task files are read in memory (ZipFile needs a seekable file, which members are not).
+                    for entry in self._read_task_entries(StringIO(zip_file.read(x)), LAZY_OPEN, read_shared_net):
+                        yield entry
+                elif x.filename[-7:] == '.g.pnml' or x.filename[-11:] == '.g.pnml.ref':
+                    name = x.filename[:x.filename.find('.')]
+                    key = None
+                    if x.filename.endswith('.ref'):
+                        key = zip_file.read(x).strip()
+                        pnml_data, snapshot = read_shared_net(key)
+                    else:
+                        pnml_data = zip_file.read(x)
+                        snapshot = self._read_snapshot(zip_file, x.filename)
+                    
+                    yield self._get_net_entry('Generic_Rules/', _UnloadedPetriNet(RulePNEditor, pnml_data, snapshot, None, name), LAZY_OPEN, key)
+                elif x.filename.startswith(self.SNAPSHOTS_FOLDER) or x.filename.startswith(self.NETS_FOLDER):
+                    # Snapshots are read along with their PNML files, and Petri Nets stored apart along with the rules that refer to them.
+                    continue
+                else:
+                    print 'WARNING: Unknown file was not loaded - ' + x.filename
+                    continue
+                
+                yield (_OPEN_STEP,)
+        finally:
+            zip_file.close()
+    
+    def _read_project_database(self):
+        """Yields the entries of the tasks and generic rules of the project database in self.file_path (see _open_project)."""
+        
+        db = projectdb.ProjectDB(self.file_path)
+        try:
+            tasks = db.get_tasks()
+            rows = db.get_nets(contents = True)
+        finally:
+            db.close()
+        
+        yield (_OPEN_TOTAL, len(tasks) + len(rows))
+        
+        for task in tasks:
+            yield (_OPEN_TASK, task)
+            yield (_OPEN_STEP,)
+        
+        for task, kind, name, _, _, pnml_data, snapshot in rows:
+            if kind == projectdb.GENERIC:
+                folder = 'Generic_Rules/'
+                PNEditorClass = RulePNEditor
+                task = None
+            else:
+                folder, PNEditorClass = self._RULE_FOLDERS[kind]
+                folder = 'Tasks/' + task + '/' + folder
+            
+            yield self._get_net_entry(folder, _UnloadedPetriNet(PNEditorClass, pnml_data, snapshot, task, name), LAZY_OPEN)
+            yield (_OPEN_STEP,)
+    
+    def _get_directory_path(self, item_id):
+        """Returns the path of the PNML file of a Petri Net of the project tree, relative to project directories."""
+        
+        ext, _ = self._get_ext_and_filetype(item_id)
+        return item_id + ext + '.pnml'
+    
+    def _get_directory_item(self, rel_path):
+        """Returns the project tree item of the PNML file in a path relative to project directories."""
+        
+        file_name = os.path.basename(rel_path)
+        return rel_path[:len(rel_path) - len(file_name)] + file_name[:file_name.find('.')]
+    
+    def _scan_project_directory(self):
+        """Returns the set of names of the tasks in the project directory in self.file_path, and a dictionary
+        with the modification time and size of its PNML files, by path relative to the directory."""
+        
+        tasks = set()
+        files = {}
+        
+        def scan_folder(rel_folder, ext):
+            folder_path = os.path.join(self.file_path, *rel_folder.split('/'))
+            if not os.path.isdir(folder_path):
+                return
+            for file_name in os.listdir(folder_path):
+                if not file_name.endswith(ext + '.pnml') or file_name[0] == '.':
+                    continue
+                st = os.stat(os.path.join(folder_path, file_name))
+                files[rel_folder + file_name] = (st.st_mtime, st.st_size)
+        
+        tasks_path = os.path.join(self.file_path, 'Tasks')
+        if os.path.isdir(tasks_path):
+            for task in os.listdir(tasks_path):
+                if not os.path.isdir(os.path.join(tasks_path, task)):
+                    continue
+                tasks.add(task)
+                for folder, _ in self._RULE_FOLDERS.itervalues():
+                    scan_folder('Tasks/' + task + '/' + folder, '')
+        
+        scan_folder('Generic_Rules/', '.g')
+        
+        return tasks, files
+    
+    def _read_directory_file(self, rel_path):
+        """Adds the Petri Net in a PNML file of the project directory in self.file_path to the project tree."""
+        
+        self._add_open_entry(self._read_directory_entry(rel_path))
+    
+    def _read_directory_entry(self, rel_path):
+        """Returns the entry of the Petri Net in a PNML file of the project directory in self.file_path (see _OPEN_NET)."""
+        
+        path = os.path.join(self.file_path, *rel_path.split('/'))
+        f = open(path, 'rb')
+        pnml_data = f.read()
+        f.close()
+        
+        snapshot = None
+        snapshot_path = os.path.join(self.file_path, *(self.SNAPSHOTS_FOLDER + rel_path + '.snp').split('/'))
+        if os.path.isfile(snapshot_path):
+            f = open(snapshot_path, 'rb')
+            snapshot = f.read()
+            f.close()
+        
+        item_id = self._get_directory_item(rel_path)
+        parts = item_id.split('/')
+        
+        if parts[0] == 'Generic_Rules':
+            PNEditorClass = RulePNEditor
+            task = None
+        else:
+            task = parts[1]
+            for folder, PNEditorClass in self._RULE_FOLDERS.itervalues():
+                if folder == parts[2] + '/':
+                    break
+        
+        unloaded = _UnloadedPetriNet(PNEditorClass, pnml_data, snapshot, task, parts[-1])
+        return self._get_net_entry(item_id[:item_id.rfind('/') + 1], unloaded, LAZY_OPEN)
+    
+    def _read_project_directory(self, tasks, files):
+        """Yields the entries of the tasks and generic rules of the project directory in self.file_path (see _open_project),
+        given the names of its tasks and its PNML files (see _scan_project_directory)."""
+        
+        yield (_OPEN_TOTAL, len(tasks) + len(files))
+        
+        for task in sorted(tasks):
+            yield (_OPEN_TASK, task)
+            yield (_OPEN_STEP,)
+        
+        for rel_path in sorted(files):
+            yield self._read_directory_entry(rel_path)
+            yield (_OPEN_STEP,)
+    
+    def refresh(self, event = None):
+        """Reads again the files of the project directory that changed since they were last read or written,
+        and adds or removes the tasks and Petri Nets whose files were added or removed.
+        
+        Petri Nets with unsaved changes are kept as they are.
+        """
+        
+        if not self.file_path or not os.path.isdir(self.file_path) or self._check_opening():
+            return
+        
+        self._update_state_bar('Refreshing...')
+        
+        # Petri Nets read again from their files are not edits, so they are not written to the journal,
+        # which is replayed on the files as they are when the project directory is opened again.
+        edit_journal = self.edit_journal
+        self.edit_journal = None
+        try:
+            tasks, files = self._scan_project_directory()
+            task_items = dict((os.path.basename(t[:-1]), t) for t in self.project_tree.get_children('Tasks/'))
+            
+            for task in sorted(tasks - set(task_items)):
+                self.clicked_element = 'Tasks/'
+                self.create_task(task, open_tree = False)
+            
+            read_count = 0
+            removed_count = 0
+            kept = []
+            
+            for rel_path in sorted(files):
+                if self._directory_files.get(rel_path) == files[rel_path]:
+                    continue
+                
+                item_id = self._get_directory_item(rel_path)
+                tab_open = False
+                if item_id in self.petri_nets:
+                    if self.petri_nets[item_id].edited:
+                        kept.append(rel_path)
+                        continue
+                    _, tab_open = self.delete_petri_net(item_id)
+                
+                try:
+                    self._read_directory_file(rel_path)
+                except Exception as e:
+                    tkMessageBox.showerror('Error reading PNML file.', 'An error occurred while reading ' + rel_path + '.\n\n' + str(e))
+                    continue
+                read_count += 1
+                
+                if tab_open:
+                    self.clicked_element = item_id
+                    self.open_petri_net()
+            
+            for rel_path in set(self._directory_files) - set(files):
+                item_id = self._get_directory_item(rel_path)
+                if item_id not in self.petri_nets:
+                    continue
+                if self.petri_nets[item_id].edited:
+                    kept.append(rel_path)
+                    continue
+                self.delete_petri_net(item_id)
+                removed_count += 1
+            
+            for task in self._directory_tasks - tasks:
+                t = task_items.get(task)
+                if t is None or any(self.project_tree.get_children(folder) for folder in self.project_tree.get_children(t)):
+                    continue
+                self.project_tree.delete(t)
+            
+            # Files of Petri Nets with unsaved changes are checked again on the next refresh.
+            for rel_path in kept:
+                if rel_path in self._directory_files:
+                    files[rel_path] = self._directory_files[rel_path]
+                else:
+                    files.pop(rel_path, None)
+            
+            self._directory_tasks = tasks
+            self._directory_files = files
+            self._saved_members = self._get_saved_members()
+            
+            if kept:
+                tkMessageBox.showwarning('Files not refreshed', 'These files changed in the project directory, but their Petri Nets have unsaved changes and were kept:\n\n' + '\n'.join(sorted(kept)))
+            
+            self._update_state_bar('Refreshed: ' + self.file_path)
+            print 'Read ' + str(read_count) + ' and removed ' + str(removed_count) + ' petri nets.'
+        finally:
+            self.edit_journal = edit_journal
+    
+    def _get_database_key(self, item_id):
+        """Returns the (task, kind, name) key of a Petri Net of the project tree in project databases."""
+        
+        item_tags = self.project_tree.item(item_id, 'tags')
+        name = os.path.basename(item_id)
+        
+        if projectdb.GENERIC in item_tags:
+            return '', projectdb.GENERIC, name
+        
+        for kind in self._RULE_FOLDERS:
+            if kind in item_tags:
+                break
+        task_item = self.project_tree.parent(self.project_tree.parent(item_id))
+        return os.path.basename(task_item[:-1]), kind, name
+    
+    def _get_saved_members(self):
+        """Returns the members of the project file (see _get_project_members) or, for project databases,
+        the Petri Nets, as they are saved now, to tell which ones change before the next save."""
+        
+        if self.file_path.endswith(projectdb.EXTENSION) or os.path.isdir(self.file_path):
+            return dict((item, (item,)) for item in self.petri_nets)
+        return dict((member_name, items) for member_name, _, items in self._get_project_members())
+    
+    def _get_task_file_name(self, task_item):
+        """Returns the name of the task file of a task in the project tree, within a project file."""
+        
+        task_name = os.path.basename(task_item[:-1])
+        pos = task_name.find('(')
+        if pos > -1:
+            task_name = task_name[:pos]
+        return task_name + '.tsk'
+    
+    def _get_project_members(self):
+        """Returns a list of (member_name, item, items) tuples with the tasks and generic rules of the project,
+        in the order they are saved, where items are the tree items of the Petri Nets in each member."""
+        
+        members = []
+        
+        for t in self.project_tree.get_children('Tasks/'):
+            items = []
+            for folder in self.project_tree.get_children(t):
+                items += self.project_tree.get_children(folder)
+            members.append((self._get_task_file_name(t), t, tuple(items)))
+        
+        for r in self.project_tree.get_children('Generic_Rules/'):
+            members.append((os.path.basename(r) + '.g.pnml', r, (r,)))
+        
+        return members
+    
+    def _get_reusable_members(self, members):
+        """Returns the names of the members of the last saved project file that are still up to date."""
+        
+        if not INCREMENTAL_SAVE or not self._saved_file_path or not os.path.isfile(self._saved_file_path):
+            return set()
+        
+        reusable = set()
+        for member_name, _, items in members:
+            if self._saved_members.get(member_name) != items:
+                continue
+            if any(self.petri_nets[item].edited for item in items):
+                continue
+            reusable.add(member_name)
+        
+        return reusable
+    
+    def save(self, event = None):
+        if self._check_opening():
+            return
+        
+        if not self.file_path:
+            self.save_as()
+            return
+        
+        if os.path.isdir(self.file_path):
+            self._save_to_directory()
+            return
+        
+        if self.file_path.endswith(projectdb.EXTENSION):
+            self._save_to_database()
+            return
+        
+        members = self._get_project_members()
+        reusable = self._get_reusable_members(members)
+        
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix = '.pnpdt', dir = os.path.dirname(os.path.abspath(self.file_path)))
+            os.close(fd)
+            zip_file = zipfile.ZipFile(tmp_path, "w")
+        except:
+            tkMessageBox.showerror('Error opening file.', 'A problem ocurred while opening a file for writing, make sure the file is not open by other program before saving.')
+            return
+        
+        self._update_state_bar('Saving...')
+        
+        old_zip_file = None
+        # Petri Nets stored apart in the previous file are copied from it as well (see _write_deduplicated_members).
+        if reusable or (DEDUPLICATE_NETS and INCREMENTAL_SAVE and self._saved_file_path and zipfile.is_zipfile(self._saved_file_path)):
+            try:
+                old_zip_file = zipfile.ZipFile(self._saved_file_path, 'r')
+                old_names = old_zip_file.namelist()
+                # Members are only copied from a previous file with the same layout (see NETS_FOLDER).
+                if any(name.startswith(self.NETS_FOLDER) for name in old_names) != DEDUPLICATE_NETS:
+                    reusable = set()
+                reusable.intersection_update(old_names)
+            except Exception as e:
+                print 'WARNING: Previous file could not be read, saving all members - ' + str(e)
+                reusable = set()
+        
+        try:
+            if DEDUPLICATE_NETS:
+                result = self._write_deduplicated_members(zip_file, old_zip_file, members, reusable)
+            else:
+                result = self._write_members(zip_file, old_zip_file, members, reusable)
+        except Exception as e:
+            tkMessageBox.showerror('Error saving file.', 'An error occurred while writing the project file.\n\n' + str(e))
+            result = None
+        
+        zip_file.close()
+        if old_zip_file is not None:
+            old_zip_file.close()
+        
+        # The project file is only replaced if every task and rule was written, so none of them is lost.
+        if result is None:
+            os.remove(tmp_path)
+            self._update_state_bar('File not saved: ' + self.file_path)
+            return
+        
+        try:
+            _replace_file(tmp_path, self.file_path)
+        except Exception as e:
+            os.remove(tmp_path)
+            tkMessageBox.showerror('Error saving file.', 'A problem ocurred while replacing the file, make sure the file is not open by other program before saving.\n\n' + str(e))
+            return
+        
+        reused_count, saved_keys = result
+        for pn_item, key in saved_keys.iteritems():
+            self.petri_nets[pn_item].edited = False
+            if key is not None:
+                self._content_keys[pn_item] = key
+        
+        self._saved_file_path = self.file_path
+        self._saved_members = self._get_saved_members()
+        self._start_journal()
+        
+        if reused_count:
+            print 'Reused ' + str(reused_count) + ' of ' + str(len(members)) + ' tasks and rules from the previous file.'
+        
+        self._update_state_bar('File saved: ' + self.file_path)
+    
+    def _write_members(self, zip_file, old_zip_file, members, reusable):
+        """Writes the tasks and generic rules of the project (see _get_project_members) to a project file opened for writing,
+        copying the reusable ones from the previous file.
+        
+        Returns the number of members copied and a dictionary with None for each Petri Net written, by tree item,
+        or None if any of them could not be serialized.
+        """
+        
+        # Tasks and rules are serialized in a pool of processes (see _run_jobs).
+        jobs = []
+        for member_name, item, _ in members:
+            if member_name in reusable:
+                continue
+            if member_name.endswith('.tsk'):
+                jobs.append((_build_task_data, self._get_task_contents(item)))
+            else:
+                jobs.append((_serialize_petri_net, (self._get_petri_net(item),)))
+        
+        results = iter(_run_jobs(jobs, self.save_processes))
+        reused_count = 0
+        saved_keys = {}
+        
+        for member_name, item, items in members:
+            
+            if member_name in reusable:
+                _copy_zip_member(old_zip_file, old_zip_file.getinfo(member_name), zip_file)
+                try:
+                    _copy_zip_member(old_zip_file, old_zip_file.getinfo(self.SNAPSHOTS_FOLDER + member_name + '.snp'), zip_file)
+                except KeyError:
+                    pass
+                reused_count += 1
+                continue
+            
+            data, error = next(results)
+            
+            if error is not None:
+                if member_name.endswith('.tsk'):
+                    tkMessageBox.showerror('Error saving Task file.', 'An error occurred while saving the Task file ' + member_name + '.\n\n' + str(error))
+                else:
+                    tkMessageBox.showerror('Error saving PNML file.', 'An error occurred while saving the PNML file.\n\n' + str(error))
+                return None
+            
+            if member_name.endswith('.tsk'):
+                zip_file.writestr(member_name, data)
+            else:
+                pnml_data, snapshot = data
+                zip_file.writestr(member_name, pnml_data)
+                if snapshot is not None:
+                    zip_file.writestr(self.SNAPSHOTS_FOLDER + member_name + '.snp', snapshot)
+            
+            for pn_item in items:
+                saved_keys[pn_item] = None
+        
+        return reused_count, saved_keys
+    
+    def _write_deduplicated_members(self, zip_file, old_zip_file, members, reusable):
+        """Writes the tasks and generic rules of the project (see _get_project_members) to a project file opened for writing,
+        copying the reusable ones from the previous file, with each of their Petri Nets stored once in NETS_FOLDER.
+        
+        The Petri Nets that are already in the previous file are copied from it too, the rest are serialized once
+        however many rules have them.
+        
+        Returns the number of members copied and a dictionary with the key of each Petri Net written, by tree item,
+        or None if any of them could not be serialized.
+        """
+        
+        old_names = set(old_zip_file.namelist()) if old_zip_file is not None else set()
+        written_keys = set()
+        
+        def copy_shared_net(key):
+            """Copies a Petri Net from the previous file, unless it was already written. Returns False if it is not there."""
+            
+            pnml_name = self.NETS_FOLDER + key + '.pnml'
+            if key in written_keys:
+                return True
+            if pnml_name not in old_names:
+                return False
+            
+            _copy_zip_member(old_zip_file, old_zip_file.getinfo(pnml_name), zip_file)
+            if self.SNAPSHOTS_FOLDER + pnml_name + '.snp' in old_names:
+                _copy_zip_member(old_zip_file, old_zip_file.getinfo(self.SNAPSHOTS_FOLDER + pnml_name + '.snp'), zip_file)
+            written_keys.add(key)
+            return True
+        
+        reused_count = 0
+        keys = {}
+        
+        for member_name, item, items in members:
+            
+            if member_name in reusable:
+                _copy_zip_member(old_zip_file, old_zip_file.getinfo(member_name), zip_file)
+                if self.SNAPSHOTS_FOLDER + member_name + '.snp' in old_names:
+                    _copy_zip_member(old_zip_file, old_zip_file.getinfo(self.SNAPSHOTS_FOLDER + member_name + '.snp'), zip_file)
+                # The Petri Nets that a copied task file refers to are copied along with it.
+                if member_name.endswith('.tsk'):
+                    task_zip_file = zipfile.ZipFile(StringIO(old_zip_file.read(member_name)), 'r')
+                    for name in task_zip_file.namelist():
+                        if name.endswith('.ref'):
+                            copy_shared_net(task_zip_file.read(name).strip())
+                    task_zip_file.close()
+                reused_count += 1
+                continue
+            
+            for pn_item in items:
+                keys[pn_item] = self._get_content_key(pn_item)
+        
+        # Petri Nets are serialized in a pool of processes (see _run_jobs).
+        jobs = []
+        job_keys = []
+        keys_to_write = set()
+        for member_name, item, items in members:
+            if member_name in reusable:
+                continue
+            for pn_item in items:
+                key = keys[pn_item]
+                if key in keys_to_write or copy_shared_net(key):
+                    continue
+                jobs.append((_serialize_petri_net, (self._get_petri_net(pn_item),)))
+                job_keys.append(key)
+                keys_to_write.add(key)
+        
+        for key, (data, error) in zip(job_keys, _run_jobs(jobs, self.save_processes)):
+            if error is not None:
+                tkMessageBox.showerror('Error saving PNML file.', 'An error occurred while saving the PNML file.\n\n' + str(error))
+                return None
+            
+            pnml_data, snapshot = data
+            pnml_name = self.NETS_FOLDER + key + '.pnml'
+            zip_file.writestr(pnml_name, pnml_data)
+            if snapshot is not None:
+                zip_file.writestr(self.SNAPSHOTS_FOLDER + pnml_name + '.snp', snapshot)
+            written_keys.add(key)
+        
+        saved_keys = {}
+        for member_name, item, items in members:
+            if member_name in reusable:
+                continue
+            
+            if member_name.endswith('.tsk'):
+                refs = [(path_name, keys[current]) for path_name, current in self._get_task_rules(item)]
+                zip_file.writestr(member_name, _build_task_refs(os.path.basename(item[:-1]), refs))
+            else:
+                zip_file.writestr(member_name + '.ref', keys[item])
+            
+            for pn_item in items:
+                saved_keys[pn_item] = keys[pn_item]
+        
+        return reused_count, saved_keys
+    
+    def _get_content_key(self, item_id):
+        """Returns the key a Petri Net of the project tree is stored under in project files (see NETS_FOLDER),
+        which is the hash of its contents (see BasicPetriNet.get_content_hash).
+        
+        The key is only computed again if the Petri Net was edited since it was last stored. Petri Nets that were
+        not read yet are not read to compute it: it is computed from their snapshot or, if they have none that can be used,
+        the hash of their PNML contents is used instead.
+        """
+        
+        if not self.petri_nets[item_id].edited and item_id in self._content_keys:
+            return self._content_keys[item_id]
+        
+        pn = self._get_petri_net(item_id)
+        if not isinstance(pn, _UnloadedPetriNet):
+            return pn.get_content_hash()
+        
+        if pn.snapshot is not None:
+            try:
+                return pn.PNEditorClass.PetriNetClass.get_snapshot_content_hash(pn.snapshot, pn.pnml_data)
+            except Exception:
+                pass
+        return hashlib.sha1(pn.pnml_data).hexdigest()
+    
+    def _save_to_database(self):
+        """Saves the project to the project database in self.file_path, in a single transaction.
+        
+        Only the Petri Nets that are edited, or were not saved to this database, are written.
+        The tasks and Petri Nets that are no longer in the project are removed from it.
+        """
+        
+        try:
+            db = projectdb.ProjectDB(self.file_path)
+        except Exception as e:
+            tkMessageBox.showerror('Error opening file.', 'A problem ocurred while opening the project database.\n\n' + str(e))
+            return
+        
+        self._update_state_bar('Saving...')
+        
+        reuse = self._saved_file_path == self.file_path
+        saved = []
+        written_count = 0
+        
+        # Project database the project was opened from or last saved to, where the index of the facts
+        # and dependencies of the Petri Nets that were not read is taken from.
+        source_db = None
+        
+        try:
+            if (not reuse and self._saved_file_path is not None and self._saved_file_path.endswith(projectdb.EXTENSION)
+                    and os.path.isfile(self._saved_file_path)):
+                source_db = projectdb.ProjectDB(self._saved_file_path)
+            
+            with db:
+                task_names = set(os.path.basename(t[:-1]) for t in self.project_tree.get_children('Tasks/'))
+                for task in task_names:
+                    db.add_task(task)
+                for task in set(db.get_tasks()) - task_names:
+                    db.remove_task(task)
+                
+                old_keys = set(row[:3] for row in db.get_nets())
+                keys = set()
+                
+                for item, pne in self.petri_nets.iteritems():
+                    key = self._get_database_key(item)
+                    keys.add(key)
+                    if reuse and key in old_keys and item in self._saved_members and not pne.edited:
+                        continue
+                    
+                    pn = self._get_petri_net(item)
+                    pnml_data, snapshot = _serialize_petri_net(pn)
+                    index = self._get_database_index(pn, key, pnml_data, db, source_db)
+                    if index is None:
+                        # The contents are already in the database.
+                        saved.append(pne)
+                        continue
+                    
+                    fact_names, dependencies = index
+                    if db.save_net(key[0], key[1], key[2], pnml_data, snapshot, fact_names, dependencies):
+                        written_count += 1
+                    saved.append(pne)
+                
+                for key in old_keys - keys:
+                    db.remove_net(*key)
+        except Exception as e:
+            tkMessageBox.showerror('Error saving file.', 'An error occurred while saving the project database, it was not modified.\n\n' + str(e))
+            return
+        finally:
+            db.close()
+            if source_db is not None:
+                source_db.close()
+        
+        for pne in saved:
+            pne.edited = False
+        
+        self._saved_file_path = self.file_path
+        self._saved_members = self._get_saved_members()
+        self._start_journal()
+        
+        print 'Wrote ' + str(written_count) + ' of ' + str(len(self.petri_nets)) + ' petri nets to the database.'
+        
+        self._update_state_bar('File saved: ' + self.file_path)
+    
+    def _get_database_index(self, pn, key, pnml_data, db, source_db):
+        """Returns the (fact_names, dependencies) a Petri Net to be saved (see _get_petri_net) is indexed with
+        in project databases, or None if it is not read yet and the database already has its contents.
+        
+        The index of Petri Nets that are not read yet is copied from the database they were opened from,
+        if it has the same contents. Otherwise they are read, but they are not kept.
+        """
+        
+        if isinstance(pn, _UnloadedPetriNet):
+            content_hash = projectdb.get_content_hash(pnml_data)
+            index = db.get_net_index(*key)
+            if index is not None and index[0] == content_hash:
+                return None
+            
+            if source_db is not None:
+                index = source_db.get_net_index(*key)
+                if index is not None and index[0] == content_hash:
+                    return index[1], index[2]
+            
+            pn = self._load_unloaded_petri_net(pn)
+        
+        # Generic rules do not belong to a task, so they have no dependencies.
+        dependencies = pn.get_dependency_tasks() if key[1] != projectdb.GENERIC else ()
+        return pn.get_fact_names(), dependencies
+    
+    def _write_directory_file(self, rel_path, data):
+        """Writes a file of the project directory in self.file_path, replacing it atomically if it exists."""
+        
+        path = os.path.join(self.file_path, *rel_path.split('/'))
+        dir_path = os.path.dirname(path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        
+        fd, tmp_path = tempfile.mkstemp(dir = dir_path)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        _replace_file(tmp_path, path)
+    
+    def _remove_directory_file(self, rel_path):
+        path = os.path.join(self.file_path, *rel_path.split('/'))
+        if os.path.isfile(path):
+            os.remove(path)
+    
+    def _save_to_directory(self):
+        """Saves the project to the project directory in self.file_path.
+        
+        Only the Petri Nets that are edited, or were not saved to this directory, are written.
+        The files of the Petri Nets that are no longer in the project are removed, and so are
+        the folders of removed tasks, if nothing else is in them.
+        """
+        
+        self._update_state_bar('Saving...')
+        
+        reuse = self._saved_file_path == self.file_path
+        saved = []
+        
+        task_names = set()
+        for t in self.project_tree.get_children('Tasks/'):
+            task = os.path.basename(t[:-1])
+            task_names.add(task)
+            for folder, _ in self._RULE_FOLDERS.itervalues():
+                folder_path = os.path.join(self.file_path, 'Tasks', task, folder)
+                if not os.path.isdir(folder_path):
+                    os.makedirs(folder_path)
+        generic_path = os.path.join(self.file_path, 'Generic_Rules')
+        if not os.path.isdir(generic_path):
+            os.makedirs(generic_path)
+        
+        rel_paths = set()
+        
+        for item_id, pne in self.petri_nets.iteritems():
+            rel_path = self._get_directory_path(item_id)
+            rel_paths.add(rel_path)
+            if reuse and rel_path in self._directory_files and item_id in self._saved_members and not pne.edited:
+                continue
+            
+            try:
+                pnml_data, snapshot = _serialize_petri_net(self._get_petri_net(item_id))
+                self._write_directory_file(rel_path, pnml_data)
+                if snapshot is not None:
+                    self._write_directory_file(self.SNAPSHOTS_FOLDER + rel_path + '.snp', snapshot)
+                else:
+                    self._remove_directory_file(self.SNAPSHOTS_FOLDER + rel_path + '.snp')
+            except Exception as e:
+                tkMessageBox.showerror('Error saving PNML file.', 'An error occurred while saving ' + rel_path + '.\n\n' + str(e))
+                continue
+            saved.append(pne)
+        
+        if reuse:
+            for rel_path in set(self._directory_files) - rel_paths:
+                self._remove_directory_file(rel_path)
+                self._remove_directory_file(self.SNAPSHOTS_FOLDER + rel_path + '.snp')
+            
+            for task in self._directory_tasks - task_names:
+                task_path = os.path.join(self.file_path, 'Tasks', task)
+                try:
+                    for folder, _ in self._RULE_FOLDERS.itervalues():
+                        os.rmdir(os.path.join(task_path, folder))
+                    os.rmdir(task_path)
+                except OSError:
+                    print 'WARNING: The folder of a removed task was not empty and was kept - ' + task_path
+        
+        for pne in saved:
+            pne.edited = False
+        
+        self._directory_tasks, self._directory_files = self._scan_project_directory()
+        self._saved_file_path = self.file_path
+        self._saved_members = self._get_saved_members()
+        self._start_journal()
+        
+        print 'Wrote ' + str(len(saved)) + ' of ' + str(len(self.petri_nets)) + ' petri nets to the project directory.'
+        
+        self._update_state_bar('File saved: ' + self.file_path)
+    
+    def save_as_directory(self):
+        
+        if self._check_opening():
+            return
+        
+        dir_path = tkFileDialog.askdirectory(
+                                              title = 'Save as project directory...',
+                                              initialdir = os.path.dirname(self.file_path) if self.file_path is not None else os.path.expanduser('~/Desktop'),
+                                              mustexist = False
+                                            )
+        if not dir_path:
+            return
+        
+        if not os.path.isdir(dir_path):
+            try:
+                os.makedirs(dir_path)
+            except Exception as e:
+                tkMessageBox.showerror('Error creating directory.', 'The project directory could not be created.\n\n' + str(e))
+                return
+        
+        self.file_path = dir_path
+        
+        self.save()
     
     def save_as(self):
         
+        if self._check_opening():
+            return
+        
         default_path = os.path.expanduser('~/Desktop')
         ws_path = os.path.expanduser('~/Workspaces/CLIPS/Planning/Tasks/')
         if os.path.isdir(ws_path):
@@ -950,7 +2313,8 @@ class PNPDT(object):
         
         zip_filename = tkFileDialog.asksaveasfilename(
                                                   defaultextension = '.pnpdt',
-                                                  filetypes=[('Petri Net Plan Design Tool file', '*.pnpdt')],
+                                                  filetypes=[('Petri Net Plan Design Tool file', '*.pnpdt'),
+                                                             ('Petri Net Plan Design Tool database', '*' + projectdb.EXTENSION)],
                                                   title = 'Save as PNPDT file...',
                                                   initialdir = os.path.dirname(self.file_path) if self.file_path is not None else default_path,
                                                   initialfile = os.path.basename(self.file_path) if self.file_path is not None else ''
@@ -967,8 +2331,161 @@ class PNPDT(object):
             if not tkMessageBox.askokcancel('Exit without saving?', 'Are you sure you want to quit without saving any changes?', default = tkMessageBox.CANCEL):
                 return
         
+        self._stop_open()
+        self._close_journal(remove = True)
         self.root.destroy()
     
+    #######################################################
+    #                    EDIT JOURNAL
+    #######################################################
+    
+    def _get_journal_path(self):
+        return self.file_path.rstrip('/\\') + journal.EXTENSION
+    
+    def _get_journal_stamp(self):
+        """Returns the modification time and size of the project file, to tell whether the journal was written
+        after its last save. Project directories have no stamp, as their files are saved separately."""
+        
+        if os.path.isdir(self.file_path):
+            return None
+        return os.path.getmtime(self.file_path), os.path.getsize(self.file_path)
+    
+    def _journal_record(self, *record):
+        if self.edit_journal is not None:
+            self.edit_journal.append(record)
+    
+    def _close_journal(self, remove = False):
+        if self.edit_journal is None:
+            return
+        self.edit_journal.close(remove)
+        self.edit_journal = None
+    
+    def _start_journal(self, records = None):
+        """Starts a new journal for the edits made to the project as it was just opened or saved,
+        replacing the previous one.
+        
+        Keyword Arguments:
+        records -- Records recovered from the previous journal, which are written to the new one.
+                   Otherwise, the Petri Nets that are still edited (e. g. they could not be saved) are written.
+        """
+        
+        self._close_journal(remove = True)
+        self._journal_pending.clear()
+        for pne in self.petri_nets.itervalues():
+            del pne.mutations[:]
+        
+        if not JOURNAL_INTERVAL or self.file_path is None:
+            return
+        
+        try:
+            self.edit_journal = journal.EditJournal(self._get_journal_path(), self._get_journal_stamp(), JOURNAL_COMPACT_SIZE)
+        except Exception as e:
+            print 'WARNING: The journal of the project could not be created - ' + str(e)
+            return
+        
+        if records is not None:
+            for record in records:
+                self.edit_journal.append(record)
+        else:
+            self._journal_pending.update(item_id for item_id, pne in self.petri_nets.iteritems() if pne.edited)
+    
+    def _update_journal(self):
+        """Writes the Petri Nets that were edited since they were last written to the journal,
+        and schedules the next call.
+        
+        Only the model state is taken here, it is marshalled and written by the thread of the journal.
+        """
+        
+        if self.edit_journal is not None:
+            for item_id, pne in self.petri_nets.iteritems():
+                if not pne.mutations and item_id not in self._journal_pending:
+                    continue
+                
+                if isinstance(pne, _VirtualPNEditor):
+                    PNEditorClass = pne.PNEditorClass
+                else:
+                    PNEditorClass = pne.__class__
+                
+                try:
+                    state = pne._petri_net._get_model_state()
+                except Exception as e:
+                    print 'WARNING: A Petri Net could not be written to the journal - ' + item_id + ' - ' + str(e)
+                    continue
+                
+                self.edit_journal.append((journal.NET, item_id, PNEditorClass.__name__, tuple(pne.mutations), state))
+                del pne.mutations[:]
+            
+            self._journal_pending.clear()
+        
+        self.root.after(int(JOURNAL_INTERVAL*1000), self._update_journal)
+    
+    def _recover_journal(self):
+        """Replays the journal of the opened project if it has edits that were not saved, and the user wants to recover them.
+        
+        Returns the replayed records, or None if there were none.
+        """
+        
+        path = self._get_journal_path()
+        if not os.path.isfile(path):
+            return None
+        
+        try:
+            records = journal.fold_records(journal.read_journal(path))
+        except Exception as e:
+            print 'WARNING: The journal of the project could not be read - ' + str(e)
+            return None
+        
+        if not records or records[0][0] != journal.BASE or len(records) == 1:
+            return None
+        
+        if records[0][1] != self._get_journal_stamp():
+            print 'WARNING: The journal of the project was not recovered, the project was saved after it was written - ' + path
+            return None
+        
+        records = records[1:]
+        if not tkMessageBox.askyesno('Recover unsaved changes?', 'The project was closed without saving some of its changes, which were kept in its journal.\n\nDo you want to recover them?'):
+            return None
+        
+        for record in records:
+            try:
+                self._replay_journal_record(record)
+            except Exception as e:
+                print 'WARNING: A change could not be recovered from the journal - ' + str(record[:2]) + ' - ' + str(e)
+        
+        return records
+    
+    def _replay_journal_record(self, record):
+        
+        kind, item_id = record[:2]
+        
+        if kind == journal.TASK:
+            if not self.project_tree.exists(item_id):
+                self.clicked_element = 'Tasks/'
+                self.create_task(os.path.basename(item_id[:-1]), open_tree = False)
+        elif kind == journal.REMOVE_TASK:
+            if self.project_tree.exists(item_id):
+                self.clicked_element = item_id
+                self.delete_task()
+        elif kind == journal.REMOVE:
+            if item_id in self.petri_nets:
+                self.delete_petri_net(item_id)
+        elif kind == journal.NET:
+            _, _, editor_class_name, _, state = record
+            if item_id in self.petri_nets:
+                self.delete_petri_net(item_id)
+            
+            folder = item_id[:item_id.rfind('/') + 1]
+            if not self.project_tree.exists(folder):
+                task_item = folder[:folder[:-1].rfind('/') + 1]
+                self.clicked_element = 'Tasks/'
+                self.create_task(os.path.basename(task_item[:-1]), open_tree = False)
+            
+            PNEditorClass = self._EDITOR_CLASSES[editor_class_name]
+            self.clicked_element = folder
+            pne = self._add_virtual_pne(PNEditorClass, PetriNet = PNEditorClass.PetriNetClass._from_model_state(state))
+            if pne is not None:
+                pne.edited = True
+    
     #######################################################
     #                TOOLS MENU ACTIONS
     #######################################################
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+Headless batch conversion of PNML files into Petri Net objects.
+
+Files are parsed in a pool of worker processes, which send the nets back
+to the parent process as model states (see BasicPetriNet._get_model_state).
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from petrinets import BasicPetriNet, RulePN, DexecPN, FinalizationPN, CancelationPN
+
+PETRI_NET_KINDS = {
+                   'basic': BasicPetriNet,
+                   'generic': RulePN,
+                   'dexec': DexecPN,
+                   'finalizing': FinalizationPN,
+                   'canceling': CancelationPN
+                   }
+
+# Same extensions used by PNPDT when saving rules.
+_EXTENSIONS = [('.dx.pnml', DexecPN),
+               ('.f.pnml', FinalizationPN),
+               ('.c.pnml', CancelationPN),
+               ('.g.pnml', RulePN)]
+
+def get_petri_net_class(file_name):
+    """Returns the Petri Net class corresponding to the extension of a PNML file."""
+    
+    for ext, PetriNetClass in _EXTENSIONS:
+        if file_name.endswith(ext):
+            return PetriNetClass
+    return BasicPetriNet
+
+def _get_output_name(file_name, index, count):
+    """Returns the name of the output file of the net in position 'index' of the 'count' nets read from a PNML file.
+    
+    If the file has more than one net, the index is appended to its name, before its extension.
+    """
+    
+    base_name = os.path.basename(file_name)
+    if count == 1:
+        return base_name
+    
+    pos = base_name.find('.')
+    if pos < 0:
+        pos = len(base_name)
+    return '{0}_{1}{2}'.format(base_name[:pos], index, base_name[pos:])
+
+def _convert_file(args):
+    """Worker function. Returns (file_name, model_states, elapsed_time, error_message)."""
+    
+    file_name, PetriNetClass, task = args
+    
+    start = time.time()
+    try:
+        if PetriNetClass is None:
+            PetriNetClass = get_petri_net_class(file_name)
+        if PetriNetClass is BasicPetriNet:
+            petri_nets = BasicPetriNet.from_pnml_file(file_name)
+        else:
+            if not task and PetriNetClass is not RulePN:
+                raise Exception('A task name is needed to load ' + PetriNetClass.__name__ + ' rules.')
+            petri_nets = PetriNetClass.from_pnml_file(file_name, task)
+        states = [pn._get_model_state() for pn in petri_nets]
+    except Exception as e:
+        return (file_name, None, time.time() - start, str(e))
+    
+    return (file_name, states, time.time() - start, None)
+
+def convert_files(file_names, PetriNetClass = None, task = None, processes = None):
+    """Converts PNML files into Petri Net objects in a pool of processes.
+    
+    Yields a tuple (file_name, petri_nets, elapsed_time, error_message) for each file,
+    in the same order as 'file_names'. If a file could not be converted,
+    petri_nets is None and error_message describes the problem; the rest of the files are still converted.
+    
+    Keyword Arguments:
+    PetriNetClass -- Class of the Petri Nets to create. If None, it is chosen from each file's extension.
+    task -- Task name for planning rules (Dexec, Finalizing and Canceling rules).
+    processes -- Number of worker processes (default: number of CPUs).
+    """
+    
+    pool = multiprocessing.Pool(processes)
+    try:
+        args = [(file_name, PetriNetClass, task) for file_name in file_names]
+        for file_name, states, elapsed, error in pool.imap(_convert_file, args):
+            petri_nets = None
+            if states is not None:
+                petri_nets = [BasicPetriNet._from_model_state(state) for state in states]
+            yield (file_name, petri_nets, elapsed, error)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def main(argv = None):
+    
+    parser = argparse.ArgumentParser(description = 'Converts PNML files into Petri Net objects in parallel.')
+    parser.add_argument('files', nargs = '+', metavar = 'FILE', help = 'PNML files to convert.')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'Number of worker processes (default: number of CPUs).')
+    parser.add_argument('-k', '--kind', choices = sorted(PETRI_NET_KINDS.keys()), default = None,
+                        help = 'Kind of rule in all files (default: chosen from each file extension).')
+    parser.add_argument('-t', '--task', default = None, help = 'Task name for Dexec, Finalizing and Canceling rules.')
+    parser.add_argument('-o', '--output-dir', default = None, help = 'Directory where converted nets are saved as PNML files.')
+    args = parser.parse_args(argv)
+    
+    PetriNetClass = None
+    if args.kind:
+        PetriNetClass = PETRI_NET_KINDS[args.kind]
+    
+    if args.output_dir and not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    
+    start = time.time()
+    errors = 0
+    
+    for file_name, petri_nets, elapsed, error in convert_files(args.files, PetriNetClass, args.task, args.jobs):
+        if error is not None:
+            errors += 1
+            print '{0:>8.3f} s  ERROR  {1}: {2}'.format(elapsed, file_name, error)
+            continue
+        
+        print '{0:>8.3f} s  OK     {1} ({2} net(s))'.format(elapsed, file_name, len(petri_nets))
+        
+        if args.output_dir:
+            for i, pn in enumerate(petri_nets):
+                # Nets rebuilt from model states have no node or arc elements, so they are written from the model.
+                pn.to_pnml_file(os.path.join(args.output_dir, _get_output_name(file_name, i, len(petri_nets))), streaming = True)
+    
+    print 'Converted {0} of {1} files in {2:.3f} s.'.format(len(args.files) - errors, len(args.files), time.time() - start)
+    
+    return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+Benchmarks of loading and saving Petri Nets.
+
+Run without arguments (or with a list of sizes) for the namespace, from_ElementTree and memory benchmarks,
+with --scale for the load/save scale suite, which records its results to a JSON file,
+or with --save to compare serializing the rules of a project in pools of threads and processes.
+"""
+
+import argparse
+import copy
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from multiprocessing.pool import ThreadPool
+
+import lxml.etree as ET
+
+from petrinets import BasicPetriNet, RulePN, DexecPN, _remove_namespaces, _remove_namespaces_xslt
+from nodes import Place, Transition, FactPlace, TaskPlace, RuleTransition
+from utils import Vec2
+
+SIZES = [250, 500, 1000, 2000, 4000, 8000]
+
+SCALE_SIZES = [10, 100, 1000, 10000, 100000]
+SCALE_CLASSES = {'RulePN': RulePN, 'DexecPN': DexecPN}
+SCALE_OPERATIONS = ['from_pnml_file', 'from_ElementTree', 'to_ElementTree', 'to_pnml_file']
+SCALE_TASK = 'benchmark_task'
+
+SAVE_SIZES = [100, 1000, 10000]
+SAVE_NETS = 32
+
+def build_net_tree(n_places, n_transitions, arcs_per_transition = 2, seed = 0):
+    """Builds a synthetic (namespace-free) PNML ElementTree with the given number of nodes."""
+    
+    rnd = random.Random(seed)
+    
+    root = ET.Element('pnml')
+    net = ET.SubElement(root, 'net', {'id': 'benchmark', 'type': 'http://www.pnml.org/version-2009/grammar/ptnet'})
+    ET.SubElement(ET.SubElement(net, 'name'), 'text').text = 'benchmark'
+    page = ET.SubElement(net, 'page', {'id': 'page'})
+    
+    for i in range(n_places):
+        place = ET.SubElement(page, 'place', {'id': 'p' + str(i)})
+        ET.SubElement(ET.SubElement(place, 'name'), 'text').text = 'regular.place_' + str(i)
+        ET.SubElement(ET.SubElement(place, 'graphics'), 'position', {'x': str(i), 'y': str(i)})
+    
+    for i in range(n_transitions):
+        transition = ET.SubElement(page, 'transition', {'id': 't' + str(i)})
+        ET.SubElement(ET.SubElement(transition, 'name'), 'text').text = 'regular.transition_' + str(i)
+        ET.SubElement(ET.SubElement(transition, 'graphics'), 'position', {'x': str(i), 'y': str(i)})
+    
+    for i in range(n_transitions):
+        for p in rnd.sample(xrange(n_places), min(arcs_per_transition, n_places)):
+            if rnd.random() < 0.5:
+                source, target = 'p' + str(p), 't' + str(i)
+            else:
+                source, target = 't' + str(i), 'p' + str(p)
+            ET.SubElement(page, 'arc', {'id': source + '_' + target, 'source': source, 'target': target})
+    
+    return ET.ElementTree(root)
+
+def build_petri_net(n_places, n_transitions, arcs_per_transition = 2, seed = 0):
+    """Builds a synthetic Petri Net with the given number of nodes, as if it had been drawn with the tool."""
+    
+    rnd = random.Random(seed)
+    
+    pn = BasicPetriNet('benchmark')
+    places = []
+    for i in range(n_places):
+        p = Place('place_' + str(i), Vec2(i, i))
+        pn.add_place(p)
+        places.append(p)
+    
+    for i in range(n_transitions):
+        t = Transition('transition_' + str(i), Vec2(i, i))
+        pn.add_transition(t)
+        for p in rnd.sample(places, min(arcs_per_transition, n_places)):
+            if rnd.random() < 0.5:
+                pn.add_arc(p, t)
+            else:
+                pn.add_arc(t, p)
+    
+    return pn
+
+def build_pnml_bytes(n_places, n_transitions, arcs_per_transition = 2, seed = 0):
+    """Returns a synthetic PNML document, with the PNML namespace, as a string."""
+    
+    et = build_net_tree(n_places, n_transitions, arcs_per_transition, seed)
+    return ET.tostring(et, xml_declaration = True, encoding = 'utf-8').replace('<pnml>', '<pnml xmlns="http://www.pnml.org/version-2009/grammar/pnml">', 1)
+
+def time_from_ElementTree(size, repeat = 3):
+    """Returns the best time (in seconds) to load a synthetic net with 'size' nodes."""
+    
+    et = build_net_tree(size/2, size/2)
+    trees = [copy.deepcopy(et) for _ in range(repeat)]
+    
+    # from_ElementTree renames the tree it receives, so each run gets its own copy.
+    return min(timeit.repeat(lambda: BasicPetriNet.from_ElementTree(trees.pop()), number = 1, repeat = repeat))
+
+def time_remove_namespaces(size, repeat = 3):
+    """Returns the best times (in seconds) to parse a synthetic PNML document with 'size' nodes
+    and remove its namespace, with the XSLT transform and in place."""
+    
+    data = build_pnml_bytes(size/2, size/2)
+    
+    xslt = min(timeit.repeat(lambda: _remove_namespaces_xslt(ET.fromstring(data).getroottree()), number = 1, repeat = repeat))
+    in_place = min(timeit.repeat(lambda: _remove_namespaces(ET.fromstring(data).getroottree()), number = 1, repeat = repeat))
+    
+    return xslt, in_place
+
+def _get_rss():
+    """Returns the resident set size of this process, in bytes (Linux only)."""
+    
+    f = open('/proc/self/statm')
+    pages = int(f.read().split()[1])
+    f.close()
+    return pages*os.sysconf('SC_PAGE_SIZE')
+
+def _reset_peak_rss():
+    """Resets the peak resident set size of this process (Linux only)."""
+    
+    f = open('/proc/self/clear_refs', 'w')
+    f.write('5')
+    f.close()
+
+def _get_peak_rss():
+    """Returns the peak resident set size of this process, in bytes (Linux only)."""
+    
+    f = open('/proc/self/status')
+    try:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])*1024
+    finally:
+        f.close()
+
+def _load_project(file_names, release_tree):
+    """Loads all the files of a project, returns the memory (in bytes) taken by the loaded nets."""
+    
+    gc.collect()
+    before = _get_rss()
+    petri_nets = [BasicPetriNet.from_pnml_file(file_name, release_tree = release_tree) for file_name in file_names]
+    gc.collect()
+    return _get_rss() - before
+
+def memory_project(n_nets, size):
+    """Returns the memory (in bytes) taken by a synthetic project of n_nets nets with 'size' nodes each,
+    keeping the trees of the nets and releasing them after loading (see BasicPetriNet.release_tree)."""
+    
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        file_names = []
+        for i in range(n_nets):
+            file_name = os.path.join(tmp_dir, 'rule_' + str(i) + '.pnml')
+            build_petri_net(size/2, size/2, seed = i).to_pnml_file(file_name)
+            file_names.append(file_name)
+        
+        # Each project is loaded in a new process, so memory freed by a previous load is not reused.
+        results = []
+        for release_tree in [False, True]:
+            pool = multiprocessing.Pool(1)
+            results.append(pool.apply(_load_project, (file_names, release_tree)))
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(tmp_dir)
+    
+    return tuple(results)
+
+def build_rule_tree(PetriNetClass, n_places, n_transitions, arc_density = 2.0, references = 0.0, pages = 1,
+                    task = SCALE_TASK, seed = 0):
+    """Builds a synthetic PNML ElementTree of a rule, with its nodes in the form the tool saves them.
+    
+    The first transition is the rule transition and, for planning rules (e. g. DexecPN),
+    the first place is the task place, connected to it.
+    
+    Keyword Arguments:
+    arc_density -- Average number of arcs per transition.
+    references -- Fraction of the places and transitions that also get a reference node,
+                  in the next page, which half of the arcs to the node go through.
+    pages -- Number of pages the nodes are spread over. Each page is nested in the previous one.
+    """
+    
+    rnd = random.Random(seed)
+    is_planning_rule = issubclass(PetriNetClass, DexecPN)
+    
+    root = ET.Element('pnml')
+    net = ET.SubElement(root, 'net', {'id': 'benchmark', 'type': 'http://www.pnml.org/version-2009/grammar/ptnet'})
+    ET.SubElement(ET.SubElement(net, 'name'), 'text').text = 'benchmark'
+    
+    page_els = []
+    parent = net
+    for i in range(max(1, pages)):
+        parent = ET.SubElement(parent, 'page', {'id': 'page_' + str(i)})
+        page_els.append(parent)
+    
+    # Ids of the nodes, or of one of their references, that arcs can use.
+    place_ids = []
+    for i in range(n_places):
+        if i == 0 and is_planning_rule:
+            p = TaskPlace(task, Vec2(i, i))
+        else:
+            p = FactPlace('fact_' + str(i), Vec2(i, i))
+        p._id = 'p' + str(i)
+        page_els[i % len(page_els)].append(p._create_treeElement())
+        place_ids.append([p._id])
+    
+    transition_ids = []
+    for i in range(n_transitions):
+        if i == 0:
+            t = RuleTransition('rule', Vec2(i, i))
+        else:
+            t = Transition('transition_' + str(i), Vec2(i, i))
+        t._id = 't' + str(i)
+        page_els[i % len(page_els)].append(t._create_treeElement())
+        transition_ids.append([t._id])
+    
+    for tag, node_ids, prefix in [('referencePlace', place_ids, 'rp'), ('referenceTransition', transition_ids, 'rt')]:
+        for i, ids in enumerate(node_ids):
+            if rnd.random() < references:
+                ref_id = prefix + str(i)
+                ET.SubElement(page_els[(i + 1) % len(page_els)], tag, {'id': ref_id, 'ref': ids[0]})
+                ids.append(ref_id)
+    
+    def add_arc(source_ids, target_ids):
+        source, target = rnd.choice(source_ids), rnd.choice(target_ids)
+        ET.SubElement(page_els[0], 'arc', {'id': source + '_' + target, 'source': source, 'target': target})
+    
+    # The task place of planning rules connects only to the rule transition.
+    first_place = 0
+    if is_planning_rule and n_places and n_transitions:
+        # Without references, which are not followed when looking for the task place.
+        add_arc(place_ids[0][:1], transition_ids[0][:1])
+        first_place = 1
+    candidates = range(first_place, n_places)
+    
+    for i in range(n_transitions):
+        n_arcs = int(arc_density)
+        if rnd.random() < arc_density - n_arcs:
+            n_arcs += 1
+        for p in rnd.sample(candidates, min(n_arcs, len(candidates))):
+            if rnd.random() < 0.5:
+                add_arc(place_ids[p], transition_ids[i])
+            else:
+                add_arc(transition_ids[i], place_ids[p])
+    
+    return ET.ElementTree(root)
+
+def _measure(setup, operation, repeat):
+    """Runs 'operation' on the result of 'setup' in a new process, 'repeat' times.
+    
+    Returns the best time (in seconds) and the highest increase of the peak resident set size (in bytes)
+    over the memory in use before each run. Setup is neither timed nor measured.
+    """
+    
+    queue = multiprocessing.Queue()
+    
+    def run():
+        try:
+            best_time = None
+            peak_memory = 0
+            for _ in range(repeat):
+                arg = setup()
+                gc.collect()
+                _reset_peak_rss()
+                before = _get_rss()
+                start = time.time()
+                operation(arg)
+                elapsed = time.time() - start
+                peak_memory = max(peak_memory, _get_peak_rss() - before)
+                if best_time is None or elapsed < best_time:
+                    best_time = elapsed
+            queue.put((best_time, peak_memory, None))
+        except Exception as e:
+            queue.put((None, None, str(e)))
+    
+    # On Linux the child process is forked, so setup and operation do not need to be picklable.
+    process = multiprocessing.Process(target = run)
+    process.start()
+    best_time, peak_memory, error = queue.get()
+    process.join()
+    if error is not None:
+        raise Exception(error)
+    
+    return best_time, peak_memory
+
+def time_scale(PetriNetClass, size, file_name, repeat):
+    """Times loading and saving the PNML file of a synthetic rule (see build_rule_tree).
+    
+    Returns a dictionary with the best time and peak memory of each operation in SCALE_OPERATIONS.
+    """
+    
+    task = None
+    if issubclass(PetriNetClass, DexecPN):
+        task = SCALE_TASK
+    
+    def parse():
+        return _remove_namespaces(ET.parse(file_name))
+    
+    def load():
+        return PetriNetClass.from_pnml_file(file_name, task)[0]
+    
+    out_file_name = file_name + '.out.pnml'
+    
+    operations = {
+                  'from_pnml_file': (lambda: None, lambda _: load()),
+                  'from_ElementTree': (parse, lambda et: PetriNetClass.from_ElementTree(et, name = 'benchmark', PetriNetClass = PetriNetClass, task = task)),
+                  'to_ElementTree': (load, lambda pn: pn.to_ElementTree()),
+                  'to_pnml_file': (load, lambda pn: pn.to_pnml_file(out_file_name))
+                  }
+    
+    results = {}
+    for operation in SCALE_OPERATIONS:
+        results[operation] = _measure(operations[operation][0], operations[operation][1], repeat)
+    
+    if os.path.exists(out_file_name):
+        os.remove(out_file_name)
+    
+    return results
+
+def run_scale_suite(sizes = SCALE_SIZES, class_names = sorted(SCALE_CLASSES.keys()), arc_density = 2.0,
+                    references = 0.0, pages = 1, output = 'benchmark_results.json'):
+    """Times loading and saving synthetic rules of each class and size, and writes the results to a JSON file."""
+    
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for class_name in class_names:
+            PetriNetClass = SCALE_CLASSES[class_name]
+            
+            print class_name
+            print '{0:>8} {1:>18} {2:>10} {3:>12} {4:>12}'.format('nodes', 'operation', 'time (s)', 'us / node', 'peak (MB)')
+            for size in sizes:
+                n_places = size/2
+                et = build_rule_tree(PetriNetClass, n_places, size - n_places, arc_density, references, pages)
+                file_name = os.path.join(tmp_dir, class_name + '_' + str(size) + '.pnml')
+                et.write(file_name, encoding = 'utf-8', xml_declaration = True, pretty_print = True)
+                del et
+                
+                repeat = 3 if size <= 10000 else 1
+                timings = time_scale(PetriNetClass, size, file_name, repeat)
+                
+                for operation in SCALE_OPERATIONS:
+                    elapsed, peak_memory = timings[operation]
+                    print '{0:>8d} {1:>18} {2:>10.4f} {3:>12.2f} {4:>12.2f}'.format(size, operation, elapsed,
+                                                                                    elapsed*1e6/size, peak_memory/1048576.0)
+                    results.append({
+                                    'class': class_name,
+                                    'nodes': size,
+                                    'operation': operation,
+                                    'time': elapsed,
+                                    'peak_memory': peak_memory,
+                                    'file_size': os.path.getsize(file_name),
+                                    'repeat': repeat
+                                    })
+                os.remove(file_name)
+            print
+    finally:
+        shutil.rmtree(tmp_dir)
+    
+    f = open(output, 'w')
+    json.dump({
+               'python': platform.python_version(),
+               'lxml': ET.__version__,
+               'platform': platform.platform(),
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'parameters': {
+                              'arc_density': arc_density,
+                              'references': references,
+                              'pages': pages
+                              },
+               'results': results
+               }, f, indent = 2, sort_keys = True)
+    f.close()
+    
+    print 'Results written to: ' + output
+    
+    return results
+
+def _run_thread_jobs(jobs, threads):
+    """Runs a list of (function, args) jobs as PNPlanDesignTool._run_jobs, in a pool of threads instead of processes."""
+    
+    pool = ThreadPool(threads)
+    try:
+        return pool.map(lambda job: job[0](*job[1]), jobs, chunksize = 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def time_save(n_nets, size, workers, repeat = 3):
+    """Times serializing 'n_nets' synthetic rules (as when saving a project) in pools of threads and of processes.
+    
+    Returns the best time (in seconds) with each number of threads and with each number of processes in 'workers'.
+    """
+    
+    # The main module pulls the Tk widgets in, so it is only imported for this benchmark.
+    from PNPlanDesignTool import _run_jobs, _serialize_petri_net
+    
+    n_places = size/2
+    nets = [DexecPN.from_ElementTree(build_rule_tree(DexecPN, n_places, size - n_places, task = SCALE_TASK),
+                                     name = 'rule' + str(i), PetriNetClass = DexecPN, task = SCALE_TASK)[0]
+            for i in range(n_nets)]
+    jobs = [(_serialize_petri_net, (pn,)) for pn in nets]
+    
+    def best_time(run, n):
+        return min(timeit.repeat(lambda: run(jobs, n), number = 1, repeat = repeat))
+    
+    thread_times = [best_time(_run_thread_jobs, n) for n in workers]
+    process_times = [best_time(_run_jobs, n) for n in workers]
+    
+    return thread_times, process_times
+
+def run_save_suite(sizes = SAVE_SIZES, n_nets = SAVE_NETS):
+    """Prints the speedup of serializing the rules of a project with more threads and with more processes."""
+    
+    workers = [1]
+    while workers[-1]*2 <= multiprocessing.cpu_count():
+        workers.append(workers[-1]*2)
+    
+    print 'Serializing ' + str(n_nets) + ' rules (' + str(multiprocessing.cpu_count()) + ' CPUs)'
+    print '{0:>8} {1:>8} {2:>12} {3:>10} {4:>14} {5:>10}'.format('nodes', 'workers', 'threads (s)', 'speedup', 'processes (s)', 'speedup')
+    for size in sizes:
+        thread_times, process_times = time_save(n_nets, size, workers)
+        for n, thread_time, process_time in zip(workers, thread_times, process_times):
+            print '{0:>8d} {1:>8d} {2:>12.4f} {3:>10.2f} {4:>14.4f} {5:>10.2f}'.format(size, n, thread_time, thread_times[0]/thread_time,
+                                                                                     process_time, process_times[0]/process_time)
+
+def main(sizes = SIZES):
+    
+    print 'from_ElementTree'
+    print '{0:>8} {1:>10} {2:>12}'.format('nodes', 'load (s)', 'us / node')
+    for size in sizes:
+        elapsed = time_from_ElementTree(size)
+        print '{0:>8d} {1:>10.4f} {2:>12.2f}'.format(size, elapsed, elapsed*1e6/size)
+    
+    print
+    print 'Parsing and removing the PNML namespace'
+    print '{0:>8} {1:>10} {2:>12}'.format('nodes', 'xslt (s)', 'in place (s)')
+    for size in [10] + sizes:
+        xslt, in_place = time_remove_namespaces(size)
+        print '{0:>8d} {1:>10.4f} {2:>12.4f}'.format(size, xslt, in_place)
+    
+    print
+    print 'Memory of a project of 200 nets, keeping and releasing their trees'
+    print '{0:>8} {1:>12} {2:>12}'.format('nodes', 'kept (MB)', 'released (MB)')
+    for size in [10, 50, 100, 250]:
+        kept, released = memory_project(200, size)
+        print '{0:>8d} {1:>12.2f} {2:>12.2f}'.format(size, kept/1048576.0, released/1048576.0)
+
+if __name__ == '__main__':
+    
+    parser = argparse.ArgumentParser(description = 'Benchmarks of loading and saving Petri Nets.')
+    parser.add_argument('sizes', nargs = '*', type = int, metavar = 'SIZE', help = 'Number of nodes of the benchmark nets.')
+    parser.add_argument('-s', '--scale', action = 'store_true', help = 'Run the load/save scale suite.')
+    parser.add_argument('--save', action = 'store_true', help = 'Compare serializing rules in pools of threads and processes.')
+    parser.add_argument('-c', '--classes', nargs = '+', choices = sorted(SCALE_CLASSES.keys()), default = sorted(SCALE_CLASSES.keys()),
+                        help = 'Classes of the rules of the scale suite.')
+    parser.add_argument('-a', '--arc-density', type = float, default = 2.0, help = 'Average number of arcs per transition (scale suite).')
+    parser.add_argument('-r', '--references', type = float, default = 0.0, help = 'Fraction of nodes with a reference node (scale suite).')
+    parser.add_argument('-p', '--pages', type = int, default = 1, help = 'Number of nested pages (scale suite).')
+    parser.add_argument('-o', '--output', default = 'benchmark_results.json', help = 'JSON file for the results of the scale suite.')
+    args = parser.parse_args()
+    
+    if args.scale:
+        run_scale_suite(args.sizes or SCALE_SIZES, args.classes, args.arc_density, args.references, args.pages, args.output)
+    elif args.save:
+        run_save_suite(args.sizes or SAVE_SIZES)
+    else:
+        main(args.sizes or SIZES)
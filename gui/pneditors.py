@@ -64,6 +64,8 @@ class BasicPNEditor(Tkinter.Canvas):
         self._label_transitions = kwargs.pop('label_transitions', False)
         
         self._create_petri_net(kwargs)
+        # The editor draws and edits every node, so the pages that are still pending are loaded (see BasicPetriNet.load_pages).
+        self._petri_net.load_pages()
         
         Tkinter.Canvas.__init__(self, parent, *args, **kwargs)
         
@@ -90,6 +92,10 @@ class BasicPNEditor(Tkinter.Canvas):
         
         self._current_grid_size = self._GRID_SIZE
         
+        # Kinds of the edits made to the Petri Net since they were last taken from the editor
+        # (e. g. to write them to a journal), see _record_mutation.
+        self.mutations = []
+        
         self.set_petri_net(self._petri_net)
         
         ################################
@@ -594,6 +600,7 @@ class BasicPNEditor(Tkinter.Canvas):
             self._draw_arc(action[2])
                 
         
+        self._record_mutation('undo_' + action[0])
         self._redo_queue.append(action)
     
     def _redo(self, event):
@@ -733,6 +740,7 @@ class BasicPNEditor(Tkinter.Canvas):
             action[3] = w
             self._draw_arc(action[2])
         
+        self._record_mutation('redo_' + action[0])
         self._undo_queue.append(action)
     
     def _add_to_undo(self, action):
@@ -741,6 +749,22 @@ class BasicPNEditor(Tkinter.Canvas):
         if len(self._undo_queue) > 50:
             self._undo_queue.pop(0)
         self._redo_queue = []
+        self._record_mutation(action[0])
+    
+    def _record_mutation(self, kind):
+        """Records the kind of an edit made to the Petri Net model (e. g. 'create_place', 'move_node' or 'undo_rename_place')."""
+        
+        self.mutations.append(kind)
+        if len(self.mutations) > 1000:
+            self.mutations.pop(0)
+    
+    def _set_edited(self):
+        """Marks the Petri Net as edited, recording an 'edit' mutation unless one was recorded since the mutations
+        were last taken, so that the edits that are not added to the undo queue (e. g. panning the work area) are recorded too."""
+        
+        self.edited = True
+        if not self.mutations:
+            self._record_mutation('edit')
     
     @property
     def petri_net(self):
@@ -770,7 +794,9 @@ class BasicPNEditor(Tkinter.Canvas):
         Check PetriNet saved attribute, before changing the Petri Net
         or destroying the widget.
         '''
+        newPN.load_pages()
         self._petri_net = newPN
+        # Loading a Petri Net is not an edit to it, so no mutation is recorded.
         self.edited = True
         self._undo_queue = []
         self._redo_queue = []
@@ -793,7 +819,7 @@ class BasicPNEditor(Tkinter.Canvas):
         self._petri_net.add_place(p)
         self._draw_place(p)
         
-        self.edited = True
+        self._set_edited()
     
     def add_transition(self, t):
         """Adds a transition to the Petri Net and draws it.
@@ -806,7 +832,7 @@ class BasicPNEditor(Tkinter.Canvas):
         self._petri_net.add_transition(t)
         self._draw_transition(t)
         
-        self.edited = True
+        self._set_edited()
     
     def add_arc(self, source, target = None, weight = 1, **kwargs):
         """Adds an arc to the PetriNet object and draws it."""
@@ -814,7 +840,7 @@ class BasicPNEditor(Tkinter.Canvas):
         arc = self._petri_net.add_arc(source, target, weight, kwargs.pop('_treeElement', None))
         
         self._draw_arc(arc)
-        self.edited = True
+        self._set_edited()
     
     def remove_place(self, p):
         """Removes the place from the Petri Net.
@@ -833,7 +859,7 @@ class BasicPNEditor(Tkinter.Canvas):
         self.delete('place_' + repr(p))
         self.delete('source_' + repr(p))
         self.delete('target_' + repr(p))
-        self.edited = True
+        self._set_edited()
         return p
     
     def remove_transition(self, t):
@@ -853,14 +879,14 @@ class BasicPNEditor(Tkinter.Canvas):
         self.delete('transition_' + repr(t))
         self.delete('source_' + repr(t))
         self.delete('target_' + repr(t))
-        self.edited = True
+        self._set_edited()
         return t
     
     def remove_arc(self, source, target):
         """Removes an arc from the PetriNet object and from the canvas widget.""" 
         self._petri_net.remove_arc(source, target)
         self.delete('source_' + repr(source) + '&&' + 'target_' + repr(target))
-        self.edited = True
+        self._set_edited()
     
     def _resize(self, event):
         self._draw_grid()
@@ -953,7 +979,8 @@ class BasicPNEditor(Tkinter.Canvas):
         
         self._petri_net.scale = self._current_scale*scale_factor
         
-        self.edited = True
+        self._set_edited()
+        self._record_mutation('center')
         self._draw_petri_net()
     
     def _draw_grid(self):
@@ -1282,7 +1309,7 @@ class BasicPNEditor(Tkinter.Canvas):
         self._draw_item_arcs(t)
         
         self._add_to_undo(['switch_orientation', "Switch transition's orientation.", repr(t)])
-        self.edited = True
+        self._set_edited()
         
     def _set_initial_marking(self):
         """Menu callback to set the initial marking of a Place."""
@@ -1314,7 +1341,7 @@ class BasicPNEditor(Tkinter.Canvas):
         if dialog.value_set and p.capacity != int(dialog.input_var.get()):
             self._add_to_undo(['set_capacity', 'Set Place capacity.', repr(p), p.capacity])
             p.capacity = int(dialog.input_var.get())
-            self.edited = True
+            self._set_edited()
     
     def _set_rate(self):
         """Menu callback to set the rate of a Transition."""
@@ -1328,7 +1355,7 @@ class BasicPNEditor(Tkinter.Canvas):
         if dialog.value_set and t.rate != float(dialog.input_var.get()):
             self._add_to_undo(['set_rate', 'Set Transition Rate.', repr(t), t.rate])
             t.rate = float(dialog.input_var.get())
-            self.edited = True
+            self._set_edited()
     
     def _set_priority(self):
         """Menu callback to set the priority of a Transition."""
@@ -1343,7 +1370,7 @@ class BasicPNEditor(Tkinter.Canvas):
         if dialog.value_set and t.priority != int(dialog.input_var.get()):
             self._add_to_undo(['set_priority', 'Set Transition priority.', repr(t), t.priority])
             t.priority = int(dialog.input_var.get())
-            self.edited = True
+            self._set_edited()
     
     def _set_weight(self, new_weight = None):
         """Menu callback to set the weight of an arc."""
@@ -1385,7 +1412,7 @@ class BasicPNEditor(Tkinter.Canvas):
         self._add_to_undo(['set_weight', 'Set Arc weight.', arc, arc.weight])
         arc.weight = new_weight
         self._draw_arc(arc)
-        self.edited = True
+        self._set_edited()
     
     def _get_weight(self, arc):
         dialog = PositiveIntDialog("Set arc's weight", 'Write a positive integer for \nthe weight of arc: ' + str(arc), 'Weight', init_value = arc.weight)
@@ -1411,7 +1438,7 @@ class BasicPNEditor(Tkinter.Canvas):
                 tkMessageBox.showerror('Invalid Marking', msg)
             if p.init_marking != new_val:
                 self._add_to_undo(['set_init_marking', 'Set initial marking.', repr(p), p.init_marking])
-                self.edited = True
+                self._set_edited()
             p.init_marking = new_val
             self._draw_marking(canvas_id, p)
             txtbox.grab_release()
@@ -1681,7 +1708,7 @@ class BasicPNEditor(Tkinter.Canvas):
                              tags=tags,
                              font = self.text_font )
             
-            self.edited = True
+            self._set_edited()
             txtbox.grab_release()
             txtbox.destroy()
             self.focus_set()
@@ -1719,7 +1746,7 @@ class BasicPNEditor(Tkinter.Canvas):
                                  tags=tags,
                                  font = self.text_font )
             self._add_to_undo(['create_transition', 'Create Transition.', t, Vec2(self._offset), self._current_scale])
-            self.edited = True
+            self._set_edited()
             txtbox.grab_release()
             txtbox.destroy()
             self.focus_set()
@@ -1759,7 +1786,7 @@ class BasicPNEditor(Tkinter.Canvas):
                              tags=tags,
                              font = self.text_font )
             self._add_to_undo(['rename_place', 'Rename Place', p, old_name])
-            self.edited = True
+            self._set_edited()
             txtbox.grab_release()
             txtbox.destroy()
             self.focus_set()
@@ -1790,7 +1817,7 @@ class BasicPNEditor(Tkinter.Canvas):
                                  tags=tags,
                                  font = self.text_font )
             self._add_to_undo(['rename_transition', 'Rename Transition.', t, old_name])
-            self.edited = True
+            self._set_edited()
             txtbox.grab_release()
             txtbox.destroy()
             self.focus_set()
@@ -2119,7 +2146,8 @@ class BasicPNEditor(Tkinter.Canvas):
         if self._grid:
             self._grid_offset = (e + (self._grid_offset - e)*scale_factor).int
             self._draw_grid()
-        self.edited = True
+        self._set_edited()
+        self._record_mutation('scale')
     
     def _scale_down(self, event):
         """Callback for the wheel-scroll to scale the canvas elements to look like a zoom-out."""
@@ -2141,7 +2169,8 @@ class BasicPNEditor(Tkinter.Canvas):
         if self._grid:
             self._grid_offset = (e + (self._grid_offset - e)*scale_factor).int
             self._draw_grid()
-        self.edited = True
+        self._set_edited()
+        self._record_mutation('scale')
     
     def _scale_canvas(self, event):
         """Callback for handling the wheel-scroll event in different platforms."""
@@ -2346,7 +2375,7 @@ class BasicPNEditor(Tkinter.Canvas):
             self._moved_vec += diff
             self._draw_item_arcs(self._anchor_node)
         
-        self.edited = True
+        self._set_edited()
         self._last_point = Vec2(event.x, event.y)
         
         
@@ -102,7 +102,7 @@ class testWindow(object):
             return
         
         try:
-            self.pne.petri_net.to_pnml_file(filename)
+            self.pne._petri_net.to_pnml_file(filename)
         except Exception as e:
             tkMessageBox.showerror('Error saving PNML file.', 'An error occurred while saving the PNML file.\n\n' + str(e))
     
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+Append-only journal of the edits made to a project since it was last saved.
+
+Records are tuples of plain values, which are marshalled, compressed and appended to the journal file
+by a background thread, so that writing them does not block the UI. Each record is preceded by its
+length and CRC-32, so a record that was only partially written (e. g. if the tool crashed) is detected
+and ignored, along with anything after it. The first record is always a BASE record, with the stamp
+of the saved project the edits were made on.
+
+Kinds of records:
+    (BASE, stamp) -- Stamp of the saved project (see PNPDT._get_journal_stamp).
+    (TASK, item_id) -- A task was added to the project.
+    (REMOVE_TASK, item_id) -- A task was removed from the project.
+    (NET, item_id, editor_class_name, mutations, state) -- A Petri Net was added or edited. mutations
+        are the kinds of edits made to it since its last record and state is its model state
+        (see BasicPetriNet._get_model_state), with the PNML of the net if it has contents
+        the model does not keep (e. g. reference nodes or pages).
+    (REMOVE, item_id) -- A Petri Net was removed from the project.
+
+When the journal grows beyond its maximum size, it is compacted by the background thread,
+folding its records so that only the last one of each task and Petri Net is kept (see fold_records).
+"""
+
+import marshal
+import os
+import Queue
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+EXTENSION = '.journal'
+
+BASE = 'base'
+TASK = 'task'
+REMOVE_TASK = 'remove_task'
+NET = 'net'
+REMOVE = 'remove'
+
+# The version in the magic string changes with the format of model states (see petrinets.SNAPSHOT_VERSION).
+_MAGIC = 'PNPDTJ02'
+# Length and CRC-32 of the compressed record.
+_RECORD_HEADER = struct.Struct('<Ii')
+
+def _encode_record(record):
+    data = zlib.compress(marshal.dumps(record))
+    return _RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+def read_journal(path):
+    """Returns the list of records in a journal file, up to the first one that was not completely written.
+    
+    Raises an exception if the file is not a journal.
+    """
+    
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    if not data.startswith(_MAGIC):
+        raise Exception('Invalid journal file.')
+    
+    records = []
+    pos = len(_MAGIC)
+    while pos + _RECORD_HEADER.size <= len(data):
+        length, crc = _RECORD_HEADER.unpack_from(data, pos)
+        pos += _RECORD_HEADER.size
+        record_data = data[pos:pos + length]
+        if len(record_data) != length or zlib.crc32(record_data) != crc:
+            print 'WARNING: Incomplete record found in the journal, the records after it were ignored - ' + path
+            break
+        records.append(marshal.loads(zlib.decompress(record_data)))
+        pos += length
+    
+    return records
+
+def fold_records(records):
+    """Returns the records that have the same effect as a list of records when replayed in order,
+    keeping only the last record of each task and of each Petri Net."""
+    
+    folded = OrderedDict()
+    for record in records:
+        if record[0] in (TASK, REMOVE_TASK):
+            key = (TASK, record[1])
+        elif record[0] in (NET, REMOVE):
+            key = (NET, record[1])
+        else:
+            key = (record[0],)
+        # The record is moved to the end, after the records it may depend on (e. g. the task of a Petri Net).
+        folded.pop(key, None)
+        folded[key] = record
+    
+    return folded.values()
+
+class EditJournal(object):
+    
+    def __init__(self, path, stamp, compact_size = 0):
+        """Creates the journal file in 'path', replacing it if it exists, for the edits made to a saved project.
+        
+        Positional Arguments:
+        path -- Path of the journal file.
+        stamp -- Stamp of the saved project, written in the BASE record.
+        
+        Keyword Arguments:
+        compact_size -- Size in bytes above which the journal is compacted, 0 to never compact it.
+        """
+        
+        super(EditJournal, self).__init__()
+        
+        self.path = path
+        self.compact_size = compact_size
+        # Size of the journal after it was last compacted, it is not compacted again until it doubles.
+        self._compacted_size = 0
+        
+        self._file = open(path, 'wb')
+        self._file.write(_MAGIC + _encode_record((BASE, stamp)))
+        self._file.flush()
+        
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target = self._write_records, name = 'EditJournal')
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def append(self, record):
+        """Queues a record to be written by the background thread."""
+        self._queue.put(record)
+    
+    def close(self, remove = False):
+        """Writes the queued records and closes the journal, removing its file if remove is True."""
+        
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print 'WARNING: The journal could not be removed - ' + str(e)
+    
+    def _write_records(self):
+        
+        while True:
+            records = [self._queue.get()]
+            # Records queued while the previous ones were written are written at once, with a single fsync.
+            while records[-1] is not None:
+                try:
+                    records.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            
+            try:
+                for record in records:
+                    if record is not None:
+                        self._file.write(_encode_record(record))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                
+                if self.compact_size and self._file.tell() > max(self.compact_size, 2*self._compacted_size):
+                    self._compact()
+            except Exception as e:
+                print 'WARNING: The journal could not be written - ' + str(e)
+            
+            if records[-1] is None:
+                return
+    
+    def _compact(self):
+        """Replaces the journal file with one that has its folded records."""
+        
+        records = fold_records(read_journal(self.path))
+        
+        fd, tmp_path = tempfile.mkstemp(suffix = EXTENSION, dir = os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_MAGIC)
+            for record in records:
+                f.write(_encode_record(record))
+            f.flush()
+            os.fsync(f.fileno())
+        
+        self._file.close()
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError:
+            # Windows does not rename over existing files.
+            os.remove(self.path)
+            os.rename(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self._compacted_size = os.path.getsize(self.path)
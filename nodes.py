@@ -17,6 +17,9 @@ def _get_treeElement(parent, tag = 'text', attr = None):
     
     el = parent.find(tag)
     if el is None:
+        # The tag may include a predicate for the search (e. g. 'toolspecific[@tool="PNLab"]'),
+        # which is not part of the new element's tag.
+        tag = tag.split('[', 1)[0]
         if attr is None:
             el = ET.SubElement(parent, tag)
         else:
@@ -49,6 +52,8 @@ class Node(object):
         self._incoming_arcs = {}
         self._outgoing_arcs = {}
         self.hasTreeElement = False
+        # Whether the node changed since its tree element was built or merged (see BasicPetriNet._update_tree).
+        self._dirty = True
         self._references = set()
         self._id = name.replace(' ', '_').replace('(', '__').replace(')', '__').replace(',', '_')
     
@@ -72,6 +77,18 @@ class Node(object):
         self._validate_name(value)
         
         self._name = value
+        self._dirty = True
+    
+    @property
+    def position(self):
+        """Returns the position of the node."""
+        return self._position
+    
+    @position.setter
+    def position(self, value):
+        """Sets the position of the node."""
+        self._position = value
+        self._dirty = True
     
     @property
     def full_name(self):
@@ -103,9 +120,17 @@ class Node(object):
         return
     
     @abc.abstractmethod
+    def _create_treeElement(self):
+        """Creates an ElementTree element from the node's information, without keeping track of it."""
+        return
+    
     def _build_treeElement(self):
         """Builds the ElementTree element from the node's information."""
-        return
+        
+        el = self._create_treeElement()
+        self.hasTreeElement = True
+        self._dirty = False
+        return el
 
     def __repr__(self):
         """ String representation of a Node object. It is the id of the node.
@@ -148,6 +173,28 @@ class Place(Node):
         self.init_marking = init_marking
         self.capacity = capacity
         self.current_marking = self.init_marking
+    
+    @property
+    def init_marking(self):
+        """Returns the initial marking of the place."""
+        return self._init_marking
+    
+    @init_marking.setter
+    def init_marking(self, value):
+        """Sets the initial marking of the place."""
+        self._init_marking = value
+        self._dirty = True
+    
+    @property
+    def capacity(self):
+        """Returns the capacity of the place."""
+        return self._capacity
+    
+    @capacity.setter
+    def capacity(self, value):
+        """Sets the capacity of the place."""
+        self._capacity = value
+        self._dirty = True
         
     def can_connect_to(self, target, weight):
         
@@ -201,9 +248,10 @@ class Place(Node):
         #NOTE: PNML renaming (of references?) is done by the PetriNet procedure where this node is created.
         p = PlaceClass(name, position, initMarking, capacity)
         p.hasTreeElement = True
+        p._dirty = False
         return p
     
-    def _build_treeElement(self):
+    def _create_treeElement(self):
         
         place = ET.Element('place', {'id': self.__repr__()})
         
@@ -235,12 +283,11 @@ class Place(Node):
                                     'width': str(LINE_WIDTH),
                                     'style': 'solid'})
         
-        self.hasTreeElement = True
         return place
     
     def _merge_treeElement(self):
         
-        place = self.petri_net._tree.find('//*[@id="' + self.__repr__() + '"]')
+        place = self.petri_net._get_element(self.__repr__())
         
         place_name = _get_treeElement(place, 'name')
         tmp = _get_treeElement(place_name)
@@ -287,6 +334,8 @@ class Place(Node):
                                                          'width': str(LINE_WIDTH)
                                                          }
                                 )
+        
+        self._dirty = False
 
 class BaseFactPlace(Place):
     
@@ -748,6 +797,39 @@ class Transition(Node):
         self.rate = rate
         self.priority = priority
     
+    @property
+    def isHorizontal(self):
+        """Returns whether the transition is drawn as a horizontal bar."""
+        return self._isHorizontal
+    
+    @isHorizontal.setter
+    def isHorizontal(self, value):
+        """Sets whether the transition is drawn as a horizontal bar."""
+        self._isHorizontal = value
+        self._dirty = True
+    
+    @property
+    def rate(self):
+        """Returns the rate of the transition."""
+        return self._rate
+    
+    @rate.setter
+    def rate(self, value):
+        """Sets the rate of the transition."""
+        self._rate = value
+        self._dirty = True
+    
+    @property
+    def priority(self):
+        """Returns the priority of the transition."""
+        return self._priority
+    
+    @priority.setter
+    def priority(self, value):
+        """Sets the priority of the transition."""
+        self._priority = value
+        self._dirty = True
+    
     @property
     def type(self):
         """Returns the type of the transition. Should be a value from one of the constants in TransitionTypes class."""
@@ -820,9 +902,10 @@ class Transition(Node):
         
         t = TransitionClass(name, position, isHorizontal, rate, priority)
         t.hasTreeElement = True
+        t._dirty = False
         return t
     
-    def _build_treeElement(self):
+    def _create_treeElement(self):
         
         transition = ET.Element('transition', {'id': self.__repr__()})
         
@@ -872,12 +955,11 @@ class Transition(Node):
                                     'width': str(LINE_WIDTH),
                                     'style': 'solid'})
         
-        self.hasTreeElement = True
         return transition
     
     def _merge_treeElement(self):
         
-        transition = self.petri_net._tree.find('//*[@id="' + self.__repr__() + '"]')
+        transition = self.petri_net._get_element(self.__repr__())
         
         transition_name = _get_treeElement(transition, 'name')
         tmp = _get_treeElement(transition_name)
@@ -936,6 +1018,8 @@ class Transition(Node):
                                                          'width': str(LINE_WIDTH)
                                                          }
                                 )
+        
+        self._dirty = False
 
 class BaseRuleTransition(Transition):
     
@@ -1305,6 +1389,8 @@ class _Arc(object):
         self.target = target
         self.weight = weight
         self._treeElement = treeElement
+        # An arc loaded along with its tree element does not need to be merged until it changes.
+        self._dirty = treeElement != self.__repr__()
         self.petri_net = source.petri_net
     
     def __str__(self):
@@ -1317,7 +1403,17 @@ class _Arc(object):
     def hasTreeElement(self):
         return self._treeElement is not None
     
-    def _build_treeElement(self):
+    @property
+    def weight(self):
+        return self._weight
+    
+    @weight.setter
+    def weight(self, value):
+        self._weight = value
+        self._dirty = True
+    
+    def _create_treeElement(self):
+        """Creates an ElementTree element from the arc's information, without keeping track of it."""
         
         arc = ET.Element('arc', {'id': self.__repr__(),
                                  'source': repr(self.source),
@@ -1327,17 +1423,26 @@ class _Arc(object):
         tmp = ET.SubElement(tmp, 'text')
         tmp.text = str(self.weight)
         
+        return arc
+    
+    def _build_treeElement(self):
+        
+        arc = self._create_treeElement()
+        
         self._treeElement = self.__repr__()
+        self._dirty = False
         
         return arc
     
     def _merge_treeElement(self):
         
-        el = self.petri_net._tree.find('//arc[@id="' + self._treeElement + '"]')
+        el = self.petri_net._get_element(self._treeElement)
         if el is None:
             print 'DEBUG - TE: ' + self._treeElement + ' - TreeName: ' + self.petri_net.name
             return
         weight = _get_treeElement(el, 'inscription')
         _get_treeElement(weight).text = str(self.weight)
-        el.set('id', self.__repr__())
+        if self._treeElement != self.__repr__():
+            self.petri_net._rename_element(self._treeElement, self.__repr__())
         self._treeElement = self.__repr__()
+        self._dirty = False
@@ -4,16 +4,355 @@
 """
 
 import copy
-import io
+import hashlib
+import marshal
 import os
+import struct
+import zlib
+from cStringIO import StringIO
 #import xml.etree.ElementTree as ET
 import lxml.etree as ET
 
 from nodes import Place, Transition, _Arc, _get_treeElement,\
     RuleTransition, SequenceTransition, TaskStatusPlace, TaskPlace,\
-    FactPlace, StructuredFactPlace, CommandPlace, FunctionCallPlace
+    FactPlace, StructuredFactPlace, CommandPlace, FunctionCallPlace,\
+    PLACE_CLASSES, TRANSITION_CLASSES
 from utils import Vec2
 
+# Binary snapshots (see BasicPetriNet.to_snapshot) start with this header: magic string, format version,
+# SHA-1 of the PNML file saved along with the snapshot and SHA-1 of the rest of the snapshot.
+# The version also covers the format of model states (see BasicPetriNet._get_model_state), which snapshots store.
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_MAGIC = 'PNSNAP'
+_SNAPSHOT_HEADER = struct.Struct('>6sH20s20s')
+
+# Name and task given to Petri Nets before hashing their contents (see BasicPetriNet.get_content_hash).
+_CONTENT_HASH_PLACEHOLDER = '__content_hash__'
+
+# Id of the page of the nets created by this tool, where all the nodes and arcs of the model are added.
+_TOP_PAGE_ID = 'PNLab_top_lvl'
+
+# http://wiki.tei-c.org/index.php/Remove-Namespaces.xsl
+_REMOVE_NAMESPACES_XSLT = ET.XSLT(ET.XML('''<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+<xsl:output method="xml" indent="no"/>
+
+<xsl:template match="/|comment()|processing-instruction()">
+    <xsl:copy>
+      <xsl:apply-templates/>
+    </xsl:copy>
+</xsl:template>
+
+<xsl:template match="*">
+    <xsl:element name="{local-name()}">
+      <xsl:apply-templates select="@*|node()"/>
+    </xsl:element>
+</xsl:template>
+
+<xsl:template match="@*">
+    <xsl:attribute name="{local-name()}">
+      <xsl:value-of select="."/>
+    </xsl:attribute>
+</xsl:template>
+</xsl:stylesheet>
+'''))
+
+def _remove_namespaces_xslt(et):
+    """Returns a copy of an ElementTree with the namespaces removed from all its tags and attributes."""
+    return _REMOVE_NAMESPACES_XSLT(et)
+
+def _remove_namespaces(et):
+    """Removes the namespaces from all the tags and attributes of an ElementTree, in place.
+    
+    Gives the same result as _remove_namespaces_xslt, without copying the document.
+    """
+    
+    root = et.getroot()
+    for el in root.iter(tag = ET.Element):
+        tag = el.tag
+        if tag[0] == '{':
+            el.tag = tag[tag.index('}') + 1:]
+        for key in el.keys():
+            if key[0] == '{':
+                el.set(key[key.index('}') + 1:], el.attrib.pop(key))
+    ET.cleanup_namespaces(root)
+    return et
+
+# Tags of the node and arc elements, which are indexed by id in BasicPetriNet.
+_INDEXED_TAGS = ('place', 'transition', 'referencePlace', 'referenceTransition', 'arc')
+
+def _same_element(a, b):
+    """Returns whether two elements have the same tags, attributes, text and children, ignoring whitespace."""
+    
+    if a.tag != b.tag or dict(a.attrib) != dict(b.attrib) or len(a) != len(b):
+        return False
+    if (a.text or '').strip() != (b.text or '').strip():
+        return False
+    for child_a, child_b in zip(a, b):
+        if not _same_element(child_a, child_b):
+            return False
+    return True
+
+def _has_foreign_structure(net):
+    """Returns whether a net element has contents other than a plain name, net-level elements and a single top-level page,
+    such as nested pages or comments, which the model state of its Petri Net does not keep (see BasicPetriNet._get_model_state)."""
+    
+    if any(not isinstance(el.tag, basestring) for el in net):
+        return True
+    
+    name = net.find('name')
+    if name is not None and [el.tag for el in name] != ['text']:
+        return True
+    
+    pages = net.findall('page')
+    return len(pages) != 1 or dict(pages[0].attrib) != {'id': _TOP_PAGE_ID}
+
+def _get_class(classes, attr, value):
+    """Returns the first class in 'classes' whose attribute 'attr' equals 'value'."""
+    
+    for c in classes:
+        if getattr(c, attr) == value:
+            return c
+    raise Exception("No class with " + attr + " '" + value + "' was found.")
+
+class _ReferenceResolver(object):
+    """Resolves chains of reference nodes (referencePlace, referenceTransition) to the node they refer to.
+    
+    Union-find structure keyed by element id, where every reference is joined to the node it refers to.
+    Paths are compressed while resolving them, so all the chains in a net are followed only once.
+    """
+    
+    def __init__(self):
+        self._parent = {}
+    
+    def add_reference(self, ref_id, referenced_id):
+        self._parent[ref_id] = referenced_id
+    
+    def find(self, node_id):
+        """Returns the id of the node at the end of the chain of references that starts at node_id."""
+        
+        path = []
+        current = node_id
+        while current in self._parent:
+            path.append(current)
+            current = self._parent[current]
+            if len(path) > len(self._parent):
+                raise Exception("Circular reference found at node '" + node_id + "'.")
+        
+        for ref_id in path:
+            self._parent[ref_id] = current
+        
+        return current
+
+class _PageLoader(object):
+    """Creates the nodes and arcs in the pages of a PNML net and adds them to a Petri Net.
+    
+    Pages can be loaded in several steps. References and arcs to nodes in pages that have not been loaded yet
+    are kept until those pages are loaded.
+    """
+    
+    def __init__(self, pn, net, elements, resolver, task):
+        
+        self.pn = pn
+        self.elements = elements
+        self.resolver = resolver
+        self.task = task
+        
+        #Since name clashes can occur, all nodes must be renamed after reading the file
+        # (i. e. after creating all nodes AND ARCS correctly).
+        # Maps the ids in the file to the ids given by the Petri Net.
+        self.new_ids = {}
+        
+        self.pending_pages = []
+        self.reference_places = list(net.iter('referencePlace'))
+        self.reference_transitions = list(net.iter('referenceTransition'))
+        self.arcs = []
+    
+    def _resolve(self, node_id):
+        """Returns the id in the file of the node that node_id refers to, or None if its page is not loaded yet.
+        
+        Loaded elements are renamed, so the ids in the file are used instead of the elements' ids.
+        """
+        
+        BasicPetriNet._resolve_reference(self.elements, self.resolver, node_id)
+        referenced_id = self.resolver.find(node_id)
+        if referenced_id not in self.new_ids:
+            return None
+        return referenced_id
+    
+    def load(self, containers, max_depth = None):
+        """Loads the nodes and arcs in 'containers' (the net or some of its pages) and in the pages within them.
+        
+        Pages nested deeper than max_depth levels below 'containers' are not loaded,
+        but kept in pending_pages.
+        """
+        
+        pn = self.pn
+        new_ids = self.new_ids
+        # Elements whose ids (or references to other ids) are renamed once they are loaded.
+        loaded = []
+        
+        ### GET PLACES AND TRANSITIONS, AS WELL AS THEIR NEW IDS
+        queue = [(el, 0) for el in containers]
+        while queue:
+            current, depth = queue.pop(0)
+            
+            for p_el in current.findall('place'):
+                p = Place.fromETreeElement(p_el)
+                pn.add_place(p)
+                if p.name == self.task:
+                    pn._main_place = p
+                new_ids[p_el.get('id')] = repr(p)
+                loaded.append(p_el)
+                
+            for t_el in current.findall('transition'):
+                t = Transition.fromETreeElement(t_el)
+                pn.add_transition(t)
+                if t.__class__ == RuleTransition:
+                    pn._main_transition = t
+                new_ids[t_el.get('id')] = repr(t)
+                loaded.append(t_el)
+            
+            self.arcs += current.findall('arc')
+            
+            for page in current.findall('page'):
+                if max_depth is not None and depth >= max_depth:
+                    self.pending_pages.append(page)
+                else:
+                    queue.append((page, depth + 1))
+        
+        ### GET REFERENCES AND THEIR NEW IDS
+        pending = []
+        for ref in self.reference_places:
+            reference = self._resolve(ref.get('ref'))
+            if reference is None:
+                pending.append(ref)
+                continue
+            
+            pn._place_counter += 1
+            new_id = 'P{:0>3d}'.format(pn._place_counter)
+            new_ids[ref.get('id')] = new_id
+            pn.places[new_ids[reference]]._references.add(new_id)
+            loaded.append(ref)
+        self.reference_places = pending
+        
+        pending = []
+        for ref in self.reference_transitions:
+            reference = self._resolve(ref.get('ref'))
+            if reference is None:
+                pending.append(ref)
+                continue
+            
+            pn._transition_counter += 1
+            new_id = 'T{:0>3d}'.format(pn._transition_counter)
+            new_ids[ref.get('id')] = new_id
+            pn.transitions[new_ids[reference]]._references.add(new_id)
+            loaded.append(ref)
+        self.reference_transitions = pending
+        
+        ### GET ARC INFO TO THE PN
+        pending = []
+        for arc in self.arcs:
+            
+            source = self._resolve(arc.get('source'))
+            target = self._resolve(arc.get('target'))
+            if source is None or target is None:
+                pending.append(arc)
+                continue
+            
+            source_id = new_ids[source]
+            target_id = new_ids[target]
+            
+            if self.elements[source].tag == 'place':
+                source = pn.places[source_id]
+                target = pn.transitions[target_id]
+            else:
+                source = pn.transitions[source_id]
+                target = pn.places[target_id]
+            try:
+                weight = int(arc.find('inscription/text').text)
+            except:
+                weight = 1
+            new_arc_id = source_id + '_' + target_id
+            arc.set('id', new_arc_id)
+            pn.add_arc(source, target, weight, new_arc_id)
+            loaded.append(arc)
+        self.arcs = pending
+        
+        ### RENAME PLACES, TRANSITIONS, REFERENCES AND ARC ENDPOINTS IN THE TE (SINGLE PASS)
+        for el in loaded:
+            if el.tag == 'arc':
+                attrs = ('source', 'target')
+            else:
+                attrs = ('id', 'ref')
+            for attr in attrs:
+                old_id = el.get(attr)
+                if old_id in new_ids:
+                    el.set(attr, new_ids[old_id])
+            pn._elements.setdefault(el.get('id'), el)
+    
+    def load_page(self, page):
+        """Loads a pending page, leaving the pages nested within it pending."""
+        
+        self.pending_pages.remove(page)
+        self.load([page], max_depth = 0)
+    
+    def load_pending(self):
+        """Loads all the pages that are still pending."""
+        
+        pages = self.pending_pages
+        self.pending_pages = []
+        self.load(pages)
+
+def _get_content_hash(state):
+    """Returns the SHA-1 (as hex) of a model state without the name and task of its Petri Net (see BasicPetriNet.get_content_hash)."""
+    
+    # The net is renamed to a placeholder name and task the same way it is when it is loaded
+    # with another name or in another task (see from_snapshot), and the resulting state is hashed.
+    task = state[2]
+    pn = BasicPetriNet._from_model_state((state[0], _CONTENT_HASH_PLACEHOLDER) + state[2:])
+    if task:
+        try:
+            pn.task = _CONTENT_HASH_PLACEHOLDER
+        except Exception:
+            # The net could not be loaded in another task, so its task is kept in the hash.
+            pass
+    
+    (class_name, _, task, scale, place_counter, transition_counter,
+     net_attributes, net_elements, places, transitions, arcs, pnml) = pn._get_model_state()
+    
+    # The id of the net is its name when it is created.
+    net_attributes = tuple(sorted(item for item in net_attributes if item[0] != 'id'))
+    
+    def is_scale_only(el):
+        # The scale is merged into the tool's element when the net is saved, and it is in the state already.
+        if el.tag == 'toolspecific' and el.get('tool') == 'PNLab':
+            for scale_el in el.findall('scale'):
+                el.remove(scale_el)
+            return len(el) == 0 and not (el.text or '').strip()
+        return False
+    
+    parser = ET.XMLParser(remove_blank_text = True)
+    elements = []
+    for data in net_elements:
+        el = ET.fromstring(data, parser)
+        if not is_scale_only(el):
+            elements.append(ET.tostring(el))
+    net_elements = tuple(elements)
+    
+    # The PNML of the net is written without whitespace, as it is after the net is saved and read again.
+    if pnml is not None:
+        net = ET.fromstring(pnml, parser)
+        net.attrib.pop('id', None)
+        for el in net.findall('toolspecific'):
+            if is_scale_only(el):
+                net.remove(el)
+        pnml = ET.tostring(net)
+    
+    state = (class_name, task, scale, place_counter, transition_counter, net_attributes, net_elements,
+             tuple(sorted(places)), tuple(sorted(transitions)), tuple(sorted(arcs)), pnml)
+    # Version 0 of marshal does not share interned strings, so equal states are always serialised the same.
+    return hashlib.sha1(marshal.dumps(state, 0)).hexdigest()
+
 class BasicPetriNet(object):
     
     '''
@@ -33,11 +372,22 @@ class BasicPetriNet(object):
         self.name = name
         self.places = {}
         self.transitions = {}
+        # _PageLoader with the pages that are still to be loaded (see from_ElementTree).
+        self._lazy_pages = None
         self.scale = 1.0
         
         self._place_counter = 0
         self._transition_counter = 0
         
+        # Index of the node and arc elements in the tree by id (see _index_tree).
+        self._elements = {}
+        
+        # Serialised remains of the tree while it is released (see release_tree).
+        self._tree_data = None
+        
+        # Whether the tree has contents that the model does not keep, None until it is checked (see _has_foreign_content).
+        self._foreign_content = None
+        
         root_el = ET.Element('pnml', {'xmlns': 'http://www.pnml.org/version-2009/grammar/pnml'})
         self._tree = ET.ElementTree(root_el)
         page = None
@@ -57,7 +407,143 @@ class BasicPetriNet(object):
         tmp = _get_treeElement(tmp)
         tmp.text = name
         if page is None:
-            ET.SubElement(_net, 'page', {'id': 'PNLab_top_lvl'})
+            ET.SubElement(_net, 'page', {'id': _TOP_PAGE_ID})
+        
+        # Scale of the node elements in the tree, which must all be merged again when it changes.
+        self._tree_scale = self.scale
+    
+    def get_pending_pages(self):
+        """Returns the ids of the pages of the net that were not loaded yet (see from_ElementTree)."""
+        
+        if self._lazy_pages is None:
+            return []
+        return [page.get('id') for page in self._lazy_pages.pending_pages]
+    
+    def load_page(self, page_id):
+        """Loads a page of the net that was not loaded yet (see get_pending_pages), with the arcs and references
+        between its nodes and the nodes already loaded. The pages nested within it are left pending.
+        
+        Raises KeyError if there is no pending page with that id.
+        """
+        
+        loader = self._lazy_pages
+        pages = [page for page in loader.pending_pages if page.get('id') == page_id] if loader is not None else []
+        if not pages:
+            raise KeyError(page_id)
+        
+        loader.load_page(pages[0])
+        if not loader.pending_pages:
+            self._lazy_pages = None
+    
+    def load_pages(self):
+        """Loads every page of the net that was not loaded yet."""
+        
+        if self._lazy_pages is None:
+            return
+        
+        loader = self._lazy_pages
+        self._lazy_pages = None
+        loader.load_pending()
+    
+    def __getstate__(self):
+        # Copies of the tree do not keep the identity of its elements, so the index is rebuilt (see __setstate__).
+        # The same goes for the elements of pending pages, which are loaded before copying.
+        self.load_pages()
+        state = self.__dict__.copy()
+        del state['_elements']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index_tree()
+    
+    def _index_tree(self):
+        """Rebuilds the index of the node and arc elements in the tree by their ids."""
+        
+        self._elements = {}
+        if self._tree is None:
+            return
+        for el in self._tree.getroot().iter(*_INDEXED_TAGS):
+            self._elements.setdefault(el.get('id'), el)
+    
+    def _get_tree(self):
+        """Returns the tree of the Petri Net, re-materialising it if it was released (see release_tree)."""
+        
+        if self._tree is None:
+            root_attributes, net_data = self._tree_data
+            # The root is rebuilt apart, so its xmlns attribute does not put the net in the PNML namespace.
+            root_el = ET.Element('pnml', root_attributes)
+            root_el.append(ET.fromstring(net_data))
+            self._tree = ET.ElementTree(root_el)
+            self._tree_data = None
+            self._index_tree()
+        return self._tree
+    
+    def release_tree(self):
+        """Drops the tree of the Petri Net, keeping only the parts that cannot be rebuilt from the model.
+        
+        The elements of nodes and arcs that the model builds exactly the same are discarded.
+        The rest of the tree (net-level elements, pages, reference nodes,
+        and nodes or arcs with contents unknown to this tool) is kept serialised,
+        and it is re-materialised the next time the tree is needed.
+        """
+        
+        if self._tree is None:
+            return
+        
+        self._update_tree()
+        
+        for key, node in self.places.items() + self.transitions.items():
+            el = self._get_element(key)
+            if el is not None and _same_element(el, node._create_treeElement()):
+                self._remove_element(key)
+                node.hasTreeElement = False
+        
+        for p in self.places.itervalues():
+            for arc in p._incoming_arcs.values() + p._outgoing_arcs.values():
+                el = self._get_element(arc._treeElement)
+                if el is not None and _same_element(el, arc._create_treeElement()):
+                    self._remove_element(arc._treeElement)
+                    arc._treeElement = None
+        
+        root = self._tree.getroot()
+        net = root.find('net')
+        if self._foreign_content is None:
+            # Only the elements that the model builds the same were discarded.
+            self._foreign_content = _has_foreign_structure(net) or len(net.find('page')) > 0
+        self._tree_data = (dict(root.attrib), ET.tostring(net))
+        self._tree = None
+        self._elements = {}
+    
+    def _get_element(self, el_id):
+        """Returns the tree element of a node or arc with id 'el_id', or None if it is not in the tree."""
+        return self._elements.get(el_id)
+    
+    def _add_element(self, parent, el):
+        """Appends a node or arc element to 'parent' in the tree and adds it to the index."""
+        
+        parent.append(el)
+        self._elements[el.get('id')] = el
+    
+    def _remove_element(self, el_id):
+        """Removes the node or arc element with id 'el_id' from the tree.
+        
+        Returns the removed element, or None if it was not in the tree.
+        A released tree is re-materialised first, since the element may be among the parts it kept.
+        """
+        
+        self._get_tree()
+        el = self._elements.pop(el_id, None)
+        if el is not None:
+            el.getparent().remove(el)
+        return el
+    
+    def _rename_element(self, old_id, new_id):
+        """Changes the id of a node or arc element in the tree."""
+        
+        el = self._elements.pop(old_id)
+        el.set('id', new_id)
+        self._elements[new_id] = el
     
     def add_place(self, p):
         """Adds a place from the Petri Net.
@@ -120,12 +606,9 @@ class BasicPetriNet(object):
             self.remove_arc(p, self.transitions[t])
         
         for ref in p._references:
-            el = self._tree.find('//*[@id="' + ref + '"]')
-            el.getparent().remove(el)
+            self._remove_element(ref)
         
-        el = self._tree.find('//place[@id="' + key + '"]')
-        if el is not None:
-            el.getparent().remove(el)
+        self._remove_element(key)
         
         p = self.places.pop(key)
         p._references.clear()
@@ -157,12 +640,9 @@ class BasicPetriNet(object):
             self.remove_arc(t, self.places[p])
         
         for ref in t._references:
-            el = self._tree.find('//*[@id="' + ref + '"]')
-            el.getparent().remove(el)
+            self._remove_element(ref)
         
-        el = self._tree.find('//transition[@id="' + key + '"]')
-        if el is not None:
-            el.getparent().remove(el)
+        self._remove_element(key)
         
         t = self.transitions.pop(key)
         t._references.clear()
@@ -230,34 +710,58 @@ class BasicPetriNet(object):
             self.places[trgt]._incoming_arcs.pop(src, None)
         
         if arc and arc.hasTreeElement:
-            arc_el = self._tree.find('//arc[@id="' + arc._treeElement + '"]')
-            if arc_el is None:
+            if self._remove_element(arc._treeElement) is None:
                 print 'Something is not right!'
-            else:
-                arc_el.getparent().remove(arc_el)
+            # The element is gone, so if the arc is added again (e. g. undo) a new one is built.
+            arc._treeElement = None
     
     @classmethod
-    def _get_consecutive_letter_generator(cls):
-        
-        text = 'a'
-        length = 1
-        
-        while True:
-            yield text
-            index = length - 1
-            while index > -1:
-                if text[index] == 'z':
-                    text = text[:index] + 'a' + text[index+1:]
-                    index -= 1
-                else:
-                    text = text[:index] + chr(ord(text[index])+1) + text[index+1:]
-                    break
-            if index == -1:
-                text = 'a' + text
-                length += 1
+    def _index_elements(cls, net):
+        """Returns a dictionary mapping every id in the net to the first element that has it,
+        and a _ReferenceResolver with all the reference nodes in the net."""
+        
+        elements = {}
+        resolver = _ReferenceResolver()
+        for el in net.iter(tag = ET.Element):
+            el_id = el.get('id')
+            if el_id is not None and el_id not in elements:
+                elements[el_id] = el
+                if el.tag[:9] == 'reference' and el.get('ref') is not None:
+                    resolver.add_reference(el_id, el.get('ref'))
+        return elements, resolver
+    
+    @classmethod
+    def _resolve_reference(cls, elements, resolver, node_id):
+        """Returns the place or transition element that node_id refers to (maybe through other references)."""
+        
+        el = elements.get(resolver.find(node_id))
+        if el is None or el.tag[:9] == 'reference':
+            raise Exception("Referenced node '" + node_id + "' was not found.")
+        return el
 
     @classmethod
-    def from_ElementTree(cls, et, name = None, PetriNetClass = None, task = None):
+    def _create_loaded_net(cls, PetriNetClass, name, task, net):
+        """Creates the Petri Net object that the contents of a PNML net are loaded into."""
+        
+        if task:
+            return PetriNetClass(name, task, _net = net, initialize = False)
+        if net is not None and issubclass(PetriNetClass, RulePN):
+            # The rule transition is only created if the net does not have one already.
+            for t in net.iter('transition'):
+                if (t.findtext('name/text') or '').startswith(RuleTransition.PREFIX + '.'):
+                    return PetriNetClass(name, _net = net, initialize = False)
+        return PetriNetClass(name, _net = net)
+
+    @classmethod
+    def from_ElementTree(cls, et, name = None, PetriNetClass = None, task = None, lazy_pages = False):
+        """Reads the Petri Nets in a (namespace-free) PNML ElementTree.
+        
+        If lazy_pages is True, only the nodes in the pages of each net (and not in the pages nested within them)
+        are created. The places and transitions of the net are then only those in the pages loaded so far,
+        the rest of the pages are loaded one at a time with load_page (or all at once with load_pages).
+        They are all loaded before the net is saved or copied, before the queries of rules
+        (e. g. get_clips_code, get_fact_names or get_dependency_tasks) and when the net is opened in an editor.
+        """
         
         pnets = []
         root = et.getroot()
@@ -273,6 +777,8 @@ class BasicPetriNet(object):
             if PetriNetClass == None:
                 PetriNetClass = BasicPetriNet
             
+            elements, resolver = BasicPetriNet._index_elements(net)
+            
             if task:
                 t = None
                 for current_t in net.findall('page//transition'):
@@ -285,8 +791,9 @@ class BasicPetriNet(object):
                     p = None
                     l = len(TaskPlace.PREFIX) + 1
                     for current_arc in net.findall("page//arc[@target='"+ transition_id +"']"):
-                        place_id = current_arc.get('source')
-                        current_p = net.find('page//place[@id="' + place_id + '"]')
+                        current_p = elements.get(current_arc.get('source'))
+                        if current_p is None or current_p.tag != 'place':
+                            continue
                         p_name = current_p.find('name').findtext('text')
                         if p_name[:l] == TaskPlace.PREFIX + '.':
                             p = current_p
@@ -295,10 +802,8 @@ class BasicPetriNet(object):
                         print 'WARNING: TaskPlace not found!'
                     else:
                         p.find('name/text').text = p_name[:l] + task
-                
-                pn = PetriNetClass(name, task, _net = net, initialize = False)
-            else:
-                pn = PetriNetClass(name, _net = net)
+            
+            pn = BasicPetriNet._create_loaded_net(PetriNetClass, name, task, net)
             
             try:
                 scale = float(net.find('toolspecific[@tool="PNLab"]/scale/text').text)
@@ -306,160 +811,14 @@ class BasicPetriNet(object):
             except:
                 pass
             
-            generator = BasicPetriNet._get_consecutive_letter_generator()
-            
-            queue = [net]
-            
-            #Since name clashes can occur, all nodes must be renamed after reading the file
-            # (i. e. after creating all nodes AND ARCS correctly).
-            renaming_places_dict = {}
-            renaming_places_dict_2 = {}
-            renaming_transitions_dict = {}
-            renaming_transitions_dict_2 = {}
-            
-            ### GET PLACES AND TRANSITIONS, AS WELL AS THEIR REFERENCES, AND GET THEIR NEW IDS
-            while queue:
-                current = queue.pop(0)
-                
-                for p_el in current.findall('place'):
-                    p = Place.fromETreeElement(p_el)
-                    pn.add_place(p)
-                    if p.name == task:
-                        pn._main_place = p
-                    
-                    temp_key = next(generator)
-                    renaming_places_dict[p_el.get('id')] = temp_key
-                    renaming_places_dict_2[temp_key] = repr(p)
-                    
-                for t_el in current.findall('transition'):
-                    t = Transition.fromETreeElement(t_el)
-                    pn.add_transition(t)
-                    if t.__class__ == RuleTransition:
-                        pn._main_transition = t
-                    
-                    temp_key = next(generator)
-                    renaming_transitions_dict[t_el.get('id')] = temp_key
-                    renaming_transitions_dict_2[temp_key] = repr(t)
-                
-                pages = current.findall('page')
-                if pages:
-                    queue += pages
-            
-            for ref in net.findall('.//referencePlace'):
-                reference = ref
-                try:
-                    while reference.tag[:9] == 'reference':
-                        reference = net.find('.//*[@id="' + reference.get('ref') + '"]')
-                except:
-                    raise Exception("Referenced node '" + ref.get('ref') + "' was not found.")
-                
-                place_id = ref.get('id')
-                pn._place_counter += 1
-                new_id = 'P{:0>3d}'.format(pn._place_counter)
-                
-                temp_key = next(generator)
-                renaming_places_dict[place_id] = temp_key
-                renaming_places_dict_2[temp_key] = new_id
-                
-                temp_key = renaming_places_dict[reference.get('id')]
-                pn.places[renaming_places_dict_2[temp_key]]._references.add(new_id)
-            
-            for ref in net.findall('.//referenceTransition'):
-                reference = ref
-                try:
-                    while reference.tag[:9] == 'reference':
-                        reference = net.find('.//*[@id="' + reference.get('ref') + '"]')
-                except:
-                    raise Exception("Referenced node '" + ref.get('ref') + "' was not found.")
-                
-                transition_id = ref.get('id')
-                pn._transition_counter += 1
-                new_id = 'T{:0>3d}'.format(pn._transition_counter)
-                
-                temp_key = next(generator)
-                renaming_transitions_dict[transition_id] = temp_key
-                renaming_transitions_dict_2[temp_key] = new_id
-                
-                temp_key = renaming_transitions_dict[reference.get('id')]
-                pn.transitions[renaming_transitions_dict_2[temp_key]]._references.add(new_id)
-            
-            ### RENAME PLACES AND TRANSITIONS, AS WELL AS THEIR REFERENCES, AND SUBSTITUTE ANY REFERENCE TO THEM
-            
-            for key, new_key in renaming_places_dict.iteritems():
-                p_el = net.find('.//place[@id="' + key + '"]')
-                for e in net.findall('.//referencePlace[@ref="' + key + '"]'):
-                    e.set('ref', new_key)
-                for e in net.findall('.//arc[@source="' + key + '"]'):
-                    e.set('source', new_key)
-                for e in net.findall('.//arc[@target="' + key + '"]'):
-                    e.set('target', new_key)
-                p_el.set('id', new_key)
-            
-            for key, new_key in renaming_places_dict_2.iteritems():
-                p_el = net.find('.//place[@id="' + key + '"]')
-                for e in net.findall('.//referencePlace[@ref="' + key + '"]'):
-                    e.set('ref', new_key)
-                for e in net.findall('.//arc[@source="' + key + '"]'):
-                    e.set('source', new_key)
-                for e in net.findall('.//arc[@target="' + key + '"]'):
-                    e.set('target', new_key)
-                p_el.set('id', new_key)
-            
-            
-            for key, new_key in renaming_transitions_dict.iteritems():
-                t_el = net.find('.//transition[@id="' + key + '"]')
-                for e in net.findall('.//referenceTransition[@ref="' + key + '"]'):
-                    e.set('ref', new_key)
-                for e in net.findall('.//arc[@source="' + key + '"]'):
-                    e.set('source', new_key)
-                for e in net.findall('.//arc[@target="' + key + '"]'):
-                    e.set('target', new_key)
-                t_el.set('id', new_key)
-            
-            for key, new_key in renaming_transitions_dict_2.iteritems():
-                t_el = net.find('.//transition[@id="' + key + '"]')
-                for e in net.findall('.//referenceTransition[@ref="' + key + '"]'):
-                    e.set('ref', new_key)
-                for e in net.findall('.//arc[@source="' + key + '"]'):
-                    e.set('source', new_key)
-                for e in net.findall('.//arc[@target="' + key + '"]'):
-                    e.set('target', new_key)
-                t_el.set('id', new_key)
-            
-            ### GET ARC INFO TO THE PN AND UPDATE ARC INFO IN THE TE
-            
-            for arc in current.findall('arc'):
-                
-                source = net.find('.//*[@id="' + arc.get('source') + '"]')
-                try:
-                    while source.tag[:9] == 'reference':
-                        source = net.find('.//*[@id="' + source.get('ref') + '"]')
-                except:
-                    raise Exception("Referenced node '" + arc.get('source') + "' was not found.")
-                
-                target = net.find('.//*[@id="' + arc.get('target') + '"]')
-                try:
-                    while target.tag[:9] == 'reference':
-                        target = net.find('.//*[@id="' + target.get('ref') + '"]')
-                except:
-                    raise Exception("Referenced node '" + arc.get('target') + "' was not found.")
-                
-                source_id = source.get('id')
-                target_id = target.get('id')
-                
-                if source.tag == 'place':
-                    source = pn.places[source_id]
-                    target = pn.transitions[target_id]
-                else:
-                    source = pn.transitions[source_id]
-                    target = pn.places[target_id]
-                try:
-                    weight = int(arc.find('inscription/text').text)
-                except:
-                    weight = 1
-                new_arc_id = source_id + '_' + target_id
-                arc.set('id', new_arc_id)
-                pn.add_arc(source, target, weight, new_arc_id)
+            loader = _PageLoader(pn, net, elements, resolver, task)
+            if lazy_pages:
+                # The net is at depth 0, so only its own pages are loaded.
+                loader.load([net], max_depth = 1)
+                if loader.pending_pages:
+                    pn._lazy_pages = loader
+            else:
+                loader.load([net])
             
             pnets.append(pn)
         
@@ -467,15 +826,21 @@ class BasicPetriNet(object):
         
     
     def to_ElementTree(self):
+        """Returns a copy of the Petri Net's tree, updated with the current state of the model."""
+        return copy.deepcopy(self._update_tree())
+    
+    def _update_net_element(self):
+        """Merges the name and scale of the Petri Net into the net element of the tree and returns it."""
         
-        net = self._tree.find('net')
+        # The elements of pending pages have not been renamed yet, so they cannot be saved as they are.
+        self.load_pages()
+        
+        net = self._get_tree().find('net')
         
         tmp = _get_treeElement(net, 'name')
         tmp = _get_treeElement(tmp)
         tmp.text = self.name
         
-        page = net.find('page')
-        
         toolspecific = net.find('toolspecific[@tool="PNLab"]')
         if toolspecific is None:
             toolspecific = ET.SubElement(net, 'toolspecific', {'tool' : 'PNLab'})
@@ -483,74 +848,537 @@ class BasicPetriNet(object):
         tmp = _get_treeElement(tmp, 'text')
         tmp.text = str(self.scale)
         
+        return net
+    
+    def _update_tree(self):
+        """Merges the current state of the model into the Petri Net's tree and returns the tree itself.
+        
+        Only the nodes and arcs that changed since they were last merged are merged again,
+        unless the scale of the net changed.
+        The tree is not copied, so it must not be modified by the caller.
+        """
+        
+        net = self._update_net_element()
+        page = net.find('page')
+        
+        rescaled = self.scale != self._tree_scale
+        
         for p in self.places.itervalues():
-            if p.hasTreeElement:
+            if not p.hasTreeElement:
+                self._add_element(page, p._build_treeElement())
+            elif p._dirty or rescaled:
                 p._merge_treeElement()
-            else:
-                page.append(p._build_treeElement())
         
         for t in self.transitions.itervalues():
-            if t.hasTreeElement:
+            if not t.hasTreeElement:
+                self._add_element(page, t._build_treeElement())
+            elif t._dirty or rescaled:
                 t._merge_treeElement()
-            else:
-                page.append(t._build_treeElement())
         
         for p in self.places.itervalues():
             for arc in p._incoming_arcs.itervalues():
-                if arc.hasTreeElement:
+                if not arc.hasTreeElement:
+                    self._add_element(page, arc._build_treeElement())
+                elif arc._dirty:
                     arc._merge_treeElement()
-                else:
-                    page.append(arc._build_treeElement())
 
             for arc in p._outgoing_arcs.itervalues():
-                if arc.hasTreeElement:
+                if not arc.hasTreeElement:
+                    self._add_element(page, arc._build_treeElement())
+                elif arc._dirty:
                     arc._merge_treeElement()
-                else:
-                    page.append(arc._build_treeElement())
         
-        return copy.deepcopy(self._tree)
+        self._tree_scale = self.scale
+        
+        return self._tree
     
     @classmethod
-    def from_pnml_file(cls, filename, PetriNetClass = None, task = None):
-        et = ET.parse(filename)
-        # http://wiki.tei-c.org/index.php/Remove-Namespaces.xsl
-        xslt='''<xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-        <xsl:output method="xml" indent="no"/>
-        
-        <xsl:template match="/|comment()|processing-instruction()">
-            <xsl:copy>
-              <xsl:apply-templates/>
-            </xsl:copy>
-        </xsl:template>
-        
-        <xsl:template match="*">
-            <xsl:element name="{local-name()}">
-              <xsl:apply-templates select="@*|node()"/>
-            </xsl:element>
-        </xsl:template>
-        
-        <xsl:template match="@*">
-            <xsl:attribute name="{local-name()}">
-              <xsl:value-of select="."/>
-            </xsl:attribute>
-        </xsl:template>
-        </xsl:stylesheet>
-        '''
-        xslt_doc=ET.parse(io.BytesIO(xslt))
-        transform=ET.XSLT(xslt_doc)
-        et=transform(et)
-        filename = os.path.basename(filename)
-        if '.' in filename:
-            filename = filename[:filename.find('.')]
+    def from_pnml_file(cls, filename, PetriNetClass = None, task = None, streaming = False, cache = None, release_tree = False,
+                       lazy_pages = False, name = None):
+        """Reads the Petri Nets in a PNML file.
+        
+        'filename' can also be a file-like object (e. g. a member opened from a zip file,
+        or a StringIO with PNML contents already in memory), which is read without any temporary file.
+        Unless a name is given, nets are named after the file, without its extensions.
+        
+        If streaming is True, the file is parsed incrementally (see _from_pnml_stream),
+        which keeps memory usage close to the size of the model for very large nets.
+        
+        If a PNMLCache is given, the nets are rebuilt from the cache when the same contents
+        were already read, without parsing the file; otherwise they are added to the cache.
+        
+        If release_tree is True, the trees of the nets are released after loading them (see release_tree).
+        
+        If lazy_pages is True, nested pages are loaded only when they are needed (see from_ElementTree).
+        Nets loaded this way are not added to the cache, since that would load all their pages.
+        """
+        
+        is_file_name = isinstance(filename, basestring)
+        
+        if name is None:
+            if is_file_name:
+                name = filename
+            else:
+                name = getattr(filename, 'name', None)
+            if not name:
+                raise Exception('A name is needed to read a PNML file object without a name.')
+            name = os.path.basename(name)
+            if '.' in name:
+                name = name[:name.find('.')]
+        
+        if PetriNetClass is None:
+            PetriNetClass = BasicPetriNet
+        
+        if cache is not None:
+            if is_file_name:
+                f = open(filename, 'rb')
+                data = f.read()
+                f.close()
+            else:
+                # File objects cannot be rewound in general (e. g. zip members), so they are parsed from their contents.
+                data = filename.read()
+                filename = StringIO(data)
+            key = cache.get_key(data, PetriNetClass.__name__, SNAPSHOT_VERSION)
+            
+            states = cache.get(key)
+            if states is not None:
+                petri_nets = [BasicPetriNet._from_cached_state(state, name, task) for state in states]
+                if release_tree:
+                    for pn in petri_nets:
+                        pn.release_tree()
+                return petri_nets
+        
+        if streaming:
+            petri_nets = BasicPetriNet._from_pnml_stream(filename, name = name, task = task, PetriNetClass = PetriNetClass)
+        else:
+            et = _remove_namespaces(ET.parse(filename))
+            petri_nets = PetriNetClass.from_ElementTree(et, name = name, task = task, PetriNetClass = PetriNetClass, lazy_pages = lazy_pages)
+        
+        if cache is not None and not lazy_pages:
+            cache.put(key, [pn._get_model_state() for pn in petri_nets])
+        
+        if release_tree:
+            for pn in petri_nets:
+                pn.release_tree()
+        
+        return petri_nets
+    
+    @classmethod
+    def _from_cached_state(cls, state, name, task):
+        """Creates a Petri Net from a model state cached for a file with the same contents,
+        which may have had a different file name or task."""
+        
+        pn = BasicPetriNet._from_model_state((state[0], name) + state[2:])
+        if task and pn.task != task:
+            pn.task = task
+        
+        return pn
+    
+    @classmethod
+    def _from_pnml_stream(cls, source, name = None, PetriNetClass = None, task = None):
+        """Reads the Petri Nets in a PNML file with lxml's iterparse.
+        
+        Places, transitions and arcs are created as their elements are parsed,
+        and the elements are discarded right after, so the whole document is never held in memory.
+        Only the small net-level elements (e. g. name and toolspecific) are kept in the net's tree,
+        nodes and arcs get new tree elements when the net is saved.
+        
+        Reference nodes are not kept either: arcs to or from them are connected
+        directly to the nodes they refer to.
+        """
         
         if PetriNetClass is None:
             PetriNetClass = BasicPetriNet
         
-        return PetriNetClass.from_ElementTree(et, name = filename, task = task, PetriNetClass = PetriNetClass)
+        pnets = []
+        pn = None
+        
+        for event, el in ET.iterparse(source, events = ('start', 'end')):
+            
+            tag = el.tag
+            if tag[0] == '{':
+                tag = tag[tag.index('}') + 1:]
+            
+            if event == 'start':
+                if tag == 'net':
+                    net_name = name
+                    if net_name is None:
+                        net_name = el.get('id')
+                    pn = BasicPetriNet._create_loaded_net(PetriNetClass, net_name, task, None)
+                    # File ids of nodes, mapped to (is_place, id given by the Petri Net).
+                    node_ids = {}
+                    resolver = _ReferenceResolver()
+                    arcs = []
+                    rule_transition_id = None
+                continue
+            
+            el.tag = tag
+            
+            if pn is None:
+                continue
+            
+            parent = el.getparent()
+            
+            if tag == 'place':
+                p = Place.fromETreeElement(el)
+                p.hasTreeElement = False
+                pn.add_place(p)
+                if p.name == task:
+                    pn._main_place = p
+                node_ids[el.get('id')] = (True, repr(p))
+            elif tag == 'transition':
+                t = Transition.fromETreeElement(el)
+                t.hasTreeElement = False
+                pn.add_transition(t)
+                if t.__class__ == RuleTransition:
+                    pn._main_transition = t
+                    if rule_transition_id is None:
+                        rule_transition_id = el.get('id')
+                node_ids[el.get('id')] = (False, repr(t))
+            elif tag == 'arc':
+                try:
+                    weight = int(el.find('inscription/text').text)
+                except:
+                    weight = 1
+                arcs.append((el.get('source'), el.get('target'), weight))
+            elif tag in ['referencePlace', 'referenceTransition']:
+                resolver.add_reference(el.get('id'), el.get('ref'))
+            elif tag == 'page':
+                pass
+            elif tag == 'net':
+                BasicPetriNet._finish_streamed_net(pn, el, node_ids, resolver, arcs, rule_transition_id, task)
+                pnets.append(pn)
+                pn = None
+                el.clear()
+                continue
+            else:
+                # Descendants of nodes are processed along with them,
+                # net-level elements are kept until the whole net is read.
+                continue
+            
+            el.clear()
+            parent.remove(el)
+        
+        return pnets
     
-    def to_pnml_file(self, file_name):
-        et = self.to_ElementTree()
-        et.write(file_name, encoding = 'utf-8', xml_declaration = True, pretty_print = True)
+    @classmethod
+    def _finish_streamed_net(cls, pn, net, node_ids, resolver, arcs, rule_transition_id, task):
+        """Resolves references, adds the arcs and copies the net-level elements of a streamed net."""
+        
+        def resolve(node_id):
+            node = node_ids.get(resolver.find(node_id))
+            if node is None:
+                raise Exception("Referenced node '" + node_id + "' was not found.")
+            return node
+        
+        if task and rule_transition_id is not None:
+            task_place = None
+            for source_id, target_id, _ in arcs:
+                if target_id != rule_transition_id or source_id not in node_ids:
+                    continue
+                is_place, key = node_ids[source_id]
+                if is_place and pn.places[key].__class__ is TaskPlace:
+                    task_place = pn.places[key]
+                    break
+            if task_place is None:
+                print 'WARNING: TaskPlace not found!'
+            else:
+                task_place.name = task
+                pn._main_place = task_place
+        
+        for source_id, target_id, weight in arcs:
+            source_is_place, source_key = resolve(source_id)
+            _, target_key = resolve(target_id)
+            if source_is_place:
+                pn.add_arc(pn.places[source_key], pn.transitions[target_key], weight)
+            else:
+                pn.add_arc(pn.transitions[source_key], pn.places[target_key], weight)
+        
+        pn._merge_net_elements(net.items(), [el for el in net if el.tag not in ['name', 'page']])
+        
+        try:
+            pn.scale = float(pn._get_tree().find('net/toolspecific[@tool="PNLab"]/scale/text').text)
+        except:
+            pass
+    
+    def _merge_net_elements(self, attributes, elements):
+        """Sets the attributes of the net element of the tree and adds the net-level elements
+        (i. e. anything but its name and pages) read from a file."""
+        
+        net = self._get_tree().find('net')
+        for attr, value in attributes:
+            net.set(attr, value)
+        page = net.find('page')
+        for el in elements:
+            page.addprevious(el)
+    
+    @classmethod
+    def _create_empty(cls, name, task = None):
+        """Creates an empty Petri Net of this class, for nodes and arcs to be loaded into."""
+        return cls(name)
+    
+    def _get_model_state(self):
+        """Returns the state of the Petri Net model as nested tuples of plain values.
+        
+        Unlike the Petri Net itself, the state can be pickled or marshalled.
+        It is turned back into a Petri Net by BasicPetriNet._from_model_state.
+        Only the net-level elements of the tree (e. g. toolspecific) are kept,
+        nodes and arcs get new tree elements when the restored net is saved.
+        
+        If the tree has contents that the model does not keep (see _has_foreign_content),
+        the state also has the PNML of the net, which it is restored from instead.
+        """
+        
+        self.load_pages()
+        
+        # The tree may be updated when it is checked, so it is checked before its net-level elements are taken.
+        pnml = None
+        if self._has_foreign_content():
+            pnml = ET.tostring(self._update_tree().find('net'), with_tail = False)
+        
+        net = self._get_tree().find('net')
+        net_elements = tuple(ET.tostring(el, with_tail = False) for el in net
+                             if isinstance(el.tag, basestring) and el.tag not in ['name', 'page'])
+        
+        places = tuple((repr(p), p.PREFIX, p.name, p.position.x, p.position.y, p.init_marking, p.capacity)
+                       for p in self.places.itervalues())
+        transitions = tuple((repr(t), t.PREFIX, t.name, t.position.x, t.position.y, t.isHorizontal, t.rate, t.priority)
+                            for t in self.transitions.itervalues())
+        arcs = tuple((repr(arc.source), repr(arc.target), arc.weight)
+                     for p in self.places.itervalues()
+                     for arc in p._incoming_arcs.values() + p._outgoing_arcs.values())
+        
+        return (self.__class__.__name__, self.name, getattr(self, 'task', None), self.scale,
+                self._place_counter, self._transition_counter,
+                tuple(net.items()), net_elements, places, transitions, arcs, pnml)
+    
+    def _has_foreign_content(self):
+        """Returns whether the tree of the Petri Net has contents that its model does not keep: pages other than
+        the top-level one, reference nodes, or elements of nodes and arcs that the model does not build the same
+        (e. g. with contents of other tools).
+        
+        The result is kept, since editing the Petri Net does not add such contents.
+        """
+        
+        if self._foreign_content is None:
+            net = self._update_tree().find('net')
+            self._foreign_content = _has_foreign_structure(net) or self._has_foreign_elements(net.find('page'))
+        return self._foreign_content
+    
+    def _has_foreign_elements(self, page):
+        """Returns whether the top-level page has elements other than those of the nodes and arcs of the model,
+        or any of them is not the same as the model builds it. The tree must be up to date (see _update_tree)."""
+        
+        count = 0
+        for key, node in self.places.items() + self.transitions.items():
+            el = self._get_element(key)
+            if el is None or el.getparent() is not page or not _same_element(el, node._create_treeElement()):
+                return True
+            count += 1
+        
+        for p in self.places.itervalues():
+            for arc in p._incoming_arcs.values() + p._outgoing_arcs.values():
+                el = self._get_element(arc._treeElement)
+                if el is None or el.getparent() is not page or not _same_element(el, arc._create_treeElement()):
+                    return True
+                count += 1
+        
+        return len(page) != count
+    
+    @classmethod
+    def _from_model_state(cls, state):
+        """Creates a Petri Net from a state returned by _get_model_state."""
+        
+        (class_name, name, task, scale, place_counter, transition_counter,
+         net_attributes, net_elements, places, transitions, arcs, pnml) = state
+        
+        PetriNetClass = _get_class(PETRI_NET_CLASSES, '__name__', class_name)
+        
+        if pnml is not None:
+            root = ET.Element('pnml')
+            root.append(ET.fromstring(pnml))
+            return PetriNetClass.from_ElementTree(ET.ElementTree(root), name = name, PetriNetClass = PetriNetClass, task = task)[0]
+        
+        pn = PetriNetClass._create_empty(name, task)
+        pn._merge_net_elements(net_attributes, [ET.fromstring(el) for el in net_elements])
+        pn.scale = scale
+        
+        # Nodes are added directly (not with add_place/add_transition) to keep their ids.
+        for key, prefix, node_name, x, y, init_marking, capacity in places:
+            PlaceClass = _get_class(PLACE_CLASSES, 'PREFIX', prefix)
+            p = PlaceClass(node_name, Vec2(x, y), init_marking, capacity)
+            p._id = key
+            p.petri_net = pn
+            pn.places[key] = p
+        
+        for key, prefix, node_name, x, y, isHorizontal, rate, priority in transitions:
+            TransitionClass = _get_class(TRANSITION_CLASSES, 'PREFIX', prefix)
+            t = TransitionClass(node_name, Vec2(x, y), isHorizontal, rate, priority)
+            t._id = key
+            t.petri_net = pn
+            pn.transitions[key] = t
+        
+        pn._place_counter = place_counter
+        pn._transition_counter = transition_counter
+        
+        for source_key, target_key, weight in arcs:
+            if source_key in pn.places:
+                pn.add_arc(pn.places[source_key], pn.transitions[target_key], weight)
+            else:
+                pn.add_arc(pn.transitions[source_key], pn.places[target_key], weight)
+        
+        pn._foreign_content = False
+        
+        return pn
+    
+    def to_snapshot(self, pnml_data = None):
+        """Returns a compact binary snapshot of the Petri Net, which can be restored
+        without parsing PNML (see from_snapshot).
+        
+        Keyword Arguments:
+        pnml_data -- Contents of the PNML file saved along with the snapshot, if any.
+                     The snapshot is considered stale if it is restored along with different PNML contents.
+        """
+        
+        source_hash = '\0'*20
+        if pnml_data is not None:
+            source_hash = hashlib.sha1(pnml_data).digest()
+        
+        data = zlib.compress(marshal.dumps(self._get_model_state()))
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, SNAPSHOT_VERSION, source_hash, hashlib.sha1(data).digest())
+        return header + data
+    
+    def get_content_hash(self):
+        """Returns the SHA-1 (as hex) of the canonical serialisation of the Petri Net: its model state
+        without its name and task, so that copies of a rule with other names or in other tasks have the same hash.
+        
+        Such copies can be stored once, and loaded with their own name and task (see from_snapshot and from_pnml_file).
+        """
+        return _get_content_hash(self._get_model_state())
+    
+    @classmethod
+    def get_snapshot_content_hash(cls, data, pnml_data = None):
+        """Returns the hash that get_content_hash returns for the Petri Net in a snapshot, without restoring it.
+        
+        Raises an exception if the snapshot cannot be restored (see from_snapshot).
+        """
+        return _get_content_hash(cls._read_snapshot_state(data, pnml_data))
+    
+    @classmethod
+    def _read_snapshot_state(cls, data, pnml_data = None):
+        """Returns the model state in a snapshot, checking it can be restored as a Petri Net of this class (see from_snapshot)."""
+        
+        if len(data) < _SNAPSHOT_HEADER.size:
+            raise Exception('Invalid snapshot.')
+        
+        magic, version, source_hash, data_hash = _SNAPSHOT_HEADER.unpack_from(data)
+        if magic != _SNAPSHOT_MAGIC:
+            raise Exception('Invalid snapshot.')
+        if version != SNAPSHOT_VERSION:
+            raise Exception('Unsupported snapshot version: ' + str(version) + '.')
+        if pnml_data is not None and source_hash != hashlib.sha1(pnml_data).digest():
+            raise Exception('Snapshot is stale.')
+        
+        # marshal is not meant for data that may be malformed, so the snapshot is checked before it is unmarshalled.
+        data = data[_SNAPSHOT_HEADER.size:]
+        if hashlib.sha1(data).digest() != data_hash:
+            raise Exception('Snapshot is corrupt.')
+        
+        try:
+            state = marshal.loads(zlib.decompress(data))
+        except (ValueError, EOFError, TypeError, zlib.error) as e:
+            raise Exception('Invalid snapshot - ' + str(e))
+        
+        if not isinstance(state, tuple) or len(state) != 12:
+            raise Exception('Invalid snapshot.')
+        if state[0] != cls.__name__:
+            raise Exception('Snapshot contains a ' + state[0] + ' instead of a ' + cls.__name__ + '.')
+        
+        return state
+    
+    @classmethod
+    def from_snapshot(cls, data, pnml_data = None, task = None, name = None):
+        """Restores a Petri Net from a snapshot returned by to_snapshot.
+        
+        Raises an exception if the snapshot is invalid, was made by a different version of the format,
+        is not of this class or, when pnml_data is given, was not saved along with those PNML contents.
+        Callers are expected to fall back to the PNML file in any of these cases.
+        
+        Keyword Arguments:
+        pnml_data -- Contents of the PNML file the snapshot was saved with, to check it is not stale.
+        task -- Task name for planning rules, in case the task was renamed after the snapshot was made.
+        name -- Name of the Petri Net, in case it was renamed after the snapshot was made.
+        """
+        
+        state = cls._read_snapshot_state(data, pnml_data)
+        
+        if name:
+            state = (state[0], name) + state[2:]
+        
+        pn = BasicPetriNet._from_model_state(state)
+        if task and pn.task != task:
+            pn.task = task
+        
+        return pn
+    
+    def to_pnml_file(self, file_name, streaming = False):
+        """Writes the Petri Net as PNML to 'file_name', which can be a file name or a file-like object.
+        
+        The tree is written straight from the net, without copying it (see to_ElementTree).
+        
+        If streaming is True, the nodes and arcs are written one by one from the model
+        (see _to_pnml_stream), which keeps memory usage bounded for very large nets.
+        """
+        
+        if streaming:
+            self._to_pnml_stream(file_name)
+            return
+        
+        self._update_tree().write(file_name, encoding = 'utf-8', xml_declaration = True, pretty_print = True)
+    
+    def _to_pnml_stream(self, output):
+        """Writes the Petri Net as PNML with lxml's xmlfile.
+        
+        Places, transitions and arcs are written straight from the model, each element is created
+        only while it is being written, and the node and arc elements of the tree are neither used nor updated.
+        Only the net-level elements (e. g. name and toolspecific) are taken from the tree.
+        
+        As with _from_pnml_stream, reference nodes and node contents unknown to this tool are not kept:
+        all nodes and arcs are written to a single page.
+        """
+        
+        net = self._update_net_element()
+        page_id = net.find('page').get('id')
+        
+        with ET.xmlfile(output, encoding = 'UTF-8') as xf:
+            xf.write_declaration()
+            with xf.element('pnml', self._get_tree().getroot().attrib):
+                xf.write('\n')
+                with xf.element('net', net.attrib):
+                    xf.write('\n')
+                    for el in net:
+                        if el.tag != 'page':
+                            xf.write(el, pretty_print = True)
+                    
+                    with xf.element('page', {'id': page_id}):
+                        xf.write('\n')
+                        for p in self.places.itervalues():
+                            xf.write(p._create_treeElement(), pretty_print = True)
+                        
+                        for t in self.transitions.itervalues():
+                            xf.write(t._create_treeElement(), pretty_print = True)
+                        
+                        for p in self.places.itervalues():
+                            for arc in p._incoming_arcs.itervalues():
+                                xf.write(arc._create_treeElement(), pretty_print = True)
+                            for arc in p._outgoing_arcs.itervalues():
+                                xf.write(arc._create_treeElement(), pretty_print = True)
+                    xf.write('\n')
+                xf.write('\n')
+    
+    def to_pnml_string(self):
+        """Returns the Petri Net as PNML, in the same form to_pnml_file writes it."""
+        return ET.tostring(self._update_tree(), encoding = 'UTF-8', xml_declaration = True, pretty_print = True)
 
 class RulePN(BasicPetriNet):
     
@@ -588,6 +1416,10 @@ class RulePN(BasicPetriNet):
         if kwargs.pop('initialize', True):
             self._initialize()
     
+    @classmethod
+    def _create_empty(cls, name, task = None):
+        return cls(name, initialize = False)
+    
     def _initialize(self):
         self._main_transition = RuleTransition('Rule', Vec2(350, 300))
         self.add_transition(self._main_transition)
@@ -598,6 +1430,7 @@ class RulePN(BasicPetriNet):
         if self._main_transition_:
             return self._main_transition_
         
+        self.load_pages()
         for t in self.transitions.itervalues():
             if t.__class__ is RuleTransition:
                 self._main_transition_ = t
@@ -614,8 +1447,8 @@ class RulePN(BasicPetriNet):
         self._main_transition_ = val
     
     @classmethod
-    def from_pnml_file(cls, filename, task):
-        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls)
+    def from_pnml_file(cls, filename, task, **kwargs):
+        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, **kwargs)
     
     def add_arc(self, source, target, weight = 1, _treeElement = None):
         
@@ -626,6 +1459,7 @@ class RulePN(BasicPetriNet):
     
     def get_dependency_tasks(self):
         
+        self.load_pages()
         dependencies = set()
         
         for p in self.places.values():
@@ -638,6 +1472,12 @@ class RulePN(BasicPetriNet):
             dependencies.add(name)
             
         return dependencies
+    
+    def get_fact_names(self):
+        """Returns the set of names of the facts (and structured facts) used by the rule."""
+        
+        self.load_pages()
+        return set(p._get_description()[1] for p in self.places.itervalues() if isinstance(p, FactPlace))
                     
     
     def get_clips_code(self, is_cancelation = False):
@@ -657,6 +1497,7 @@ class RulePN(BasicPetriNet):
         )
         '''
         
+        self.load_pages()
         self._deleted_fact_count = 0
         self._to_delete = []
         
@@ -958,6 +1799,10 @@ class PlanningRulePN(RulePN):
         # Notice the underscore at the end.
         self._main_place_ = None
     
+    @classmethod
+    def _create_empty(cls, name, task = None):
+        return cls(name, task, initialize = False)
+    
     def _initialize(self):
         
         super(PlanningRulePN, self)._initialize()
@@ -976,6 +1821,7 @@ class PlanningRulePN(RulePN):
         if not val:
             raise Exception('Task name cannot be an empty string.')
         
+        self.load_pages()
         place = None
         for p in self.places.itervalues():
             if p.name == self.task:
@@ -995,6 +1841,7 @@ class PlanningRulePN(RulePN):
         if self._main_place_:
             return self._main_place_
         
+        self.load_pages()
         for p in self.places.itervalues():
             if p.name == self.task:
                 self._main_place_ = p
@@ -1021,8 +1868,8 @@ class PlanningRulePN(RulePN):
 class DexecPN(PlanningRulePN):
     
     @classmethod
-    def from_pnml_file(cls, filename, task):
-        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task)
+    def from_pnml_file(cls, filename, task, **kwargs):
+        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task, **kwargs)
 
 class FinalizationPN(PlanningRulePN):
     
@@ -1044,8 +1891,8 @@ class FinalizationPN(PlanningRulePN):
         super(FinalizationPN, self)._can_connect(source, target, weight)
     
     @classmethod
-    def from_pnml_file(cls, filename, task):
-        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task)
+    def from_pnml_file(cls, filename, task, **kwargs):
+        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task, **kwargs)
 
 class CancelationPN(PlanningRulePN):
     
@@ -1053,5 +1900,12 @@ class CancelationPN(PlanningRulePN):
         return super(CancelationPN, self).get_clips_code(is_cancelation = True)
     
     @classmethod
-    def from_pnml_file(cls, filename, task):
-        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task)
+    def from_pnml_file(cls, filename, task, **kwargs):
+        return BasicPetriNet.from_pnml_file(filename, PetriNetClass = cls, task = task, **kwargs)
+
+PETRI_NET_CLASSES = (BasicPetriNet,
+                     RulePN,
+                     PlanningRulePN,
+                     DexecPN,
+                     FinalizationPN,
+                     CancelationPN)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+On-disk cache of parsed PNML files.
+
+Entries are the model states of the Petri Nets read from a PNML file
+(see BasicPetriNet._get_model_state), keyed by the SHA-1 of the file contents
+and the version of the tool, so they are never used for a file that has changed
+or after upgrading. When the cache grows beyond its maximum size,
+the least recently used entries are removed.
+
+Each entry is the SHA-1 of its data followed by the marshalled and compressed states,
+so that an entry that is corrupt is detected before it is unmarshalled.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+
+from settings import __version__
+
+_ENTRY_EXTENSION = '.pnc'
+# Size of the SHA-1 at the start of each entry.
+_HASH_SIZE = 20
+# Fraction of the maximum size the cache is reduced to when it is exceeded.
+_EVICT_RATIO = 0.9
+
+class PNMLCache(object):
+    
+    def __init__(self, directory, max_size = 64*1024*1024):
+        """Creates a cache in 'directory' (created if it does not exist), which is kept under 'max_size' bytes."""
+        
+        super(PNMLCache, self).__init__()
+        
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        
+        self.directory = directory
+        self.max_size = max_size
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        # Running total of the size of the entries, so the directory is only scanned when it goes over max_size.
+        # It is None until the first entry is stored, and it is corrected whenever the directory is scanned
+        # (other processes may store entries in the same directory too).
+        self._size = None
+    
+    def get_key(self, pnml_data, *args):
+        """Returns the key for the contents of a PNML file.
+        
+        Any other arguments that change the result of reading the file (e. g. the Petri Net class)
+        must be given as well, they are included in the key as strings.
+        """
+        
+        h = hashlib.sha1(__version__)
+        for arg in args:
+            h.update('\0' + str(arg))
+        h.update('\0')
+        h.update(pnml_data)
+        
+        return h.hexdigest()
+    
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + _ENTRY_EXTENSION)
+    
+    def get(self, key):
+        """Returns the model states stored with 'key', or None if they are not in the cache."""
+        
+        path = self._get_path(key)
+        
+        try:
+            f = open(path, 'rb')
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            self.misses += 1
+            return None
+        
+        try:
+            # marshal is not meant for data that may be malformed, so the entry is checked before it is unmarshalled.
+            if hashlib.sha1(data[_HASH_SIZE:]).digest() != data[:_HASH_SIZE]:
+                raise ValueError('corrupt entry')
+            states = marshal.loads(zlib.decompress(data[_HASH_SIZE:]))
+            if not isinstance(states, list):
+                raise TypeError('entry is not a list of states')
+        except (ValueError, EOFError, TypeError, zlib.error) as e:
+            print 'WARNING: Invalid PNML cache entry was removed - ' + str(e)
+            self._remove(path)
+            self.misses += 1
+            return None
+        
+        # Entries are evicted by modification time, so a hit makes the entry the most recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        
+        self.hits += 1
+        return states
+    
+    def put(self, key, states):
+        """Stores a list of model states with 'key', evicting old entries if the cache gets too big."""
+        
+        data = zlib.compress(marshal.dumps(states))
+        data = hashlib.sha1(data).digest() + data
+        if len(data) > self.max_size:
+            return
+        
+        path = self._get_path(key)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        
+        # The entry is written to a temporary file first, so other processes never read half an entry.
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix = '.tmp', dir = self.directory)
+            f = os.fdopen(fd, 'wb')
+            f.write(data)
+            f.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            # The cache is only an optimization, so failing to write to it is not an error.
+            # (On some platforms rename also fails if another process stored the same entry first.)
+            print 'WARNING: PNML cache entry could not be written - ' + str(e)
+            if tmp_path is not None:
+                self._remove(tmp_path)
+            return
+        
+        if self._size is None:
+            self._size = self.get_size()
+        else:
+            self._size += len(data) - old_size
+        
+        if self._size > self.max_size:
+            self._evict()
+    
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    
+    def _get_entries(self):
+        """Returns a list of (modification time, size, path) of every entry in the cache."""
+        
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if not file_name.endswith(_ENTRY_EXTENSION):
+                continue
+            path = os.path.join(self.directory, file_name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        
+        return entries
+    
+    def _evict(self):
+        """Removes the least recently used entries until the cache fits in max_size.
+        
+        Entries are removed until the cache is under _EVICT_RATIO of max_size, so that the directory
+        is not scanned again on each of the following puts.
+        """
+        
+        entries = self._get_entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        self._size = size
+        if size <= self.max_size:
+            return
+        
+        target_size = int(self.max_size*_EVICT_RATIO)
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= target_size:
+                break
+            self._remove(path)
+            size -= entry_size
+            self.evictions += 1
+        
+        self._size = size
+    
+    def clear(self):
+        """Removes every entry from the cache."""
+        
+        for _, _, path in self._get_entries():
+            self._remove(path)
+        self._size = 0
+    
+    def get_size(self):
+        """Returns the size in bytes of all the entries in the cache."""
+        return sum(entry_size for _, entry_size, _ in self._get_entries())
+    
+    def get_stats(self):
+        """Returns a dictionary with the hits, misses and evictions since the cache was created,
+        and the current number of entries and size in bytes."""
+        
+        entries = self._get_entries()
+        
+        return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'size': sum(entry_size for _, entry_size, _ in entries)
+                }
+    
+    def __str__(self):
+        stats = self.get_stats()
+        return 'PNML cache: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries ({size} bytes).'.format(**stats)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+SQLite database to store projects in, as an alternative to .pnpdt files.
+
+A .pnpdt file is a zip file of zip files, so it can only be read and written as a whole.
+A project database has a row for each Petri Net instead (with its PNML contents, snapshot,
+content hash and modification time), so single nets can be read, saved and removed
+without rewriting the project. The names of the facts used by each rule and the tasks
+each rule depends on are kept in indexed tables, so they can be queried without reading the nets.
+
+Changes are made in a transaction, which is committed (or rolled back if an exception is raised)
+when the database is used as a context manager:
+
+    with db:
+        db.save_net(...)
+        db.remove_net(...)
+"""
+
+import hashlib
+import sqlite3
+import time
+
+EXTENSION = '.pnpdb'
+
+# Kinds of rules, which are the tags of the folders of the project tree they are in.
+GENERIC = 'generic'
+DEXEC = 'dexec'
+FINALIZING = 'finalizing'
+CANCELING = 'canceling'
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE tasks (
+    name TEXT PRIMARY KEY
+);
+
+CREATE TABLE nets (
+    id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pnml BLOB NOT NULL,
+    snapshot BLOB,
+    hash TEXT NOT NULL,
+    modified REAL NOT NULL,
+    UNIQUE (task, kind, name)
+);
+
+CREATE TABLE facts (
+    net_id INTEGER NOT NULL REFERENCES nets(id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+CREATE INDEX facts_name ON facts(name);
+CREATE INDEX facts_net_id ON facts(net_id);
+
+CREATE TABLE dependencies (
+    net_id INTEGER NOT NULL REFERENCES nets(id) ON DELETE CASCADE,
+    task TEXT NOT NULL
+);
+CREATE INDEX dependencies_task ON dependencies(task);
+CREATE INDEX dependencies_net_id ON dependencies(net_id);
+'''
+
+def get_content_hash(pnml_data):
+    """Returns the hash that Petri Nets with the given PNML contents are saved with."""
+    return hashlib.sha1(pnml_data).hexdigest()
+
+def _to_str(blob):
+    """Returns the contents of a BLOB column as a string (they are read as buffers)."""
+    
+    if blob is None:
+        return None
+    return str(blob)
+
+class ProjectDB(object):
+    
+    def __init__(self, path):
+        """Opens the project database in 'path', which is created if it does not exist."""
+        
+        super(ProjectDB, self).__init__()
+        
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # PNML contents and names are kept as byte strings, as they are read from .pnpdt files.
+        self.connection.text_factory = str
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 0:
+            with self.connection:
+                self.connection.executescript(_SCHEMA)
+                self.connection.execute('PRAGMA user_version = {0}'.format(_SCHEMA_VERSION))
+        elif version != _SCHEMA_VERSION:
+            self.connection.close()
+            raise Exception('Unsupported project database version: ' + str(version))
+    
+    def __enter__(self):
+        return self.connection.__enter__()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.connection.__exit__(exc_type, exc_value, traceback)
+    
+    def close(self):
+        self.connection.close()
+    
+    def get_tasks(self):
+        """Returns the sorted list of the names of the tasks in the project."""
+        
+        return [row[0] for row in self.connection.execute('SELECT name FROM tasks ORDER BY name')]
+    
+    def add_task(self, name):
+        self.connection.execute('INSERT OR IGNORE INTO tasks (name) VALUES (?)', (name,))
+    
+    def remove_task(self, name):
+        """Removes a task and all of its rules."""
+        
+        self.connection.execute('DELETE FROM nets WHERE task = ?', (name,))
+        self.connection.execute('DELETE FROM tasks WHERE name = ?', (name,))
+    
+    def get_nets(self, task = None, contents = False):
+        """Returns a list of (task, kind, name, hash, modified) tuples for the Petri Nets in the project,
+        or only for the rules of a task if it is given. Generic rules have an empty task name.
+        
+        If contents is True, the PNML contents and snapshot (or None) of each net are added to the tuples.
+        """
+        
+        columns = 'task, kind, name, hash, modified'
+        if contents:
+            columns += ', pnml, snapshot'
+        
+        query = 'SELECT ' + columns + ' FROM nets'
+        params = ()
+        if task is not None:
+            query += ' WHERE task = ?'
+            params = (task,)
+        query += ' ORDER BY task, kind, name'
+        
+        rows = self.connection.execute(query, params).fetchall()
+        if contents:
+            rows = [row[:5] + (_to_str(row[5]), _to_str(row[6])) for row in rows]
+        return rows
+    
+    def get_net(self, task, kind, name):
+        """Returns a (pnml_data, snapshot) tuple with the contents of a Petri Net, or None if it is not in the project."""
+        
+        row = self.connection.execute('SELECT pnml, snapshot FROM nets WHERE task = ? AND kind = ? AND name = ?',
+                                      (task, kind, name)).fetchone()
+        if row is None:
+            return None
+        return _to_str(row[0]), _to_str(row[1])
+    
+    def save_net(self, task, kind, name, pnml_data, snapshot = None, fact_names = (), dependencies = ()):
+        """Saves a Petri Net, replacing the one with the same task, kind and name if there is one.
+        
+        Returns False if the net was already saved with the same PNML contents, in which case it is left as it is.
+        """
+        
+        content_hash = get_content_hash(pnml_data)
+        
+        row = self.connection.execute('SELECT id, hash FROM nets WHERE task = ? AND kind = ? AND name = ?',
+                                      (task, kind, name)).fetchone()
+        
+        if row is None:
+            net_id = self.connection.execute('INSERT INTO nets (task, kind, name, pnml, snapshot, hash, modified) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                             (task, kind, name, buffer(pnml_data), buffer(snapshot) if snapshot is not None else None,
+                                              content_hash, time.time())).lastrowid
+        else:
+            net_id, old_hash = row
+            if old_hash == content_hash:
+                return False
+            self.connection.execute('UPDATE nets SET pnml = ?, snapshot = ?, hash = ?, modified = ? WHERE id = ?',
+                                    (buffer(pnml_data), buffer(snapshot) if snapshot is not None else None,
+                                     content_hash, time.time(), net_id))
+            self.connection.execute('DELETE FROM facts WHERE net_id = ?', (net_id,))
+            self.connection.execute('DELETE FROM dependencies WHERE net_id = ?', (net_id,))
+        
+        self.connection.executemany('INSERT INTO facts (net_id, name) VALUES (?, ?)',
+                                    [(net_id, fact_name) for fact_name in set(fact_names)])
+        self.connection.executemany('INSERT INTO dependencies (net_id, task) VALUES (?, ?)',
+                                    [(net_id, dependency) for dependency in set(dependencies)])
+        
+        return True
+    
+    def get_net_index(self, task, kind, name):
+        """Returns a (hash, fact_names, dependencies) tuple with the hash of the contents of a Petri Net
+        and the facts and tasks it is indexed with, or None if it is not in the project."""
+        
+        row = self.connection.execute('SELECT id, hash FROM nets WHERE task = ? AND kind = ? AND name = ?',
+                                      (task, kind, name)).fetchone()
+        if row is None:
+            return None
+        
+        net_id, content_hash = row
+        fact_names = [r[0] for r in self.connection.execute('SELECT name FROM facts WHERE net_id = ?', (net_id,))]
+        dependencies = [r[0] for r in self.connection.execute('SELECT task FROM dependencies WHERE net_id = ?', (net_id,))]
+        return content_hash, fact_names, dependencies
+    
+    def remove_net(self, task, kind, name):
+        self.connection.execute('DELETE FROM nets WHERE task = ? AND kind = ? AND name = ?', (task, kind, name))
+    
+    def find_fact(self, fact_name):
+        """Returns a list of (task, kind, name) tuples with the rules that use a fact."""
+        
+        return self.connection.execute('SELECT DISTINCT nets.task, nets.kind, nets.name FROM facts '
+                                       'JOIN nets ON nets.id = facts.net_id WHERE facts.name = ? '
+                                       'ORDER BY nets.task, nets.kind, nets.name', (fact_name,)).fetchall()
+    
+    def get_dependencies(self):
+        """Returns a sorted list of (task, dependency) tuples, with the tasks the rules of each task depend on."""
+        
+        return self.connection.execute('SELECT DISTINCT nets.task, dependencies.task FROM dependencies '
+                                       'JOIN nets ON nets.id = dependencies.net_id ORDER BY nets.task, dependencies.task').fetchall()
+    
+    def get_dependent_tasks(self, task):
+        """Returns the sorted list of tasks that have rules that depend on a task."""
+        
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT nets.task FROM dependencies '
+                                                          'JOIN nets ON nets.id = dependencies.net_id '
+                                                          'WHERE dependencies.task = ? ORDER BY nets.task', (task,))]
+    
+    def get_unmet_dependencies(self):
+        """Returns the sorted list of tasks that rules depend on, but are not in the project."""
+        
+        task_names = set()
+        for name in self.get_tasks():
+            par = name.find('(')
+            if par >= 0:
+                name = name[:par]
+            task_names.add(name)
+        
+        dependencies = set(row[0] for row in self.connection.execute('SELECT DISTINCT task FROM dependencies'))
+        
+        return sorted(dependencies - task_names)
@@ -7,6 +7,42 @@ __version__ = '0.9'
 
 _UPDATE_LABEL_OFFSET = False
 
+# On-disk cache of parsed PNML files (see pnmlcache.py), set the directory to None to disable it.
+PNML_CACHE_DIR = '~/.pnpdt/cache'
+PNML_CACHE_MAX_SIZE = 64*1024*1024
+
+# Release the XML trees of the nets after loading them, to save memory in large projects
+# (see BasicPetriNet.release_tree). The trees are rebuilt when the nets are saved.
+RELEASE_PNML_TREES = False
+
+# Only list the rules of a project when opening it, and read each of them the first time it is needed.
+LAZY_OPEN = True
+
+# Read projects in a background thread when opening them, adding their tasks and rules to the project tree
+# a few at a time (every OPEN_POLL_INTERVAL milliseconds), so that the window is not frozen until they are all read.
+BACKGROUND_OPEN = True
+OPEN_POLL_INTERVAL = 50
+
+# Copy the tasks and generic rules that were not edited from the previous project file when saving,
+# instead of serializing them again.
+INCREMENTAL_SAVE = True
+
+# Number of processes to serialize the tasks and generic rules with when saving, 0 to use one per CPU.
+# They are forked, so they are only used where fork is available (not on Windows).
+SAVE_PROCESSES = 0
+
+# Store identical Petri Nets (e. g. rules copied between tasks) once in project files, under a hash of their contents,
+# which the tasks and generic rules refer to. Disabled by default, because older versions would open such project files
+# without the shared Petri Nets, and lose them if the project is saved again.
+DEDUPLICATE_NETS = False
+
+# Seconds between writes of the edits made to the opened project to its journal (a file next to it,
+# with a .journal extension), which are recovered when the project is opened if it was not saved. 0 disables it.
+JOURNAL_INTERVAL = 5
+
+# Size in bytes above which the journal is compacted, keeping only the last state of each Petri Net.
+JOURNAL_COMPACT_SIZE = 4*1024*1024
+
 LINE_WIDTH = 2.0
     
 PLACE_RADIUS = 25
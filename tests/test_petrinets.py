@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Adrián Revuelta Cuauhtli
+
+Tests of the Petri Net model: snapshots, model states and lazily loaded pages.
+
+Run from the root of the repository with: python -m unittest discover tests
+"""
+
+import unittest
+from StringIO import StringIO
+
+import lxml.etree as ET
+
+from benchmark import build_rule_tree
+from nodes import FactPlace
+from petrinets import BasicPetriNet, RulePN, DexecPN, _remove_namespaces
+from utils import Vec2
+
+def _canonical_pnml(pnml_data):
+    """Returns the net of a PNML string with the children of each element sorted, so that nets are compared regardless of the order of their elements."""
+    
+    def canonical(el):
+        children = sorted(canonical(child) for child in el if isinstance(child.tag, basestring))
+        return (el.tag, sorted(el.attrib.items()), (el.text or '').strip(), children)
+    
+    root = _remove_namespaces(ET.parse(StringIO(pnml_data))).getroot()
+    return canonical(root.find('net'))
+
+class SnapshotTest(unittest.TestCase):
+    
+    def _load(self, et):
+        return DexecPN.from_pnml_file(StringIO(ET.tostring(et)), 'task', name = 'rule')[0]
+    
+    def _assert_round_trip(self, pn):
+        before = pn.to_pnml_string()
+        restored = DexecPN.from_snapshot(pn.to_snapshot(before), before, task = 'task', name = 'rule')
+        self.assertEqual(_canonical_pnml(before), _canonical_pnml(restored.to_pnml_string()))
+    
+    def test_round_trip(self):
+        pn = DexecPN('rule', 'task')
+        pn.add_place(FactPlace('fact', Vec2(10, 20)))
+        self._assert_round_trip(pn)
+        self._assert_round_trip(self._load(build_rule_tree(DexecPN, 20, 10, task = 'task')))
+    
+    def test_round_trip_foreign_content(self):
+        et = build_rule_tree(DexecPN, 20, 10, references = 0.5, pages = 2, task = 'task')
+        ET.SubElement(et.getroot().find('net/page'), 'toolspecific', {'tool': 'Other'}).text = 'data'
+        pn = self._load(et)
+        self._assert_round_trip(pn)
+        
+        # The PNML is also kept when the net is restored with another name and task.
+        restored = DexecPN.from_snapshot(pn.to_snapshot(), task = 'other_task', name = 'other_rule')
+        root = _remove_namespaces(ET.parse(StringIO(restored.to_pnml_string()))).getroot()
+        self.assertEqual(len(root.findall('.//page')), 2)
+        self.assertTrue(root.findall('.//referencePlace'))
+        self.assertEqual(len(root.findall(".//toolspecific[@tool='Other']")), 1)
+        self.assertEqual(restored.task, 'other_task')
+    
+    def test_generic_rule_round_trip(self):
+        pn = RulePN('rule')
+        before = pn.to_pnml_string()
+        restored = RulePN.from_pnml_file(StringIO(before), None, name = 'rule')[0]
+        self.assertEqual(len(restored.transitions), 1)
+        self.assertEqual(_canonical_pnml(before), _canonical_pnml(restored.to_pnml_string()))
+    
+    def test_invalid_snapshot(self):
+        snapshot = DexecPN('rule', 'task').to_snapshot()
+        corrupt = snapshot[:-1] + chr((ord(snapshot[-1]) + 1) % 256)
+        for data in [snapshot[:10], snapshot[:-5], corrupt]:
+            self.assertRaises(Exception, DexecPN.from_snapshot, data)
+        self.assertRaises(Exception, RulePN.from_snapshot, snapshot)
+    
+    def test_model_state(self):
+        pn = self._load(build_rule_tree(DexecPN, 20, 10, references = 0.5, pages = 2, task = 'task'))
+        before = pn.to_pnml_string()
+        restored = BasicPetriNet._from_model_state(pn._get_model_state())
+        self.assertEqual(_canonical_pnml(before), _canonical_pnml(restored.to_pnml_string()))
+
+def _get_structure(pn):
+    """Returns the names of the places of a Petri Net with the names of the transitions they are connected to and the weights of the arcs,
+    which do not depend on the order its nodes were loaded in."""
+    
+    def arcs(arcs_dict):
+        return sorted((pn.transitions[key].name, arc.weight) for key, arc in arcs_dict.iteritems())
+    
+    return sorted((p.name, arcs(p._incoming_arcs), arcs(p._outgoing_arcs)) for p in pn.places.itervalues())
+
+class LazyPagesTest(unittest.TestCase):
+    
+    def setUp(self):
+        et = build_rule_tree(DexecPN, 20, 10, references = 0.3, pages = 3, task = 'task')
+        self.pnml_data = ET.tostring(et)
+        self.eager = self._load()
+    
+    def _load(self, lazy_pages = False):
+        return DexecPN.from_pnml_file(StringIO(self.pnml_data), 'task', name = 'rule', lazy_pages = lazy_pages)[0]
+    
+    def test_load_page(self):
+        pn = self._load(lazy_pages = True)
+        self.assertEqual(pn.get_pending_pages(), ['page_1'])
+        self.assertTrue(len(pn.places) < len(self.eager.places))
+        self.assertRaises(KeyError, pn.load_page, 'page_2')
+        
+        pn.load_page('page_1')
+        self.assertEqual(pn.get_pending_pages(), ['page_2'])
+        pn.load_page('page_2')
+        self.assertEqual(pn.get_pending_pages(), [])
+        self.assertEqual(_get_structure(pn), _get_structure(self.eager))
+    
+    def test_queries_load_pending_pages(self):
+        pn = self._load(lazy_pages = True)
+        self.assertEqual(pn.get_fact_names(), self.eager.get_fact_names())
+        self.assertEqual(pn.get_pending_pages(), [])
+        
+        pn = self._load(lazy_pages = True)
+        self.assertEqual(pn.get_clips_code(), self.eager.get_clips_code())
+        self.assertEqual(_get_structure(pn), _get_structure(self.eager))
+
+if __name__ == '__main__':
+    unittest.main()